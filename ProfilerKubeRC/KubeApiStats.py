@@ -0,0 +1,97 @@
+#
+# This file contents of:
+# - KubeApiCallStats     : Tallies of kubernetes API calls by verb, resource, namespace, reconcile path and outcome
+#
+# A reconcile path is a name of the code path which makes API calls, f.e. "source-event" or "config".
+# It is kept per thread, so calls made by work queue workers are attributed to the reconcile they run
+
+import threading
+from contextlib import contextmanager
+
+NO_RECONCILE_PATH = 'other'
+
+_context = threading.local()
+
+
+class KubeApiCallStats:
+    """
+    In-process accounting of kubernetes API calls made through the engine.
+    Every call is tallied by (verb, resource, namespace, reconcile path, outcome) with its number and latency.
+    A reconcile path can have a budget of API calls. A reconcile which makes more calls is logged and counted as exceeded
+
+    :param logger: logger to report exceeded budgets
+
+    Public methods:
+        - reconcile: context manager to attribute API calls of the current thread to a reconcile path and check its budget
+        - record: add a finished API call
+        - getReconcilePath: returns the reconcile path of the current thread
+        - getCalls: returns call tallies as a list of dictionaries
+        - getReconciles: returns numbers of reconciles, their API calls and exceeded budgets by reconcile path
+    """
+
+    def __init__(self, logger=None):
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._calls = {}                # (verb, resource, namespace, path, outcome) -> [count, seconds total, seconds max]
+        self._reconciles = {}           # path -> [reconciles, calls, max calls per reconcile, exceeded budgets, budget]
+
+    @staticmethod
+    def _getFrames():
+        frames = getattr(_context, 'frames', None)
+        if frames is None:
+            frames = _context.frames = []
+        return frames
+
+    @staticmethod
+    def getReconcilePath():
+        frames = KubeApiCallStats._getFrames()
+        return frames[-1]['path'] if frames else NO_RECONCILE_PATH
+
+    @contextmanager
+    def reconcile(self, path, budget=None):
+        frame = {'path': path, 'calls': 0}
+        frames = KubeApiCallStats._getFrames()
+        frames.append(frame)
+        try:
+            yield frame
+        finally:
+            frames.pop()
+            self._finishReconcile(path, frame['calls'], budget)
+
+    def _finishReconcile(self, path, calls, budget):
+        exceeded = budget is not None and calls > budget
+        with self._lock:
+            tally = self._reconciles.setdefault(path, [0, 0, 0, 0, budget])
+            tally[0] += 1
+            tally[1] += calls
+            tally[2] = max(tally[2], calls)
+            tally[3] += 1 if exceeded else 0
+        if exceeded and self._logger is not None:
+            self._logger.warning("Reconcile %s made %d API calls, budget is %d" % (path, calls, budget))
+
+    def record(self, verb, resource, namespace, seconds, outcome):
+        frames = KubeApiCallStats._getFrames()
+        for frame in frames:
+            frame['calls'] += 1
+        key = (verb, resource, namespace, frames[-1]['path'] if frames else NO_RECONCILE_PATH, outcome)
+        with self._lock:
+            tally = self._calls.get(key)
+            if tally is None:
+                tally = self._calls[key] = [0, 0.0, 0.0]
+            tally[0] += 1
+            tally[1] += seconds
+            tally[2] = max(tally[2], seconds)
+
+    def getCalls(self):
+        with self._lock:
+            return [{
+                'verb': verb, 'resource': resource, 'namespace': namespace, 'path': path, 'outcome': outcome,
+                'count': count, 'seconds_total': seconds_total, 'seconds_max': seconds_max
+            } for (verb, resource, namespace, path, outcome), (count, seconds_total, seconds_max) in self._calls.items()]
+
+    def getReconciles(self):
+        with self._lock:
+            return {path: {
+                'reconciles': reconciles, 'calls': calls, 'calls_max': calls_max, 'budget_exceeded': exceeded, 'budget': budget
+            } for path, (reconciles, calls, calls_max, exceeded, budget) in self._reconciles.items()}
+
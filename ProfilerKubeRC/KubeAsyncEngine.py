@@ -0,0 +1,374 @@
+#
+# This file contents of:
+# - KubeAsyncRestClient        : REST client of kubernetes_asyncio with default timeouts
+# - KubeAsyncResumableWatch    : asyncio version of KubeResumableWatch
+# - KubeAsyncEngine            : AKubeEngine implementation which runs all API calls and watches on one asyncio event loop
+#
+# kubernetes_asyncio is an optional dependency. It is required only if ENGINE=asyncio
+
+import asyncio
+import threading
+import kubernetes
+
+from ProfilerKubeRC.KubeEngine import KubeEngine, kubapi_call
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeRawDecoder import KubeRawDecoder
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot
+from ProfilerKubeRC.KubeWatch import KubeResumableWatch, HTTP_STATUS_GONE
+
+try:
+    import aiohttp
+    import kubernetes_asyncio
+    from kubernetes_asyncio.client.rest import ApiException as AsyncApiException, RESTClientObject as AsyncRESTClientObject
+except ImportError:
+    kubernetes_asyncio = None
+    AsyncRESTClientObject = object
+
+
+class KubeAsyncRestClient(AsyncRESTClientObject):
+    """
+    REST client of kubernetes_asyncio.client.ApiClient tuned by KubeEngineSettings.
+    Calls without _request_timeout get API_CONNECT_TIMEOUT and API_READ_TIMEOUT instead of 5 minutes of kubernetes_asyncio.
+    aiohttp keeps connections alive and decompresses responses itself, API_COMPRESSION "none" asks for uncompressed responses.
+    The number of connections isn't limited: every watch holds its own connection
+
+    :param configuration: kubernetes_asyncio.client.Configuration
+    :param settings: KubeEngineSettings
+
+    Public methods:
+        - request: the request of RESTClientObject with default timeouts
+        - install: coroutine to replace the REST client of ApiClient with a tuned one
+    """
+
+    def __init__(self, configuration, settings):
+        super().__init__(configuration)
+        self._timeout = aiohttp.ClientTimeout(sock_connect=settings.api_connect_timeout, sock_read=settings.api_read_timeout)
+        self._compression = settings.api_compression == 'gzip'
+
+    @staticmethod
+    async def install(api_client, settings):
+        await api_client.rest_client.pool_manager.close()
+        api_client.rest_client = KubeAsyncRestClient(api_client.configuration, settings)
+        return api_client.rest_client
+
+    async def request(self, method, url, query_params=None, headers=None, body=None, post_params=None, _preload_content=True, _request_timeout=None):
+        headers = dict(headers or {})
+        if not self._compression:
+            headers.setdefault('Accept-Encoding', 'identity')
+        return await super().request(method, url, query_params, headers, body, post_params, _preload_content,
+                                     _request_timeout if _request_timeout is not None else self._timeout)
+
+
+class KubeAsyncResumableWatch(KubeResumableWatch):
+    """
+    Resumable list+watch as a coroutine for kubernetes_asyncio list functions.
+    Behaviour is the same as KubeResumableWatch: resume from the last resourceVersion, bookmarks, relist only on 410 Gone,
+    jittered backoff and read timeout to detect a dead connection
+
+    Public methods:
+        - runAsync: coroutine to run the watch loop until it is cancelled or stop_event is set
+        - getState: returns KubeWatchState
+    """
+
+    # The decoder creates an aiohttp session, so it is created in the event loop by runAsync
+    def _createDecoder(self):
+        return None
+
+    def _getRequestTimeout(self):
+        return aiohttp.ClientTimeout(sock_connect=self._settings.watch_stall_grace, sock_read=self._settings.watch_timeout + self._settings.watch_stall_grace)
+
+    async def runAsync(self, stop_event: threading.Event = None):
+        self._decoder = KubeRawDecoder() if self._raw else kubernetes_asyncio.watch.Watch()
+        self._return_type = self._decoder.get_return_type(self._list_func)
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        while not stop_event.is_set():
+            try:
+                if self._state.resource_version is None:
+                    await self._relistAsync()
+                await self._watchAsync(stop_event)
+                self._backoff.reset()
+            except AsyncApiException as e:
+                if e.status == HTTP_STATUS_GONE:
+                    self._logger.info("Watch %s: resourceVersion %s is expired, reloading the list" % (self._state.name, self._state.resource_version))
+                    self._state.expire()
+                    continue
+                await self._onFailureAsync(e)
+                self._logger.error("Watch %s: exception when calling %s: %s" % (self._state.name, self._list_func.__name__, e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._onFailureAsync(e)
+                self._logger.exception(e)
+
+    async def _onFailureAsync(self, error):
+        self._state.fail(error)
+        await asyncio.sleep(self._backoff.nextDelay())
+
+    async def _relistAsync(self):
+        if self._raw:
+            response = await self._list_func(_request_timeout=self._getRequestTimeout(), _preload_content=False, **self._kwargs)
+            try:
+                items, resource_version = self._decoder.decodeList(await response.read(), self._return_type)
+            finally:
+                response.release()
+        else:
+            result = await self._list_func(_request_timeout=self._getRequestTimeout(), **self._kwargs)
+            items, resource_version = result.items, result.metadata.resource_version
+        self._state.touch()
+        self._logger.debug("Watch %s: list is loaded at resourceVersion %s" % (self._state.name, resource_version))
+        for event in self._state.relistEvents(items, resource_version, self._return_type):
+            self._dispatch(event)
+
+    async def _watchAsync(self, stop_event):
+        self._state.reconnects += 1
+        response = await self._list_func(
+            watch=True,
+            resource_version=self._state.resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=self._settings.watch_timeout,
+            _request_timeout=self._getRequestTimeout(),
+            _preload_content=False,
+            **self._kwargs)
+        self._state.touch()
+        try:
+            while True:
+                line = await response.content.readline()
+                if not line:
+                    break
+                self._state.touch()
+                event = self._decoder.unmarshal_event(line.decode('utf8'), self._return_type)  # Watch raises ApiException on ERROR events
+                if event['type'] == 'ERROR':
+                    raise AsyncApiException(status=event['raw_object'].get('code'), reason=event['raw_object'].get('message'))
+                self._state.observe(event)
+                if event['type'] != 'BOOKMARK':
+                    self._dispatch(event)
+                if stop_event.is_set():
+                    break
+        finally:
+            response.release()
+
+
+class KubeAsyncEngine(KubeEngine):
+    """
+    Kubernetes engine on top of kubernetes_asyncio.
+    All API requests and watch streams of the application share one asyncio event loop which runs in its own thread,
+    so hundreds of watches don't need hundreds of threads: watch tasks are supervised by TasksManager in the loop.
+    Reconcilers of deployments are synchronous, they still run in the WORKERS threads of the work queue.
+    Their blocking calls of AKubeEngine submit a coroutine to the loop and wait for its result,
+    so the number of threads depends on WORKERS and not on the number of namespaces and watches.
+    Blocking calls can't be made in the loop thread, f.e. by watch callbacks, they would wait for the loop forever
+    The deployment cache and selectors are the same as in KubeEngine
+
+    :param api_client: KubeClient. Its configuration (host, certificates, token) is copied to the asyncio client
+    :param settings: KubeEngineSettings
+
+    Public methods:
+        - isAsync: returns True
+        - runCoroutine: submit a coroutine to the event loop and return concurrent.futures.Future
+        - watchDeploymentsAsync, watchAllDeploymentsAsync, watchConfigMapsAsync: coroutines to watch objects in the event loop
+        - readDeploymentAsync, listAllDeploymentsAsync, createDeploymentAsync, applyDeploymentAsync, deleteDeploymentAsync, patchDeploymentAsync, patchDeploymentScaleAsync, readConfigMapAsync, getCrdAsync,
+          listLeasesAsync, createLeaseAsync, replaceLeaseAsync, deleteLeaseAsync: coroutines of API calls
+    """
+
+    def __init__(self, api_client, settings: KubeEngineSettings = None):
+        if kubernetes_asyncio is None:
+            raise ImportError("kubernetes_asyncio package is required to run the asyncio engine")
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name='kube-asyncio-engine', daemon=True)
+        self._loop_thread.start()
+        super().__init__(api_client, settings)
+
+    def _createApis(self):
+        self._async_api_client = self._runSync(self._createAsyncApiClient())
+        self._api_appsv1 = kubernetes_asyncio.client.AppsV1Api(self._async_api_client)
+        self._api_corev1 = kubernetes_asyncio.client.CoreV1Api(self._async_api_client)
+        self._api_custom = kubernetes_asyncio.client.CustomObjectsApi(self._async_api_client)
+        self._api_coordinationv1 = kubernetes_asyncio.client.CoordinationV1Api(self._async_api_client)
+
+    # Copies configuration of the synchronous client. aiohttp session has to be created inside the event loop
+    async def _createAsyncApiClient(self):
+        configuration = kubernetes_asyncio.client.Configuration()
+        sync_configuration = self._getSyncConfiguration()
+        for attribute in ('host', 'verify_ssl', 'ssl_ca_cert', 'cert_file', 'key_file', 'proxy'):
+            setattr(configuration, attribute, getattr(sync_configuration, attribute))
+        configuration.api_key = dict(sync_configuration.api_key)
+        configuration.api_key_prefix = dict(sync_configuration.api_key_prefix)
+        configuration.connection_pool_maxsize = 0                       # no limit: every watch holds a connection
+        configuration.refresh_api_key_hook = self._refreshApiKey
+        api_client = kubernetes_asyncio.client.ApiClient(configuration)
+        await KubeAsyncRestClient.install(api_client, self._settings)
+        return api_client
+
+    # Local and in-cluster clients configure the default kubernetes configuration
+    def _getSyncConfiguration(self):
+        sync_api_client = self._getApiClient().getApiClient()
+        if sync_api_client is not None:
+            return sync_api_client.configuration
+        return kubernetes.client.Configuration.get_default_copy()
+
+    # Session tokens of EKS clients are rotated in place on the configuration of the synchronous client.
+    # Its refresh hook is run too, so an expired token is refreshed even if the token refresher is late
+    def _refreshApiKey(self, configuration):
+        sync_configuration = self._getSyncConfiguration()
+        if sync_configuration.refresh_api_key_hook is not None:
+            sync_configuration.refresh_api_key_hook(sync_configuration)
+        configuration.api_key.update(sync_configuration.api_key)
+
+    def isAsync(self):
+        return True
+
+    # aiohttp connections aren't pooled up to a limit, so the pool can't be saturated
+    def getConnectionPoolStats(self):
+        return None
+
+    def runCoroutine(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _runSync(self, coroutine):
+        if threading.current_thread() is self._loop_thread:
+            coroutine.close()
+            raise RuntimeError("Blocking API calls can't be made in the event loop of the engine, its coroutines have to be awaited")
+        return self.runCoroutine(coroutine).result()
+
+    async def createDeploymentAsync(self, deployment, namespace):
+        KubeAsyncEngine.logger.debug("Creating deployment %s in %s" % (deployment.metadata.name, namespace))
+        return self._deployment_cache.put(await self._api_appsv1.create_namespaced_deployment(namespace, deployment))
+
+    async def applyDeploymentAsync(self, deployment, namespace):
+        KubeAsyncEngine.logger.debug("Applying deployment %s in %s" % (deployment.metadata.name, namespace))
+        return self._deployment_cache.put(await self._async_api_client.call_api(**self._getApplyArguments(self._async_api_client, deployment, namespace)))
+
+    async def deleteDeploymentAsync(self, name, namespace):
+        KubeAsyncEngine.logger.debug("Deleting deployment %s in %s" % (name, namespace))
+        status = await self._api_appsv1.delete_namespaced_deployment(name, namespace)
+        self._deployment_cache.delete(name, namespace)
+        return status
+
+    async def readDeploymentAsync(self, name, namespace):
+        KubeAsyncEngine.logger.debug("Reading deployment %s in %s" % (name, namespace))
+        try:
+            deployment = KubeDeploymentSnapshot.prune(await self._api_appsv1.read_namespaced_deployment(name, namespace))
+        except AsyncApiException as e:
+            if e.status == 404:
+                self._deployment_cache.delete(name, namespace)
+            raise
+        self._deployment_cache.put(deployment)
+        return deployment
+
+    async def listAllDeploymentsAsync(self, limit=None):
+        return await self._api_appsv1.list_deployment_for_all_namespaces(
+            limit=limit, **self._getSelectorArguments(label_selector=self._settings.deployment_label_selector))
+
+    async def patchDeploymentAsync(self, name, namespace, patch_body):
+        return self._deployment_cache.put(await self._api_appsv1.patch_namespaced_deployment(name=name, namespace=namespace, body=patch_body))
+
+    async def patchDeploymentScaleAsync(self, name, namespace, patch_body):
+        return self._deployment_cache.putScale(await self._api_appsv1.patch_namespaced_deployment_scale(name=name, namespace=namespace, body=patch_body))
+
+    async def readConfigMapAsync(self, name, namespace):
+        return await self._api_corev1.read_namespaced_config_map(name=name, namespace=namespace)
+
+    async def getCrdAsync(self, crd_group, crd_version, namespace, crd_plural, name):
+        return await self._api_custom.get_namespaced_custom_object(crd_group, crd_version, namespace, crd_plural, name)
+
+    async def listLeasesAsync(self, namespace, label_selector=None):
+        return await self._api_coordinationv1.list_namespaced_lease(namespace, **self._getSelectorArguments(label_selector=label_selector))
+
+    async def createLeaseAsync(self, lease, namespace):
+        return await self._api_coordinationv1.create_namespaced_lease(namespace, lease)
+
+    async def replaceLeaseAsync(self, name, namespace, lease):
+        return await self._api_coordinationv1.replace_namespaced_lease(name, namespace, lease)
+
+    async def deleteLeaseAsync(self, name, namespace, body=None):
+        return await self._api_coordinationv1.delete_namespaced_lease(name, namespace, body=body)
+
+    @kubapi_call('create', 'deployments')
+    def createDeployment(self, deployment, namespace):
+        return self._runSync(self.createDeploymentAsync(deployment, namespace))
+
+    @kubapi_call('apply', 'deployments')
+    def applyDeployment(self, deployment, namespace):
+        return self._runSync(self.applyDeploymentAsync(deployment, namespace))
+
+    @kubapi_call('delete', 'deployments')
+    def deleteDeployment(self, name, namespace):
+        return self._runSync(self.deleteDeploymentAsync(name, namespace))
+
+    @kubapi_call('get', 'deployments')
+    def readDeployment(self, name, namespace):
+        return self._runSync(self.readDeploymentAsync(name, namespace))
+
+    @kubapi_call('list', 'deployments')
+    def listAllDeployments(self, limit=None):
+        return self._runSync(self.listAllDeploymentsAsync(limit))
+
+    @kubapi_call('patch', 'deployments')
+    def patchDeployment(self, name, namespace, patch_body):
+        return self._runSync(self.patchDeploymentAsync(name, namespace, patch_body))
+
+    @kubapi_call('patch', 'deployments/scale')
+    def patchDeploymentScale(self, name, namespace, patch_body):
+        return self._runSync(self.patchDeploymentScaleAsync(name, namespace, patch_body))
+
+    @kubapi_call('get', 'configmaps')
+    def readConfigMap(self, name, namespace):
+        return self._runSync(self.readConfigMapAsync(name, namespace))
+
+    @kubapi_call('get', 'customobjects')
+    def getCrd(self, crd_group, crd_version, namespace, crd_plural, name):
+        return self._runSync(self.getCrdAsync(crd_group, crd_version, namespace, crd_plural, name))
+
+    @kubapi_call('list', 'leases')
+    def listLeases(self, namespace, label_selector=None):
+        return self._runSync(self.listLeasesAsync(namespace, label_selector))
+
+    @kubapi_call('create', 'leases')
+    def createLease(self, lease, namespace):
+        return self._runSync(self.createLeaseAsync(lease, namespace))
+
+    @kubapi_call('update', 'leases')
+    def replaceLease(self, name, namespace, lease):
+        return self._runSync(self.replaceLeaseAsync(name, namespace, lease))
+
+    @kubapi_call('delete', 'leases')
+    def deleteLease(self, name, namespace, body=None):
+        return self._runSync(self.deleteLeaseAsync(name, namespace, body))
+
+    # Blocking versions are kept for AKubeEngine compatibility. Listeners use the coroutines
+    def watchDeployments(self, namespace, callback=None, field_selector=None, label_selector=None, stop_event=None):
+        self._runSync(self.watchDeploymentsAsync(namespace, callback, field_selector, label_selector, stop_event))
+
+    def watchAllDeployments(self, callback=None, namespaces=None, stop_event=None):
+        self._runSync(self.watchAllDeploymentsAsync(callback, namespaces, stop_event))
+
+    def watchConfigMaps(self, namespace, callback=None, field_selector=None):
+        self._runSync(self.watchConfigMapsAsync(namespace, callback, field_selector))
+
+    async def watchDeploymentsAsync(self, namespace, callback=None, field_selector=None, label_selector=None, stop_event=None):
+        KubeAsyncEngine.logger.debug("Deployments watcher has been started")
+        selectors = self._getSelectorArguments(field_selector, label_selector)
+        name = self._getWatchName('deployments', namespace, selectors)
+        await self._runWatchAsync(self._api_appsv1.list_namespaced_deployment, self._getDeploymentEventHandler(callback, name), name,
+                                  stop_event, raw=self._isRawDecoder(), namespace=namespace, **selectors)
+
+    async def watchAllDeploymentsAsync(self, callback=None, namespaces=None, stop_event=None):
+        KubeAsyncEngine.logger.debug("Cluster deployments watcher has been started")
+        selectors = self._getSelectorArguments(label_selector=self._settings.deployment_label_selector)
+        name = self._getWatchName('deployments', '*', selectors)
+        await self._runWatchAsync(self._api_appsv1.list_deployment_for_all_namespaces, self._getDeploymentEventHandler(callback, name, namespaces), name,
+                                  stop_event, raw=self._isRawDecoder(), **selectors)
+
+    async def watchConfigMapsAsync(self, namespace, callback=None, field_selector=None):
+        KubeAsyncEngine.logger.debug("Configmaps watcher has been started")
+        selectors = self._getSelectorArguments(field_selector=field_selector)
+        await self._runWatchAsync(self._api_corev1.list_namespaced_config_map, self._getConfigMapEventHandler(callback),
+                                  self._getWatchName('configmaps', namespace, selectors), None, namespace=namespace, **selectors)
+
+    async def _runWatchAsync(self, list_func, callback, name, stop_event=None, raw=False, **kwargs):
+        resumable_watch = KubeAsyncResumableWatch(list_func, callback, self._settings, KubeAsyncEngine.logger, name, raw=raw, **kwargs)
+        self._watches[name] = resumable_watch
+        try:
+            await resumable_watch.runAsync(stop_event)
+        finally:
+            self._forgetWatch(name, resumable_watch)
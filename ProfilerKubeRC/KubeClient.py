@@ -1,9 +1,15 @@
 # from __future__ import annotations
+import socket
+import threading
+import time
 from abc import ABC, abstractmethod
 import kubernetes.client
+import urllib3
 from dependency_injector.wiring import inject, Provide
+from kubernetes.client.rest import RESTClientObject
 
 from ProfilerKubeRC.KubeEKSClusterInfo import KubeEKSClusterInfo
+from ProfilerKubeRC.KubeWatch import KubeBackoff
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 
@@ -37,12 +43,90 @@ class KubeClientConfig:
         return self._configuration
 
 
+class KubeRestClient(RESTClientObject):
+    """
+    REST client of kubernetes.client.ApiClient tuned by KubeEngineSettings.
+    - The connection pool has API_POOL_SIZE connections, idle connections are kept alive by TCP keepalive and reused by next requests
+    - Calls without _request_timeout get API_CONNECT_TIMEOUT and API_READ_TIMEOUT, so a hung request can't block its caller forever
+    - API calls and lists ask for gzip responses if API_COMPRESSION is "gzip". Watch streams are read without decoding and aren't compressed
+    Requests which find all pooled connections busy open an extra connection. They are counted as saturated,
+    extra connections which can't be returned to the full pool are counted as discarded
+
+    :param configuration: kubernetes.client.Configuration
+    :param settings: KubeEngineSettings
+
+    Public methods:
+        - request: the request of RESTClientObject with default timeouts and compression
+        - getPoolStats: returns the pool size, connections in use, opened connections, requests, saturated requests and discarded connections
+        - install: replace the REST client of ApiClient with a tuned one
+    """
+
+    def __init__(self, configuration, settings):
+        super().__init__(configuration, maxsize=settings.api_pool_size)
+        self._maxsize = settings.api_pool_size
+        self._timeout = (settings.api_connect_timeout, settings.api_read_timeout)
+        self._compression = settings.api_compression == 'gzip'
+        self._lock = threading.Lock()
+        self._saturated = 0
+        self._discarded = 0
+        self.pool_manager.connection_pool_kw['socket_options'] = urllib3.connection.HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        self.pool_manager.pool_classes_by_scheme = {scheme: self._createPoolClass(pool_class)
+                                                    for scheme, pool_class in self.pool_manager.pool_classes_by_scheme.items()}
+
+    @staticmethod
+    def install(api_client, settings):
+        api_client.rest_client.pool_manager.clear()
+        api_client.rest_client = KubeRestClient(api_client.configuration, settings)
+        return api_client.rest_client
+
+    # Pool classes of urllib3 which count requests without a free connection and connections which don't fit into the pool
+    def _createPoolClass(self, pool_class):
+        rest_client = self
+
+        class KubeCountingPool(pool_class):
+            def _get_conn(self, timeout=None):
+                if self.pool is not None and self.pool.empty():
+                    rest_client._count('_saturated')
+                return super()._get_conn(timeout)
+
+            def _put_conn(self, conn):
+                if self.pool is not None and self.pool.full():
+                    rest_client._count('_discarded')
+                super()._put_conn(conn)
+        return KubeCountingPool
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def request(self, method, url, query_params=None, headers=None, body=None, post_params=None, _preload_content=True, _request_timeout=None):
+        headers = dict(headers or {})
+        if self._compression and not any(key == 'watch' and value for key, value in query_params or ()):
+            headers.setdefault('Accept-Encoding', 'gzip')
+        return super().request(method, url, query_params, headers, body, post_params, _preload_content,
+                               _request_timeout if _request_timeout is not None else self._timeout)
+
+    def getPoolStats(self):
+        pools = [pool for pool in (self.pool_manager.pools.get(key) for key in self.pool_manager.pools.keys()) if pool is not None]
+        with self._lock:
+            return {
+                'size': self._maxsize,
+                'in_use': sum(max(0, pool.pool.maxsize - pool.pool.qsize()) for pool in pools if pool.pool is not None),
+                'connections': sum(pool.num_connections for pool in pools),
+                'requests': sum(pool.num_requests for pool in pools),
+                'saturated': self._saturated,
+                'discarded': self._discarded
+            }
+
+
 class KubeClient:
     """
     Manage kubernetes client. Abstract class
 
     Public methods:
     - getApiClient(): returns kubernetes.client.ApiClient for executing  API request
+    - needsTokenRefresh(): returns True if runTokenRefresher has to be run as a task
     """
 
     def __init__(self):
@@ -56,6 +140,10 @@ class KubeClient:
     def getApiClient(self) -> kubernetes.client.ApiClient:
         pass
 
+    # Clients with expiring tokens rotate them by a background task
+    def needsTokenRefresh(self):
+        return False
+
 
 class KubeLocalClient(KubeClient):
     """
@@ -90,30 +178,80 @@ class KubeInclusterClient(KubeClient):
 
 class KubeEKSClient(KubeClient):
     """
-    Kubernetes client to work with EKS under an assumed role
+    Kubernetes client to work with EKS under an assumed role.
+    The client and its connections are created once. The bearer token is rotated in place on its configuration:
+    by runTokenRefresher ahead of expiry and, if the refresher is late, by the first request which finds the token expired
+
+    :param cluster_name: name of the EKS cluster
+    :param region_name: AWS region of the cluster
+    :param lag: seconds before expiry when the token is refreshed
+    :param token_source: (optional) function which returns a new token as eks_token.get_token does
+    :param endpoint_attempts: (optional) attempts to describe the cluster endpoint before the client fails to start
+
     Public methods:
     - getApiClient(): returns kubernetes.client.ApiClient for executing  API request
+    - needsTokenRefresh(): returns True, the token refresher has to be run as a task
+    - runTokenRefresher(): rotate the token ahead of expiry until stop_event is set
     """
 
-    def __init__(self, cluster_name, region_name='us-east-1', lag=60):
+    def __init__(self, cluster_name, region_name='us-east-1', lag=60, token_source=None, endpoint_attempts=5):
         super().__init__()
         self._logger.debug("Initializing EKS cluster")
-        self._cluster = KubeEKSClusterInfo(cluster_name, region_name, lag)
+        self._cluster = KubeEKSClusterInfo(cluster_name, region_name, lag, token_source)
         self._logger.debug(self._cluster)
-        self._refreshSessionToken()
+        self._config = KubeClientConfig(self._resolveEndpoint(endpoint_attempts), self._getAuthorizationType())
+        self._config.getConfiguration().refresh_api_key_hook = self._refreshExpiredToken
+        self._updateSessionToken()
+        self._api_client = kubernetes.client.ApiClient(self._config.getConfiguration())
 
     def getApiClient(self) -> kubernetes.client.ApiClient:
-        if self._cluster.isTokenExpired():
-            self._refreshSessionToken()
         return self._api_client
 
-    def _refreshSessionToken(self):
-        config = KubeClientConfig(self._cluster.getEndpoint(), self._getAuthorizationType())
-        self._api_client = kubernetes.client.ApiClient(config.setSessionToken(self._cluster.getSessionToken()))
+    def needsTokenRefresh(self):
+        return True
+
+    # The token is refreshed time_lag seconds before expiry, so requests never send an expired token.
+    # A refresh is checked by the new token with a cheap request which also keeps pooled connections warm
+    def runTokenRefresher(self, stop_event: threading.Event = None):
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        backoff = KubeBackoff(1.0, 30.0)
+        while not stop_event.wait(max(0.0, self._cluster.getSecondsToRefresh())):
+            try:
+                self._updateSessionToken()
+                self._pingApiServer()
+                backoff.reset()
+            except Exception as e:
+                self._logger.error("Session token of cluster %s can't be refreshed: %s" % (self._cluster.getEndpoint(), e))
+                stop_event.wait(backoff.nextDelay())
+
+    # The configuration is shared by all requests for the life of the process, so it is never built without the endpoint.
+    # The last error is raised if the cluster can't be described by all attempts
+    def _resolveEndpoint(self, attempts):
+        backoff = KubeBackoff(1.0, 30.0)
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._cluster.getEndpoint()
+            except Exception as e:
+                self._logger.error("Endpoint of cluster can't be described, attempt %d of %d: %s" % (attempt, attempts, e))
+                if attempt == attempts:
+                    raise
+                time.sleep(backoff.nextDelay())
+
+    def _updateSessionToken(self):
+        self._config.setSessionToken(self._cluster.getSessionToken())
+
+    # Hook of the configuration which is called by every request before it reads the token
+    def _refreshExpiredToken(self, configuration):
+        if self._cluster.isTokenExpired():
+            self._updateSessionToken()
+
+    def _pingApiServer(self):
+        version = kubernetes.client.VersionApi(self._api_client).get_code()
+        self._logger.debug("Session token is refreshed, API server %s responds" % version.git_version)
 
     def _getAuthorizationType(self) -> str:
         return 'Bearer'
-    
+
 
 class AKubeClientFabric(ABC):
     """
@@ -1,8 +1,9 @@
 import yaml
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 from dependency_injector.wiring import inject, Provide
 from ProfilerKubeRC import KubeEngine
-from ProfilerKubeRC.KubeDeployment import DeploymentConfigDto
+from ProfilerKubeRC.KubeConfigModel import OperatorConfig, DeploymentConfig, ConfigError, YamlLoader
 from ProfilerKubeRC.container import EngineContainer
 from ProfilerKubeRC.logger import LoggerContainer, SLogger
 from ProfilerKubeRC.KubeEventListener import KubeEventHandlerInterface
@@ -10,11 +11,18 @@ from ProfilerKubeRC.KubeEventListener import KubeEventHandlerInterface
 class KubeConfigMap(KubeEventHandlerInterface):
     """
     Handles configmap objects. At present this class uses to parse configuration from configmap object
+    Parsed values are cached by resourceVersion of the configmap, so a value of one version is parsed only once.
+    Cached values are shared between callers and must not be changed. The configuration of deployments is frozen OperatorConfig
     :param name: name of deployment
     :param namespace: working kubernetes namespace
     :param type: type of configmap data
 
     Public methods:
+        - refresh: Read the configmap from kubernetes API
+        - setContent: Use a configmap object from a watch event as the current content without reading it again
+        - getConfigurationValue: Parsed value of a configmap variable
+        - getDeploymentsConfig: Validated configuration of deployments in a configmap variable. None if it is missing or invalid
+        - diffDeployments: Added, removed and changed deployments between two versions of the configmap
         - update: Not used yet. In future it have to generate deployment event
 
     Private methods:
@@ -27,6 +35,7 @@ class KubeConfigMap(KubeEventHandlerInterface):
         self._namespace = namespace
         self._type = type
         self._data = ''
+        self._parsed = OrderedDict()            # (resourceVersion, variable, format) -> parsed value
         self.refresh()
 
     @inject
@@ -40,6 +49,13 @@ class KubeConfigMap(KubeEventHandlerInterface):
     def refresh(self):
         self._data = self._kube_engine.readConfigMap(self._name, self._namespace)
 
+    # Returns False if the object has the same resourceVersion as the current content, f.e. the initial list of the watch
+    def setContent(self, configmap):
+        if self._data and self._data.metadata.resource_version == configmap.metadata.resource_version:
+            return False
+        self._data = configmap
+        return True
+
     def getContent(self):
         return self._data
 
@@ -52,23 +68,49 @@ class KubeConfigMap(KubeEventHandlerInterface):
     def update(self, event):
         pass
 
+    def getWatchedNames(self):
+        return [self._name]
+
     def getConfigurationData(self):
         return self._data.data
 
     def getConfigurationValue(self, variable, config_data=None):
+        return self._getParsedValue(variable, config_data, 'yaml', lambda value: yaml.load(value, Loader=YamlLoader))
+
+    # Parsed by the C loader of PyYAML and validated once per version of the configmap
+    def getDeploymentsConfig(self, variable, config_data=None) -> OperatorConfig:
+        return self._getParsedValue(variable, config_data, 'model', OperatorConfig.parse)
+
+    def _getParsedValue(self, variable, config_data, value_format, parse):
         if config_data is None:
             config_data = self._data
         try:
-            value = config_data.data[variable]
+            key = (config_data.metadata.resource_version, variable, value_format)
+            if key[0] is not None and key in self._parsed:
+                return self._parsed[key]
+            value = (config_data.data or {}).get(variable)
             if value is None:
                 self._logger.warning("Variable %s is not found in the configmap" % variable)
                 return None
             if self._type == 'yaml':
-                return yaml.safe_load(value)
+                value = parse(value)
+            self._cacheValue(key, value)
+            return value
+        except ConfigError as e:
+            self._logger.error("Configuration %s in the configmap %s is invalid: %s" % (variable, self._name, e))
+            return None
         except Exception as e:
             self._logger.exception(e)
             return None
 
+    # Values of the current and the previous versions are enough to diff configurations
+    def _cacheValue(self, key, value):
+        if key[0] is None:
+            return
+        self._parsed[key] = value
+        while len(self._parsed) > 4:
+            self._parsed.popitem(last=False)
+
     def eventHandler(self, event):
         try:
             self._logger.debug("Running configmap event handler")
@@ -77,35 +119,22 @@ class KubeConfigMap(KubeEventHandlerInterface):
         except Exception as e:
             print(e)
 
-    def diffConfig(self, old_config, key) -> [DeploymentConfigDto]:
-        old_config_data = self.getConfigurationValue(key, old_config)
-        current_config_data = self.getConfigurationValue(key)
-        change_list = []
-        for ns, ns_config in current_config_data.items():
-            if old_config_data.get(ns, None) is not None:
-                for deployment_name, deployment_value in ns_config.get('deployments', {}).items():
-                    if old_config_data[ns].get('deployments', None) is not None and old_config_data[ns]['deployments'].get(deployment_name, None) is not None:
-                        if deployment_value != old_config_data[ns]['deployments'].get(deployment_name):
-                            self._logger.info(
-                                "Configuration for %s in %s namespace has been changed" % (deployment_name, ns))
-                            change_list.append(DeploymentConfigDto(deployment_name, deployment_value))
-                        else:
-                            self._logger.debug(
-                                "Configuration for %s in %s namespace has not been changed" % (deployment_name, ns))
-                    else:
-                        self._logger.error(
-                            "Deploy %s is not found in configuration. Deploy can't be removed from configiration" % deployment_name)
-            else:
-                self._logger.error(
-                    "Namespace %s is not found in configuration. Namespace can't be modified in configiration" % ns)
-        return change_list
-
-    def getConfigData(self, key):
-        current_config_data = self.getConfigurationValue(key)
-        config_data = []
-        for ns, ns_config in current_config_data.items():
-            for deployment_name, deployment_value in ns_config.get('deployments', {}).items():
-                config_data.append(DeploymentConfigDto(deployment_name, deployment_value))
-        return config_data
-
-
+    # Changed configurations of deployments which are configured in both versions
+    def diffConfig(self, old_config, key) -> [DeploymentConfig]:
+        return self.diffDeployments(old_config, key)[2]
+
+    # Compares deployments of the old and the current configuration by namespace and name
+    # Returns lists of added, removed and changed deployments. Deployments without changes aren't returned
+    def diffDeployments(self, old_config, key) -> ([DeploymentConfig], [DeploymentConfig], [DeploymentConfig]):
+        current_config = self.getDeploymentsConfig(key) or OperatorConfig()
+        added, removed, changed = current_config.diff(self.getDeploymentsConfig(key, old_config))
+        for deployment in added:
+            self._logger.info("Deployment %s in %s namespace has been added to configuration" % (deployment.name, deployment.namespace))
+        for deployment in removed:
+            self._logger.info("Deployment %s in %s namespace has been removed from configuration" % (deployment.name, deployment.namespace))
+        for deployment in changed:
+            self._logger.info("Configuration for %s in %s namespace has been changed" % (deployment.name, deployment.namespace))
+        return added, removed, changed
+
+    def getConfigData(self, key) -> [DeploymentConfig]:
+        return (self.getDeploymentsConfig(key) or OperatorConfig()).getDeployments()
@@ -0,0 +1,209 @@
+#
+# This file contents of:
+# - ConfigError       : Error of validation of the configuration
+# - DeploymentConfig  : Frozen configuration of the clone of one deployment
+# - OperatorConfig    : Frozen configuration of all managed deployments by namespace and name
+#
+# The configuration is parsed and validated once per version of the configmap. Entries are compared by value,
+# so versions of the configuration are diffed without parsing them again
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:                                 # PyYAML without libyaml bindings
+    from yaml import SafeLoader as YamlLoader
+
+DEPLOYMENT_KEYS = ('scale_factor', 'name_suffix', 'image', 'cloned_image', 'env')
+
+
+class ConfigError(ValueError):
+    """
+    The configuration doesn't match the schema. The message lists all found problems
+    """
+
+
+class DeploymentConfig:
+    """
+    Configuration of the clone of one deployment. Values are converted to their types at load time and can't be changed
+
+    :param namespace: namespace of the source deployment
+    :param name: name of the source deployment
+    :param name_suffix: suffix of the name of the clone
+    :param scale_factor: (float) number of replicas of the clone = number of replicas of the source * scale_factor
+    :param image: (optional) image of the clone instead of the image of the source
+    :param env: tuple of (name, value) pairs of environment variables to add to the clone
+
+    Public methods:
+        - fromDict: validate a "deployments" item of the configmap and build the configuration
+        - getKey: returns "namespace/name"
+    """
+    __slots__ = ('namespace', 'name', 'name_suffix', 'scale_factor', 'image', 'env')
+
+    def __init__(self, namespace, name, name_suffix, scale_factor, image=None, env=()):
+        object.__setattr__(self, 'namespace', namespace)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'name_suffix', name_suffix)
+        object.__setattr__(self, 'scale_factor', scale_factor)
+        object.__setattr__(self, 'image', image)
+        object.__setattr__(self, 'env', tuple(env))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DeploymentConfig is frozen")
+
+    def __delattr__(self, name):
+        raise AttributeError("DeploymentConfig is frozen")
+
+    def _values(self):
+        return self.namespace, self.name, self.name_suffix, self.scale_factor, self.image, self.env
+
+    def __eq__(self, other):
+        return isinstance(other, DeploymentConfig) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return 'DeploymentConfig(%s)' % ', '.join('%s=%r' % (slot, getattr(self, slot)) for slot in DeploymentConfig.__slots__)
+
+    def getKey(self):
+        return '%s/%s' % (self.namespace, self.name)
+
+    @classmethod
+    def fromDict(cls, namespace, name, body):
+        errors = []
+        prefix = '%s/%s' % (namespace, name)
+        if not isinstance(body, dict):
+            raise ConfigError('%s: configuration has to be a mapping' % prefix)
+        unknown = sorted(str(key) for key in body if key not in DEPLOYMENT_KEYS)
+        if unknown:
+            errors.append('%s: unknown keys %s' % (prefix, ', '.join(unknown)))
+        scale_factor = cls._parseScaleFactor(body.get('scale_factor'), prefix, errors)
+        name_suffix = body.get('name_suffix')
+        if name_suffix is None or str(name_suffix).strip() == '':
+            errors.append('%s: name_suffix is required' % prefix)
+        image = body.get('image')
+        if body.get('cloned_image') is not None:                    # the old name of "image"
+            if image is not None and image != body['cloned_image']:
+                errors.append('%s: image and cloned_image are different' % prefix)
+            image = body['cloned_image']
+        env = cls._parseEnv(body.get('env'), prefix, errors)
+        if errors:
+            raise ConfigError('; '.join(errors))
+        return cls(namespace, name, str(name_suffix).strip(), scale_factor, str(image) if image is not None else None, env)
+
+    @staticmethod
+    def _parseScaleFactor(value, prefix, errors):
+        if value is None:
+            errors.append('%s: scale_factor is required' % prefix)
+            return None
+        try:
+            scale_factor = float(value)
+        except (TypeError, ValueError):
+            errors.append('%s: scale_factor has to be a number, got %r' % (prefix, value))
+            return None
+        if scale_factor < 0:
+            errors.append('%s: scale_factor has to be positive or 0, got %s' % (prefix, value))
+        return scale_factor
+
+    # "NAME: value" as in the configmap examples or a mapping of names to values
+    @staticmethod
+    def _parseEnv(value, prefix, errors):
+        if value is None:
+            return ()
+        if isinstance(value, dict):
+            return tuple((str(name), str(item)) for name, item in value.items())
+        if isinstance(value, str) and ':' in value:
+            name, item = value.split(':', 1)
+            if name.strip():
+                return ((name.strip(), item.strip()),)
+        errors.append('%s: env has to be "NAME: value" or a mapping, got %r' % (prefix, value))
+        return ()
+
+
+class OperatorConfig:
+    """
+    Configuration of all managed deployments. It is built once per version of the configmap and can't be changed
+
+    :param deployments: DeploymentConfig objects
+    :param namespaces: (optional) configured namespaces, including namespaces without deployments
+
+    Public methods:
+        - parse: parse YAML text by the C loader of PyYAML and validate it
+        - fromDict: validate parsed configuration
+        - getDeployment: returns DeploymentConfig by namespace and name or None
+        - getDeployments: returns all DeploymentConfig objects
+        - getNamespaces: returns configured namespaces
+        - diff: returns added, removed and changed deployments since the old configuration
+    """
+    __slots__ = ('_deployments', '_namespaces')
+
+    def __init__(self, deployments=(), namespaces=()):
+        items = {(deployment.namespace, deployment.name): deployment for deployment in deployments}
+        object.__setattr__(self, '_deployments', items)
+        object.__setattr__(self, '_namespaces', tuple(sorted(set(namespaces) | {namespace for namespace, name in items})))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("OperatorConfig is frozen")
+
+    def __eq__(self, other):
+        return isinstance(other, OperatorConfig) and self._namespaces == other._namespaces and self._deployments == other._deployments
+
+    def __hash__(self):
+        return hash((self._namespaces, frozenset(self._deployments.values())))
+
+    def __len__(self):
+        return len(self._deployments)
+
+    @classmethod
+    def parse(cls, text):
+        try:
+            data = yaml.load(text, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            raise ConfigError('configuration is not valid YAML: %s' % e)
+        return cls.fromDict(data)
+
+    @classmethod
+    def fromDict(cls, data):
+        if data is None:
+            return cls()
+        if not isinstance(data, dict):
+            raise ConfigError('configuration has to be a mapping of namespaces')
+        errors, deployments = [], []
+        for namespace, namespace_config in data.items():
+            namespace_config = namespace_config if namespace_config is not None else {}
+            if not isinstance(namespace_config, dict):
+                errors.append('%s: namespace configuration has to be a mapping' % namespace)
+                continue
+            unknown = sorted(str(key) for key in namespace_config if key != 'deployments')
+            if unknown:
+                errors.append('%s: unknown keys %s' % (namespace, ', '.join(unknown)))
+            items = namespace_config.get('deployments') or {}
+            if not isinstance(items, dict):
+                errors.append('%s: deployments have to be a mapping' % namespace)
+                continue
+            for name, body in items.items():
+                try:
+                    deployments.append(DeploymentConfig.fromDict(str(namespace), str(name), body))
+                except ConfigError as e:
+                    errors.append(str(e))
+        if errors:
+            raise ConfigError('; '.join(errors))
+        return cls(deployments, [str(namespace) for namespace in data])
+
+    def getDeployment(self, namespace, name) -> DeploymentConfig:
+        return self._deployments.get((namespace, name))
+
+    def getDeployments(self) -> [DeploymentConfig]:
+        return list(self._deployments.values())
+
+    def getNamespaces(self):
+        return list(self._namespaces)
+
+    # Entries are frozen and compared by value, so only changed deployments are returned
+    def diff(self, old) -> ([DeploymentConfig], [DeploymentConfig], [DeploymentConfig]):
+        old_deployments = old._deployments if old is not None else {}
+        added = [deployment for key, deployment in self._deployments.items() if key not in old_deployments]
+        removed = [deployment for key, deployment in old_deployments.items() if key not in self._deployments]
+        changed = [deployment for key, deployment in self._deployments.items() if key in old_deployments and old_deployments[key] != deployment]
+        return added, removed, changed
@@ -6,41 +6,30 @@
 # - KubeDeploymentManager           : Class with methods for reading, writing and managing object
 # - KubeDeploymentWithClone         : Class with its clone
 # - AKubeDeployment                 : Set of public interfaces with abstract methods to work with a deploy object
-# - DeploymentConfigDto             : Object with configuring properties for the deployment
 # - KubeDeploymentTemplates         : Set templates to patching deployment object
 
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from copy import deepcopy
 from dependency_injector.wiring import inject, Provide
 from math import ceil
-from kubernetes.client import V1Deployment
+from kubernetes.client import V1Deployment, V1EnvVar
 
+from ProfilerKubeRC.KubeConfigModel import DeploymentConfig
 from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
 from ProfilerKubeRC.KubeEventListener import KubeEventHandlerInterface
-from ProfilerKubeRC.container import EngineContainer
+from ProfilerKubeRC.KubePredicates import DESIRED_HASH_ANNOTATION
+from ProfilerKubeRC.KubeRawDecoder import KubeRawObject
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot
+from ProfilerKubeRC.container import EngineContainer, MetricsContainer
+from ProfilerKubeRC.metrics import MetricsRegistry
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 from ProfilerKubeRC.KubeDeploymentTemplates import KubeDeploymentTemplates
 
 
-class DeploymentConfigDto:
-    """
-    DTO object to exchange information about configuration of clone of the deployment object.
-    Is filling some static default values within initialization.
-
-    :param name: String: name of deployment
-    :param body: Dict: configuration paremeters for deployment
-
-    Public methods:
-        - getConfiguration(): returns configuration object for client
-        - setClusterEndpoint(): update cluster endpoint for API
-        - setSessionToken(): update client session token
-
-    """
-    def __init__(self, name, body):
-        self.name = name
-        self.body = body
-
-
 class AKubeDeployment(ABC):
     """
     Base abstract class to wrap Kubernetes deployment object.
@@ -49,7 +38,7 @@ class AKubeDeployment(ABC):
     Public methods:
         - getName: This method returns name of this wrapper object
         - readDeployment: This method reading deployment object into this class
-        - getDeployment: This method returns wrapped deployment object as kubernetes.client.V1Deployment
+        - getDeployment: This method returns the snapshot of wrapped deployment as KubeDeploymentSnapshot
         - setDeployment(new_deployment): Set wrapped deployment object with new_deployment
     """
 
@@ -58,7 +47,7 @@ class AKubeDeployment(ABC):
         pass
 
     @abstractmethod
-    def readDeployment(self) -> V1Deployment:
+    def readDeployment(self) -> KubeDeploymentSnapshot:
         pass
 
     @abstractmethod
@@ -81,10 +70,11 @@ class KubeDeployment(AKubeDeployment):
 
     Public methods:
         - getName: This method returns name of this wrapper object
+        - getKey: This method returns "namespace/name" key of this wrapper object
         - readDeployment: This method reading deployment object into this class
         - getDeploymentName: This method returns name of wrapped deployment
         - setDeploymentName: This method changes name of wrapped deployment
-        - getDeployment: This method returns wrapped deployment object as kubernetes.client.V1Deployment
+        - getDeployment: This method returns the snapshot of wrapped deployment as KubeDeploymentSnapshot
         - setDeployment(new_deployment): Set wrapped deployment object with new_deployment
     """
 
@@ -92,7 +82,8 @@ class KubeDeployment(AKubeDeployment):
         self._name = name                           # Name of deployment. self._deployment can be None if replicas == 0. That's a reason why I duplicated name, namespace and images with _deployment: V1Deployment
         self._image = image                         # Image if we have to replace original image with it in this deployment
         self._namespace = namespace                 # Namespace to search the deployment
-        self._deployment: V1Deployment = None       # Wrapped deployment object
+        self._deployment: KubeDeploymentSnapshot = None     # Snapshot of the running deployment
+        self._body: V1Deployment = None                     # Full deployment object which is built to be written. It is dropped after the write
         self._setLogger()
         self._setKubeEngine()
 
@@ -108,37 +99,49 @@ class KubeDeployment(AKubeDeployment):
     def getName(self) -> str:
         return self._name
 
-    # Reads running deployment from kubernetes
-    def readDeployment(self) -> V1Deployment:
-        return self._getKubeEngine().readDeployment(self.getName(), self._getNameSpace())
+    # Key of the deployment in work queues and indexes
+    def getKey(self) -> str:
+        return '%s/%s' % (self._namespace, self._name)
 
-    def getDeployment(self):
+    # Reads the snapshot of running deployment from the engine's informer cache. Calls kubernetes API only on a cache miss
+    def readDeployment(self) -> KubeDeploymentSnapshot:
+        return self._getKubeEngine().getDeployment(self.getName(), self._getNameSpace())
+
+    def getDeployment(self) -> KubeDeploymentSnapshot:
         return self._deployment
 
     # set wrapped deployment object
-    def setDeployment(self, deployment: V1Deployment):
-        self._name = deployment.metadata.name
-        self._deployment: V1Deployment = deployment
-        self._namespace = deployment.metadata.namespace
+    def setDeployment(self, deployment):
+        self._deployment = KubeDeploymentSnapshot.fromDeployment(deployment)
+        self._name = self._deployment.name
+        self._namespace = self._deployment.namespace
 
     # Returns an active kuberntes client object
     def _getKubeEngine(self):
         return self._kube_engine
 
-    # returns wrapped kubernetes deployment object: kubernetes.V1Deployment
-    # to work with a raw kubernetes object
-    def _getDeployment(self) -> V1Deployment:
+    # returns the snapshot of wrapped deployment
+    def _getDeployment(self) -> KubeDeploymentSnapshot:
         return self._deployment
 
-    # sets wrapped kubernetes deployment object: kubernetes.V1Deployment
-    def _setDeployment(self, deployment: V1Deployment):
-        self._deployment: V1Deployment = deployment
+    # sets the snapshot of wrapped deployment. A kubernetes.V1Deployment is reduced to its snapshot
+    def _setDeployment(self, deployment):
+        self._deployment = KubeDeploymentSnapshot.fromDeployment(deployment)
+        return self
+
+    # returns the full deployment object to work with a raw kubernetes object: kubernetes.V1Deployment
+    def _getBody(self) -> V1Deployment:
+        return self._body
+
+    # sets the full deployment object which is built to be written
+    def _setBody(self, body: V1Deployment):
+        self._body = body
         return self
 
     # To change the deployment name and wrapped kubernetes ob
     def _setWrappedDeploymentName(self, name):
-        if self._deployment is not None:
-            self._deployment.metadata.name = name
+        if self._body is not None:
+            self._body.metadata.name = name
 
     # To change the deployment name and wrapped kubernetes ob
     def _setNameWithSync(self, name):
@@ -160,28 +163,32 @@ class KubeDeploymentReplicasMixin(AKubeDeployment):
     May not be consistent with running kubernetes object
 
     Public methods:
-        - getReplicasCount: Get replicas count from wrapped deployment object.
-        - setReplicasCount: Update replicas count in wrapped deployment object without call Kubernetetes API
+        - getReplicasCount: Get replicas count from the snapshot of wrapped deployment.
+        - getDesiredReplicasCount: Get replicas count from spec of the snapshot of wrapped deployment
+        - setReplicasCount: Update replicas count in the built deployment object without call Kubernetetes API
     """
     def getReplicasCount(self) -> int:
-        return int(
-            self.getDeployment().status.replicas) if self.getDeployment() is not None and self.getDeployment().status is not None and self.getDeployment().status.replicas is not None else 0
+        return int(self.getDeployment().status_replicas) if self.getDeployment() is not None and self.getDeployment().status_replicas is not None else 0
+
+    def getDesiredReplicasCount(self) -> int:
+        return int(self.getDeployment().replicas) if self.getDeployment() is not None and self.getDeployment().replicas is not None else 0
 
     def setReplicasCount(self, replicas):
-        if self.getDeployment() is not None:
-            self.getDeployment().spec.replicas = replicas
+        if self._getBody() is not None:
+            self._getBody().spec.replicas = replicas
 
 
 class KubeDeploymentMetadataMixin(AKubeDeployment):
     """
     Mixin to manage metadata info with KubeDeployment class.
     Can't be implemented standalone
-    May not be consistent with running kubernetes object
+    Works with the built deployment object, so it may not be consistent with running kubernetes object
 
     Private methods:
         - _updateMetadataAttr: Update metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
         - _clearStatusInfo: Clear actual running deployment statuses in metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
-        - _getDeploymentNamePatch: get a patch body of the deployment name update to call API like kubectl patch
+        - _buildDesiredStateHash: get a hash of the wrapped deployment object without replicas
+        - _setDesiredStateHash / _getDesiredStateHash: write/read the hash annotation of a deployment object
         - _getDeploymentScalePatch: get a patch body of replicas count update to call API like kubectl patch
     """
 
@@ -196,12 +203,24 @@ class KubeDeploymentMetadataMixin(AKubeDeployment):
         "self_link",
         "uid",
         "local_vars_configuration",
-        "metadata.uid"
+        "metadata.uid",
+        "metadata.creation_timestamp",
+        "metadata.generation",
+        "metadata.self_link"
     ]
 
+    # Annotations which are maintained by kubernetes for the source deployment only
+    clearedAnnotationsFromRunningDeployment = [
+        "deployment.kubernetes.io/revision",
+        "kubectl.kubernetes.io/last-applied-configuration"
+    ]
+
+    # Annotation with a hash of the desired state which was written to the deployment
+    desired_hash_annotation = DESIRED_HASH_ANNOTATION
+
     def _setDeploymentMetadata(self):
-        self._deployment.metadata.name = self._name
-        self._deployment.metadata.namespace = self._namespace
+        self._body.metadata.name = self._name
+        self._body.metadata.namespace = self._namespace
 
     # update object attribute if field has hierarchy schema
     @staticmethod
@@ -219,35 +238,43 @@ class KubeDeploymentMetadataMixin(AKubeDeployment):
     # List of fields to clear in clearedFieldsFromRunningDeployment
     #
     def _clearStatusInfo(self):
-        if self._deployment is not None:
+        if self._body is not None:
             for item in KubeDeploymentMetadataMixin.clearedFieldsFromRunningDeployment:
-                KubeDeploymentMetadataMixin._updateMetadataAttr(self._deployment, item, None)
-        return self._deployment
+                KubeDeploymentMetadataMixin._updateMetadataAttr(self._body, item, None)
+            for annotation in KubeDeploymentMetadataMixin.clearedAnnotationsFromRunningDeployment:
+                (self._body.metadata.annotations or {}).pop(annotation, None)
+        return self._body
+
+    # The same hash as the template hash of snapshots. Replicas aren't a part of the hash
+    def _buildDesiredStateHash(self):
+        return KubeDeploymentSnapshot.buildDesiredStateHash(self._body)
+
+    def _setDesiredStateHash(self, desired_hash):
+        if self._body.metadata.annotations is None:
+            self._body.metadata.annotations = {}
+        self._body.metadata.annotations[KubeDeploymentMetadataMixin.desired_hash_annotation] = desired_hash
+
+    @staticmethod
+    def _getDesiredStateHash(deployment: V1Deployment):
+        if deployment is None or deployment.metadata is None:
+            return None
+        return (deployment.metadata.annotations or {}).get(KubeDeploymentMetadataMixin.desired_hash_annotation)
 
     def _getDeploymentImage(self):
-        return self._deployment.spec.template.spec.containers[0].image
+        return self._body.spec.template.spec.containers[0].image
 
     def _setDeploymentImage(self, image):
-        self._deployment.spec.template.spec.containers[0].image = image
+        self._body.spec.template.spec.containers[0].image = image
 
     def _getDeploymentEnv(self):
-        return self._deployment.spec.template.spec.containers[0].env
+        return self._body.spec.template.spec.containers[0].env
 
-    def _getDeploymentImagePatch(self, image):
-        container_name = self._deployment.spec.template.spec.containers[0].name
-        return KubeDeploymentTemplates.buildImagePatch(container_name, image)
+    # Sets an env variable of the first container. Existing variable with the same name is replaced
+    def _setDeploymentEnv(self, name, value):
+        container = self._body.spec.template.spec.containers[0]
+        container.env = [item for item in (container.env or []) if item.name != name] + [V1EnvVar(name=name, value=value)]
 
-    def _getDeploymentEnvPatch(self, item):
-        container_name = self._deployment.spec.template.spec.containers[0].name
-        return KubeDeploymentTemplates.buildEnvPatch(container_name, item)
-
-    # get a patch body of the first container image to call API like kubectl patch
-    # get a patch body of the deployment name update call API like kubectl patch
-    def _getDeploymentNamePatch(self, name):
-        return KubeDeploymentTemplates.buildNamePatch(name)
-
-    # get a patch body of the first container env item to call API like kubectl patch
-    # _getDeploymentScalePatch: get a patch body of replicas count update to call API like kubectl patch
+    # get a patch body of replicas count update to call API like kubectl patch
     def _getDeploymentScalePatch(self, replicas):
         return KubeDeploymentTemplates.buildScalePatch(replicas)
 
@@ -258,19 +285,32 @@ class KubeDeploymentManager(KubeDeployment, KubeDeploymentMetadataMixin, KubeDep
 
     Public methods:
         - createDeployment: Update metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
-        - scaleReplica: Update metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
+        - applyDeployment: Create or update the deployment to match the wrapped deployment object by one server-side apply request
+        - scaleReplicas: Change replicas count of the deployment through the scale subresource
         - patchDeployment: Update metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
     Private methods:
         - _updateMetadataAttr: Update metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
         - _clearStatusInfo: Clear actual running deployment statuses in metadata info in the wrapped deployment object to allow to start a new deployment with this metatada
     """
+    # The built deployment object is written and dropped, the snapshot of the response is kept
     def createDeployment(self, deployment=None) -> AKubeDeployment:
         if deployment is not None:
-            self._setDeployment(deployment)
-        return self._setDeployment(self._getKubeEngine().createDeployment(self._getDeployment(), self._getNameSpace()))
+            self._setBody(deployment)
+        body, self._body = self._getBody(), None
+        return self._setDeployment(self._getKubeEngine().createDeployment(body, self._getNameSpace()))
+
+    def applyDeployment(self, deployment=None) -> AKubeDeployment:
+        if deployment is not None:
+            self._setBody(deployment)
+        body, self._body = self._getBody(), None
+        return self._setDeployment(self._getKubeEngine().applyDeployment(body, self._getNameSpace()))
 
+    # Replicas are changed through the scale subresource. Returned snapshot is the cached one with new replicas
     def scaleReplicas(self, replica_count) -> AKubeDeployment:
-        return self.patchDeployment(self._getDeploymentScalePatch(replica_count))
+        deployment = self._getKubeEngine().patchDeploymentScale(self.getName(), self._getNameSpace(), self._getDeploymentScalePatch(replica_count))
+        if deployment is not None:
+            self._setDeployment(deployment)
+        return self
 
     def patchDeployment(self, patch_body):
         return self._setDeployment(
@@ -299,34 +339,64 @@ class KubeDeploymentWithClone(KubeDeploymentManager, KubeEventHandlerInterface):
     :param name_suffix: suffix for name of the cloned deployment
     :param cloned_factor: (float) factor to calculate count of the cloned replicas = number of replicas * cloned_factor
     :param image: (optional) the image to use in the cloned deployment, otherwise the same image as in main deployment
-    :param env: (optional) if we need to add an env item into the cloned deployment
+    :param env: (optional) (name, value) pairs of env items to add into the cloned deployment
 
     Public methods:
         - update: Update(patch cloned deployment)
-        - healthCheck: Test is the service working
-        - eventHandler: Handler of modify deployment events
+        - getWatchedNames: Names of the source and the cloned deployments to watch
+        - eventHandler: Handler of modify deployment events. Repairs the cloned deployment if it has drifted
         - updateClonedDeploymentConfig: update if configmap is changed
+        - removeClonedDeployment: scale down or delete the clone when the deployment is removed from the configuration
+        - getCloneState: State of the clone by the informer cache without API calls
     Private methods:
-        - _buildClonedDeployment: Takes source deployment, applies configuration patches and saves as cloned deployment object
-        - _createClonedDeployment: If the cloned deployment exist, patches k8s deployment otherwise creates a new one
-        - _isUpdateConditon
-        - _cmpDeployments
+        - _buildClonedDeployment: Takes source deployment, applies configuration rules and saves as cloned deployment object
+        - _createClonedDeployment: Creates or updates the cloned deployment by one server-side apply request
+        - _readSourceBody: Full source deployment to build the clone. It's read only when the clone has to be built
+        - _repairClonedDeployment: Rebuilds the cloned deployment if it was changed or deleted outside of this application
     """
 
     def __init__(self, name, namespace, name_suffix, cloned_factor, image=None, env=None):
         KubeDeployment.__init__(self, name, namespace)
         self._cloned:KubeDeploymentManager = None
         self._cloned_image = image
-        self._cloned_env_ext = env
+        self._cloned_env_ext = tuple(env or ())
         self._name_suffix = name_suffix
         self._setClonedFactor(cloned_factor)
-        self._active_deployment = None
-        self._loadClonedDeployment()
+        self._active_template_hash = None       # template hash of the source the clone was built from. None forces to build it again
+        self._source_body = None                # full source deployment (V1Deployment or KubeRawObject) of the handled event. It is kept only while the event is handled
+        self._cloned_drifted = False            # the cloned deployment was changed by somebody else and doesn't match its hash annotation
+        self._setEngineSettings()
+        self._setMetrics()
+        with self._reconcile('load'):
+            self._loadClonedDeployment()
+
+    @inject
+    def _setEngineSettings(self, settings: KubeEngineSettings = Provide[EngineContainer.engine_settings]):
+        self._settings = settings
+
+    @inject
+    def _setMetrics(self, metrics: MetricsRegistry = Provide[MetricsContainer.registry]):
+        self._reconcile_seconds = metrics.histogram('reconcile_duration_seconds', 'Duration of reconciles by reconcile path', ('path',))
+        self._converge_seconds = metrics.histogram('event_to_converged_seconds', 'Seconds from receiving a source deployment event to the end of its reconcile')
+        self._repairs = metrics.counter('clone_repairs_total', 'Number of repairs of cloned deployments changed or deleted outside of this application')
+
+    # API calls made inside the context are accounted to the reconcile path, its duration is observed by the path
+    @contextmanager
+    def _reconcile(self, path, budget=None):
+        started_at = time.monotonic()
+        try:
+            with self._getKubeEngine().getApiStats().reconcile(path, budget) as frame:
+                yield frame
+        finally:
+            self._reconcile_seconds.observe(time.monotonic() - started_at, path=path)
 
     # creates a cloned deployment at start
+    # The clone is built at start, so the full source is read at once instead of its snapshot
     # TODO: merge with _createClonedDeployment method
     def _loadClonedDeployment(self):
-        self._refreshDeploymentInfo()                                           # call Kuberhetes API and refresh the deployment's information
+        if self._source_body is None:
+            self._source_body = self._getKubeEngine().readDeployment(self._name, self._namespace)
+        self._refreshDeploymentInfo()                                           # refresh the deployment's information from the informer cache
         if self._deployment is not None:
             self._logger.info("Load cloned deployment from  %s " % self._name)
             if self._cloned is None:
@@ -338,6 +408,7 @@ class KubeDeploymentWithClone(KubeDeploymentManager, KubeEventHandlerInterface):
                 self._cloned._setDeployment(self._cloned.readDeployment())      # read running cloned deployment object
             self.update()
         else:
+            self._source_body = None
             self._cloned = KubeDeploymentManager(self._getClonedName(), self._namespace)
             self._cloned._refreshDeploymentInfo()
             if self._cloned._deployment is not None:                                    # case if main deployment was removed
@@ -355,58 +426,82 @@ class KubeDeploymentWithClone(KubeDeploymentManager, KubeEventHandlerInterface):
         self._cloned_factor: float = float(cloned_factor)
 
     # Builds the cloned deployment body
-    # Reads the running deployment and apply rules from the configmap
+    # Reads the full running deployment and apply rules from the configmap
+    # The object of the handled event can be shared with other handlers, so the clone is built from its copy
     def _buildClonedDeployment(self):
-        deployment = self.readDeployment()
-        self._setDeployment(deployment)
-        self._cloned._setDeployment(self.getDeployment())._resetDeployment()
-        self._cloned.setReplicasCount(self._getRequiredReplicaCount())
+        body = self._readSourceBody()
+        if body is None:
+            return None
+        self._setDeployment(body)                                   # the clone follows this version of the source
+        self._cloned._setBody(deepcopy(body))._resetDeployment()
+        self._cloned.setReplicasCount(ceil(self._cloned_factor * self.getDesiredReplicasCount()))
         if self._cloned_image is not None:
             self._cloned._setDeploymentImage(self._cloned_image)
+        for name, value in self._cloned_env_ext:
+            self._cloned._setDeploymentEnv(name, value)
         return self
 
+    # Snapshots don't keep the template, so it's the only place where the full source is needed. The object of the handled event
+    # is used if the cached version of the source has the same template, f.e. only its status was changed since the event.
+    # Otherwise the source is read from kubernetes API. A raw event object is deserialized to its model only here
+    def _readSourceBody(self) -> V1Deployment:
+        body, self._source_body = self._source_body, None
+        cached = self.readDeployment() if body is not None else None
+        if cached is None or KubeDeploymentSnapshot.buildDesiredStateHash(body) != cached.template_hash:
+            return self._getKubeEngine().readDeployment(self._name, self._namespace)
+        return body.toModel() if isinstance(body, KubeRawObject) else body
+
     # Deploys the cloned deployment
+    # The whole desired state is applied at once, so one change of the source or the configuration gives one rollout of the clone.
+    # The same request creates a missing clone
+    # The clone keeps a hash of the desired state it was written with. If the hash isn't changed, f.e. only status of the source
+    # was changed or the application was restarted, the running clone is up to date and isn't written
     def _createClonedDeployment(self):
-        cloned = self._cloned.readDeployment()
-        # if cloned is null then there is no cloned object is deployed in k8s
-        self._buildClonedDeployment()
-        if cloned is None:
-            self._cloned.createDeployment()         # create cloned deployment in k8s cluster
-        else:
-            self._cloned.patchDeployment(self._cloned.getDeployment())
+        cloned = self._cloned.readDeployment()                      # snapshot of running cloned deployment from the informer cache
+        if self._buildClonedDeployment() is None:
+            self._logger.warning("Deployment %s can't be read to build its clone" % self.getKey())
+            return None
+        desired_hash = self._cloned._buildDesiredStateHash()
+        if not self._cloned_drifted and cloned is not None and desired_hash == cloned.desired_hash:
+            self._logger.debug("Cloned deployment %s is up to date" % self._cloned.getName())
+            self._cloned._setDeployment(cloned)._setBody(None)
+            return self
+        self._cloned._setDesiredStateHash(desired_hash)
+        self._cloned.applyDeployment()
+        self._cloned_drifted = False
         return self
 
+    # The clone follows desired replicas of the source. Status-only events of the source aren't handled
     def _getRequiredReplicaCount(self) -> int:
         try:
             self._setDeployment(self.readDeployment())
-            return ceil(self._cloned_factor * self.getReplicasCount())
+            return ceil(self._cloned_factor * self.getDesiredReplicasCount())
         except Exception as e:
             self._logger.exception(e)
             return 0
 
-    # We have two conditonals as reason for updating:
-    # - the deployment was changed. We can check it by resource_version field
-    # - count of replicas of the managed deployment was changed. In this case resource_version isn't being changed
-
-    def _cmpDeployments(self, sourceDeployment, targetDeployment):
-        return sourceDeployment.metadata.resource_version == targetDeployment.metadata.resource_version if targetDeployment is not None else False
-
-    def _isUpdateConditon(self):
+    # The clone's spec is compared, because its running replicas follow the spec with a delay
+    def _isScaleRequired(self):
         self._refreshDeploymentInfo()
-        return self._cloned.getDeployment() is None or self._cloned.getReplicasCount() != self._getRequiredReplicaCount()
+        return self._cloned.getDeployment() is None or self._cloned.getDesiredReplicasCount() != self._getRequiredReplicaCount()
 
+    # We have two conditonals as reason for updating:
+    # - the template of the deployment or the configuration was changed. We can check it by the template hash of the snapshot
+    # - count of replicas of the managed deployment was changed. In this case the template hash isn't being changed
     # check conditions and run update the deployment
     def update(self):
-        if not self._cmpDeployments(self.getDeployment(), self._active_deployment):             # if deployment was updated
-            self._createClonedDeployment()                                                      # create/update a clone object
-            self._active_deployment = self._getDeployment()
-        if self._isUpdateConditon():                                                            # if replicas count changed
+        self._refreshDeploymentInfo()
+        if self._deployment is None:
+            return
+        if self._deployment.template_hash != self._active_template_hash:                        # if deployment was updated
+            if self._createClonedDeployment() is not None:                                      # create/update a clone object
+                self._active_template_hash = self._deployment.template_hash
+        if self._isScaleRequired():                                                             # if replicas count changed
             self._scaleClonedDeployment()
-            self._active_deployment = self._getDeployment()
 
-    # Test healthcheck
-    def healthCheck(self):
-        return not self._isUpdateConditon()             # If the deployment is validated, then application is running
+    # Events of the source and the cloned deployments are needed
+    def getWatchedNames(self):
+        return [self._name, self._getClonedName()]
 
     def _scaleClonedDeployment(self) -> AKubeDeployment:
         if self._cloned.getDeployment() is None:
@@ -420,71 +515,115 @@ class KubeDeploymentWithClone(KubeDeploymentManager, KubeEventHandlerInterface):
         if self._cloned.getDeployment() is not None:
             return self._cloned.scaleReplicas(0)
 
-    # This function called as callback from an events' listener when a deployment changed
+    # This function called as callback from an events' listener when the source or the cloned deployment changed
     def eventHandler(self, event):
-        self._logger.debug("Checking deployment %s event type=%s event name=%s" % (self._name, event['type'] == 'MODIFIED',event['object'].metadata.name))
+        self._logger.debug("Checking deployment %s event type=%s event name=%s" % (self._name, event['type'], event['object'].metadata.name))
         try:
-            if event['type'] == 'MODIFIED' and event['object'].metadata.name == self._name:
-                self._logger.debug("Checking deployment %s" % self._name)
-                if self._deployment is None:
-                    self._loadClonedDeployment()            # Create a cloned deployment
-                else:
-                    self.update()
+            if event['object'].metadata.name == self._name:
+                # A source created after the start comes as ADDED, its next events can change only status and be dropped by predicates
+                if event['type'] == 'MODIFIED' or (event['type'] == 'ADDED' and self._deployment is None):
+                    self._logger.debug("Checking deployment %s" % self._name)
+                    self._source_body = event['object']
+                    with self._reconcile('source-event', self._settings.reconcile_api_call_budget):
+                        if self._deployment is None:
+                            self._loadClonedDeployment()        # Create a cloned deployment
+                        else:
+                            self.update()
+                    if 'received_at' in event:
+                        self._converge_seconds.observe(time.monotonic() - event['received_at'])
+            elif event['object'].metadata.name == self._getClonedName():
+                with self._reconcile('clone-event'):
+                    self._repairClonedDeployment(event)
         except Exception as e:
             self._logger.exception(e)
+        finally:
+            self._source_body = None
+
+    # The cloned deployment has been changed or deleted by somebody else
+    # Returns it to the state required by the source deployment and configuration.
+    # A watch which starts after the clone was changed, f.e. of a renamed clone, gives it as ADDED.
+    # The event can be older than responses to own writes of the clone, so drift is checked by the latest snapshot of the cache.
+    # The clone is compared with the last handled source state: a newer source event can wait in the queue and will scale the clone itself
+    def _repairClonedDeployment(self, event):
+        if self._deployment is None or self._cloned is None:
+            return
+        required_replicas = ceil(self._cloned_factor * self.getDesiredReplicasCount())
+        if event['type'] == 'DELETED' or (event['type'] in ('ADDED', 'MODIFIED') and
+                                          self._isClonedDeploymentDrifted(self._getLatestCloneSnapshot(event), required_replicas)):
+            self._logger.info("Cloned deployment %s has drifted (%s), repairing" % (self._cloned.getName(), event['type']))
+            self._repairs.inc()
+            self._active_template_hash = None                               # force to rebuild the cloned deployment
+            self._cloned_drifted = True                                     # its hash annotation can't be trusted
+            self.update()
+
+    def _getLatestCloneSnapshot(self, event) -> KubeDeploymentSnapshot:
+        cached = self._getKubeEngine().getDeploymentCache().get(self._cloned.getName(), self._namespace)[1]
+        return cached if cached is not None else KubeDeploymentSnapshot.fromDeployment(event['object'])
+
+    def _isClonedDeploymentDrifted(self, cloned: KubeDeploymentSnapshot, required_replicas):
+        if cloned.replicas is None:
+            return False
+        if cloned.replicas != required_replicas:
+            return True
+        if self._cloned_image is not None and cloned.image != self._cloned_image:
+            return True
+        return any(item not in cloned.env for item in self._cloned_env_ext)
+
+    # State of the clone by the informer cache. It doesn't call kubernetes API and doesn't change this object,
+    # so it can be read from other threads, f.e. to export metrics:
+    #   'unknown' - the source deployment isn't known, 'missing' - no cloned deployment,
+    #   'drifted' - the clone doesn't follow the source and the configuration, 'converged' - otherwise
+    def getCloneState(self):
+        cache = self._getKubeEngine().getDeploymentCache()
+        source = cache.get(self._name, self._namespace)[1]
+        if source is None or source.replicas is None:
+            return 'unknown'
+        cloned = cache.get(self._getClonedName(), self._namespace)[1]
+        if cloned is None:
+            return 'missing'
+        required_replicas = ceil(self._cloned_factor * source.replicas)
+        return 'drifted' if self._isClonedDeploymentDrifted(cloned, required_replicas) else 'converged'
 
     # This function called as callback from an events' listener when a configmap changed and updates this deployment according to the configmap
     # we can check clone name, clone image, patched environment variable, scale factor
-    def updateClonedDeploymentConfig(self, new_config: DeploymentConfigDto):
+    # The new configuration is applied to the clone by one request
+    def updateClonedDeploymentConfig(self, new_config: DeploymentConfig):
         if new_config.name == self._name:
             self._logger.debug("Deployment clone %s is updating" % new_config.name)
-            if self._deployment is None:
-                self._loadClonedDeployment()
-            if self._deployment is not None:
-                self._runIfClonesNameChanged(new_config)                        # If cloned deployment name chamged
-                self._updateClonedImageConfig(new_config)                       # If there is cloned_image configuration
-                self._updateClonedEnvConfig(new_config)                         # If there is an env variable in configuration
-                self._setClonedFactor(new_config.body.get('scale_factor', 0))
-                self._name_suffix = new_config.body.get('name_suffix', 'clone')
-                # self._image = new_config.body.get('image', None)
-                self.update()
-
-    #
-    # If cloned name was changed
-    # updatet existing cloned deployment
-    #
-    def _runIfClonesNameChanged(self, new_config):
-        if self._buildClonedName(new_config.name,
-                                 new_config.body.get('name_suffix', 'clone')) != self._cloned.getName():
-            patch = self._cloned._getDeploymentNamePatch(
-                self._buildClonedName(new_config.name, new_config.body.get('name_suffix', 'clone')))
-            self._cloned.patchDeployment(patch)
+            with self._reconcile('config'):
+                self._cloned_image = new_config.image
+                self._cloned_env_ext = new_config.env
+                self._setClonedFactor(new_config.scale_factor)
+                self._runIfClonesNameChanged(new_config.name_suffix)
+                self._active_template_hash = None                               # force to apply the new configuration
+                if self._deployment is None:
+                    self._loadClonedDeployment()
+                else:
+                    self.update()
 
-    #
-    # If cloned image is not the same as original
-    # replace that one from configmap
-    #
-    def _updateClonedImageConfig(self, new_config):
-        if new_config.body.get('cloned_image', None) is not None and self._cloned._getDeploymentImage() != new_config.body.get(
-                'cloned_image'):
-            patch = self._cloned._getDeploymentImagePatch(new_config.body.get('cloned_image'))
-            self._cloned.patchDeployment(patch)
+    # Called when the deployment was removed from the configuration. Events of the deployment aren't handled anymore,
+    # so the clone is scaled down ("scale-down"), deleted ("delete") or left as it is ("keep")
+    def removeClonedDeployment(self, policy):
+        if self._cloned is None or policy == 'keep':
+            return
+        self._logger.info("Deployment %s has been removed from the configuration, its clone %s: %s" % (self._name, self._cloned.getName(), policy))
+        with self._reconcile('remove'):
+            if policy == 'delete':
+                self._getKubeEngine().deleteDeployment(self._cloned.getName(), self._namespace)
+            else:
+                self._cloned._refreshDeploymentInfo()
+                self._resetClonedDeployment()
 
     #
-    # If cloned configuration has env section
-    # add env variable to cloned
-    # only one environment variable allowed
+    # If cloned name was changed
+    # stop the old cloned deployment, the new one will be created by update
+    # kubernetes doesn't allow to rename objects
     #
-    def _updateClonedEnvConfig(self, new_config):
-        if new_config.body.get('env', None) is not None:
-            env_var = new_config.body.get('env').replace(' ', '').split(':')
-            env_val = KubeDeploymentTemplates. \
-                findEnvInListEnv(self._cloned._getDeploymentEnv(),
-                                 new_config.body.get('env').replace(' ', '').split(':')[0])
-            if env_val is None or env_val.value != env_var[1]:
-                patch = self._cloned._getDeploymentEnvPatch(env_var)
-                self._cloned.patchDeployment(patch)
-
-
-
-
+    def _runIfClonesNameChanged(self, name_suffix):
+        if name_suffix == self._name_suffix:
+            return
+        self._name_suffix = name_suffix
+        if self._cloned is not None:
+            self._logger.info("Cloned deployment %s is renamed to %s" % (self._cloned.getName(), self._getClonedName()))
+            self._resetClonedDeployment()
+            self._cloned = KubeDeploymentManager(self._getClonedName(), self._namespace)
@@ -1,5 +1,6 @@
 from eks_token import get_token
 from datetime import datetime
+import threading
 import boto3
 
 
@@ -9,40 +10,49 @@ class KubeEKSClusterInfo:
     :param cluster_name: It's a cluster name for AWS EKS
     :param eks_region: (optional) region name for AWS EKS
     :param time_lag: (optional) time before token has expired
+    :param token_source: (optional) function which returns a new token of the cluster as eks_token.get_token does
     Public methods:
-        - getSessionToke() : returns kubernetes session authorisation token
-        - getEndpoint() : returns kubernetes API endpoint
+        - getSessionToke() : returns kubernetes session authorisation token. The token is refreshed if it expires in time_lag seconds
+        - getEndpoint() : returns kubernetes API endpoint. describe_cluster is called until it succeeds once, its errors are raised
         - isTokenExpired(): returns True if token was expired or expires in time_lag seconds
+        - getSecondsToRefresh(): returns seconds until the token has to be refreshed
     """
 
-    def __init__(self, cluster_name, eks_region='us-east-1', time_lag=60):
+    def __init__(self, cluster_name, eks_region='us-east-1', time_lag=60, token_source=None):
         self._cluster_name = cluster_name
         self._eks_region = eks_region
         self._time_lag = time_lag
-        self._endpoint = self.getEndpoint()
+        self._token_source = token_source if token_source is not None else get_token
+        self._lock = threading.Lock()
+        self._endpoint = None
         self._refreshSessionToken()
 
-
+    # The token is shared by API requests of all threads and the token refresher, so it is refreshed once
     def getSessionToken(self):
-        if self.isTokenExpired():
-            self._refreshSessionToken()
-        return self._session_token['status']['token']
+        with self._lock:
+            if self.isTokenExpired():
+                self._refreshSessionToken()
+            return self._getCurrentSessionToken()
 
     def isTokenExpired(self):
-        return (self._getSessionTokenExpirationTime() - datetime.utcnow()).total_seconds() < self._time_lag
+        return self.getSecondsToRefresh() < 0
+
+    def getSecondsToRefresh(self) -> float:
+        return (self._getSessionTokenExpirationTime() - datetime.utcnow()).total_seconds() - self._time_lag
 
     def getAuthorizationType(self) -> str:
         return 'Bearer'
 
     def getEndpoint(self):
-        try:
-            return \
-                boto3.client('eks', region_name=self._eks_region).describe_cluster(name=self._cluster_name)['cluster']['endpoint']
-        except Exception as e:
-            print(e)
+        if self._endpoint is None:
+            self._endpoint = self._describeEndpoint()
+        return self._endpoint
+
+    def _describeEndpoint(self):
+        return boto3.client('eks', region_name=self._eks_region).describe_cluster(name=self._cluster_name)['cluster']['endpoint']
 
     def _refreshSessionToken(self):
-        self._session_token = get_token(self._cluster_name)
+        self._session_token = self._token_source(self._cluster_name)
         return self._session_token
 
     def _getSessionTokenExpirationTime(self):
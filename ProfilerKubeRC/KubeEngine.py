@@ -1,37 +1,94 @@
+import inspect
+import itertools
+import json
+import time
 import kubernetes
 from abc import ABC, abstractmethod
 from dependency_injector.wiring import inject, Provide
 from kubernetes.client.rest import ApiException
-from kubernetes import watch
-from contextlib import suppress
 
-from ProfilerKubeRC.KubeClient import KubeClient
+from ProfilerKubeRC.KubeApiStats import KubeApiCallStats
+from ProfilerKubeRC.KubeClient import KubeClient, KubeRestClient
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeInformer import KubeInformerCache
+from ProfilerKubeRC.KubePredicates import KubePredicatePipeline
+from ProfilerKubeRC.KubeRateLimiter import KubeRateLimiter
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot
+from ProfilerKubeRC.KubeWatch import KubeResumableWatch
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 
+APPLY_PATCH_CONTENT_TYPE = 'application/apply-patch+yaml'
+DEPLOYMENT_PATH = '/apis/apps/v1/namespaces/{namespace}/deployments/{name}'
+HTTP_STATUS_TOO_MANY_REQUESTS = 429
 
-def kubapi_call(func):
-    def wrapper(*args, **kwargs):
-        try:
-            KubeEngine.logger.debug("K8s API call: %s" % func)
-            return func(*args, **kwargs)
-        except ApiException as e:
-            KubeEngine.logger.error("Exception when calling %s: %s\n" % (func, e))
-            return None
-        except Exception as e:
-            KubeEngine.logger.exception(e)
-            return None
-    return wrapper
+
+# Wraps an engine method which calls kubernetes API: logs errors and returns None instead of raising them.
+# Every call waits for a token of its lane in the engine's KubeRateLimiter. A call answered with 429 Too Many Requests pauses the limiter
+# for Retry-After seconds and is repeated up to API_THROTTLE_RETRIES times.
+# Every attempt is recorded in the engine's KubeApiCallStats by verb, resource, namespace, reconcile path, latency and outcome
+def kubapi_call(verb, resource):
+    lane = KubeRateLimiter.getLane(verb, resource)
+
+    def decorator(func):
+        parameters = list(inspect.signature(func).parameters)
+        namespace_index = parameters.index('namespace') if 'namespace' in parameters else None
+
+        def wrapper(*args, **kwargs):
+            engine = args[0]
+            logger = engine.getLogger()
+            namespace = kwargs.get('namespace', args[namespace_index] if namespace_index is not None and namespace_index < len(args) else None)
+            for attempt in itertools.count():
+                engine.getRateLimiter().acquire(lane)
+                started_at = time.monotonic()
+                outcome = 'success'
+                try:
+                    logger.debug("K8s API call: %s" % func)
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    status = getattr(e, 'status', None)                 # ApiException of kubernetes or kubernetes_asyncio
+                    outcome = 'error:%s' % status if status is not None else 'error'
+                    if status == HTTP_STATUS_TOO_MANY_REQUESTS and attempt < engine.getSettings().api_throttle_retries:
+                        retry_after = getRetryAfter(e)
+                        logger.warning("API server throttles %s %s, retrying in %.1f seconds" % (verb, resource, retry_after))
+                        engine.getRateLimiter().pause(retry_after)
+                        continue
+                    if isinstance(e, ApiException):
+                        logger.error("Exception when calling %s: %s\n" % (func, e))
+                    else:
+                        logger.exception(e)
+                    return None
+                finally:
+                    engine.getApiStats().record(verb, resource, namespace, time.monotonic() - started_at, outcome)
+        return wrapper
+    return decorator
+
+
+# Seconds from the Retry-After header of a 429 response. API server sends seconds, other values get the default delay
+def getRetryAfter(error, default=1.0):
+    try:
+        return max(0.0, float((getattr(error, 'headers', None) or {}).get('Retry-After')))
+    except (TypeError, ValueError):
+        return default
 
 class AKubeEngine(ABC):
     """
-    Wrapes Kubernetes API
+    Wrapes Kubernetes API. Deployments are cached as KubeDeploymentSnapshot objects, methods which write deployments
+    return snapshots of their responses
 
     Public methods:
-        - readDeployment
+        - readDeployment: returns the full deployment object from the API
+        - getDeployment: returns the snapshot of the deployment from the cache
         - createDeployment
+        - applyDeployment
+        - deleteDeployment
         - watchDeployments
+        - listAllDeployments
+        - watchAllDeployments
+        - getDeploymentWatchSelectors
         - patchDeployment
+        - patchDeploymentScale
+        - listLeases, createLease, replaceLease, deleteLease
 
     Private methods:
 
@@ -41,35 +98,100 @@ class AKubeEngine(ABC):
     def readDeployment(self, name, namespace):
         pass
 
+    @abstractmethod
+    def getDeployment(self, name, namespace):
+        pass
+
     @abstractmethod
     def createDeployment(self, deployment, namespace):
         pass
 
+    @abstractmethod
+    def applyDeployment(self, deployment, namespace):
+        pass
+
+    @abstractmethod
+    def deleteDeployment(self, name, namespace):
+        pass
+
     @abstractmethod
     def readConfigMap(self, name, namespace):
         pass
 
     @abstractmethod
-    def watchDeployments(self, namespace, callback=None):
+    def watchDeployments(self, namespace, callback=None, field_selector=None, label_selector=None, stop_event=None):
+        pass
+
+    @abstractmethod
+    def listAllDeployments(self, limit=None):
         pass
 
     @abstractmethod
-    def watchConfigMaps(self, namespace, callback=None):
+    def watchAllDeployments(self, callback=None, namespaces=None, stop_event=None):
+        pass
+
+    @abstractmethod
+    def getDeploymentWatchSelectors(self, watched_names):
+        pass
+
+    @abstractmethod
+    def watchConfigMaps(self, namespace, callback=None, field_selector=None):
         pass
 
     @abstractmethod
     def patchDeployment(self, name, namespace, patch_body):
         pass
 
+    @abstractmethod
+    def patchDeploymentScale(self, name, namespace, patch_body):
+        pass
+
+    @abstractmethod
+    def listLeases(self, namespace, label_selector=None):
+        pass
+
+    @abstractmethod
+    def createLease(self, lease, namespace):
+        pass
+
+    @abstractmethod
+    def replaceLease(self, name, namespace, lease):
+        pass
+
+    @abstractmethod
+    def deleteLease(self, name, namespace, body=None):
+        pass
+
+    # Asynchronous engines run watches in their event loop. Listeners use coroutines of such engines instead of blocking calls
+    def isAsync(self):
+        return False
+
 class KubeEngine(AKubeEngine):
     logger: SLogger = None
 
-    def __init__(self, api_client):
+    def __init__(self, api_client, settings: KubeEngineSettings = None):
         KubeEngine.setLogger()
         KubeEngine.logger.debug("Starting k8s engine")
         self._api_client = api_client
-        self._api_appsv1 = kubernetes.client.AppsV1Api(self._getApiClient().getApiClient())         # It cant't use just api_client variable
-        self._api_corev1 = kubernetes.client.CoreV1Api(self._getApiClient().getApiClient())         # It cant't use just api_client variable
+        self._settings = settings if settings is not None else KubeEngineSettings()
+        self._watches = {}                                                                          # Running watches by name to observe their state
+        self._deployment_cache = KubeInformerCache()                                                # Latest deployments from watch streams and API responses
+        self._api_stats = KubeApiCallStats(KubeEngine.logger)                                       # Tallies of API calls
+        self._rate_limiter = KubeRateLimiter(self._settings.api_qps, self._settings.api_burst)       # Client-side limit of API calls with priority lanes
+        self._predicate_pipelines = {}                                                              # Event predicates of deployment watches by watch name
+        KubePredicatePipeline(self._settings.deployment_event_predicates)                           # Fail at start if a predicate name is wrong
+        self._createApis()
+
+    # All APIs share one kubernetes client, so they share its connection pool
+    def _createApis(self):
+        api_client = self._getApiClient().getApiClient()                                            # It cant't use just api_client variable
+        if api_client is None:
+            api_client = kubernetes.client.ApiClient()                                              # Local and in-cluster clients configure the default configuration
+        self._rest_client = KubeRestClient.install(api_client, self._settings)
+        self._api_appsv1 = kubernetes.client.AppsV1Api(api_client)
+        self._api_corev1 = kubernetes.client.CoreV1Api(api_client)
+        self._api_coordinationv1 = kubernetes.client.CoordinationV1Api(api_client)
+        self._api_custom = kubernetes.client.CustomObjectsApi(api_client)
 
     @inject
     def setLogger(logger_svc: SLogger = Provide[LoggerContainer.logger_svc]):
@@ -78,59 +200,223 @@ class KubeEngine(AKubeEngine):
     def getLogger(self):
         return KubeEngine.logger
 
+    def getApiStats(self) -> KubeApiCallStats:
+        return self._api_stats
+
+    def getRateLimiter(self) -> KubeRateLimiter:
+        return self._rate_limiter
+
+    def getSettings(self) -> KubeEngineSettings:
+        return self._settings
+
     def _getApiClient(self) -> KubeClient:
         return self._api_client
 
-    @kubapi_call
+    def getDeploymentCache(self) -> KubeInformerCache:
+        return self._deployment_cache
+
+    # Usage of the connection pool to API server, see KubeRestClient.getPoolStats
+    def getConnectionPoolStats(self):
+        return self._rest_client.getPoolStats()
+
+    @kubapi_call('create', 'deployments')
     def createDeployment(self, deployment, namespace):
         KubeEngine.logger.debug("Creating deployment %s in %s" % (deployment.metadata.name, namespace))
-        return self._api_appsv1.create_namespaced_deployment(namespace, deployment)
+        return self._deployment_cache.put(self._api_appsv1.create_namespaced_deployment(namespace, deployment))
 
-    @kubapi_call
+    # Server-side apply of the whole deployment: creates it or updates fields owned by the field manager in one request.
+    # Fields which the field manager applied before and which are missing in the deployment now are removed
+    @kubapi_call('apply', 'deployments')
+    def applyDeployment(self, deployment, namespace):
+        KubeEngine.logger.debug("Applying deployment %s in %s" % (deployment.metadata.name, namespace))
+        api_client = self._api_appsv1.api_client
+        return self._deployment_cache.put(api_client.call_api(**self._getApplyArguments(api_client, deployment, namespace)))
+
+    # The generated client of this kubernetes version can't select the apply content type, so the request is built here
+    def _getApplyArguments(self, api_client, deployment, namespace):
+        body = api_client.sanitize_for_serialization(deployment)
+        body['apiVersion'] = 'apps/v1'
+        body['kind'] = 'Deployment'
+        return {
+            'resource_path': DEPLOYMENT_PATH,
+            'method': 'PATCH',
+            'path_params': {'namespace': namespace, 'name': deployment.metadata.name},
+            'query_params': [('fieldManager', self._settings.field_manager), ('force', 'true')],
+            'header_params': {'Accept': 'application/json', 'Content-Type': APPLY_PATCH_CONTENT_TYPE},
+            'body': json.dumps(body).encode('utf8'),            # JSON is valid YAML
+            'response_type': 'V1Deployment',
+            'auth_settings': ['BearerToken'],
+            '_return_http_data_only': True
+        }
+
+    @kubapi_call('delete', 'deployments')
+    def deleteDeployment(self, name, namespace):
+        KubeEngine.logger.debug("Deleting deployment %s in %s" % (name, namespace))
+        status = self._api_appsv1.delete_namespaced_deployment(name, namespace)
+        self._deployment_cache.delete(name, namespace)
+        return status
+
+    # Returns the full pruned deployment object, its snapshot is stored in the cache
+    @kubapi_call('get', 'deployments')
     def readDeployment(self, name, namespace):
         KubeEngine.logger.debug("Reading deployment %s in %s" % (name, namespace))
-        return self._api_appsv1.read_namespaced_deployment(name, namespace, pretty=False)
+        try:
+            deployment = KubeDeploymentSnapshot.prune(self._api_appsv1.read_namespaced_deployment(name, namespace, pretty=False))
+        except ApiException as e:
+            if e.status == 404:
+                self._deployment_cache.delete(name, namespace)
+            raise
+        self._deployment_cache.put(deployment)
+        return deployment
 
-    @kubapi_call
+    # Returns the snapshot of the latest known deployment from the cache. Calls API only if the cache knows nothing about it
+    def getDeployment(self, name, namespace) -> KubeDeploymentSnapshot:
+        hit, deployment = self._deployment_cache.get(name, namespace)
+        if hit:
+            return deployment
+        self.readDeployment(name, namespace)
+        return self._deployment_cache.get(name, namespace)[1]
+
+    @kubapi_call('get', 'configmaps')
     def readConfigMap(self, name, namespace):
         return self._api_corev1.read_namespaced_config_map(name=name, namespace=namespace)
 
-    def watchDeployments(self, namespace, callback=None):
+    # Builds server-side selectors to watch only managed deployments
+    # Returns a list of selector arguments for watchDeployments, one item per watch:
+    # - a label selector if managed deployments are labeled
+    # - a field selector per name if there are only a few names
+    # - no selector to watch the whole namespace
+    # watched_names has names of the source and the clone of every deployment. Deployments, not names, are counted against
+    # FIELD_SELECTOR_MAX_WATCHES, so a namespace has up to twice as many per-name watches
+    def getDeploymentWatchSelectors(self, watched_names):
+        if self._settings.deployment_label_selector is not None:
+            return [{'label_selector': self._settings.deployment_label_selector}]
+        names = set(name for deployment_names in watched_names for name in deployment_names)
+        if 0 < len(watched_names) <= self._settings.field_selector_max_watches:
+            return [{'field_selector': 'metadata.name=%s' % name} for name in sorted(names)]
+        return [{}]
+
+    # The watch runs until stop_event is set
+    def watchDeployments(self, namespace, callback=None, field_selector=None, label_selector=None, stop_event=None):
         KubeEngine.logger.debug("Deployments watcher has been started")
-        while True:
-            w = watch.Watch()
-            try:
-                for event in w.stream(self._api_appsv1.list_namespaced_deployment, namespace=namespace):
-                    if callback is not None and len(event['object'].status.conditions) > 1 and event['object'].status.conditions[0].status and event['object'].status.conditions[1].status:
-                        KubeEngine.logger.debug("Event: %s %s to watch" % (event['type'], event['object'].metadata.name))
-                        callback(event)
-            except ApiException as e:
-                KubeEngine.logger.error("Exception when calling AppsV1Api->list_namespaced_deployment: %s\n" % e)
-            except Exception as ex:
-                KubeEngine.logger.exception(ex)
-
-    def watchConfigMaps(self, namespace, callback=None):
+        selectors = self._getSelectorArguments(field_selector, label_selector)
+        name = self._getWatchName('deployments', namespace, selectors)
+        self._runWatch(self._api_appsv1.list_namespaced_deployment, self._getDeploymentEventHandler(callback, name), name,
+                       stop_event, raw=self._isRawDecoder(), namespace=namespace, **selectors)
+
+    # Deployments of all namespaces with DEPLOYMENT_LABEL_SELECTOR. Used to check permissions of the cluster watch
+    @kubapi_call('list', 'deployments')
+    def listAllDeployments(self, limit=None):
+        return self._api_appsv1.list_deployment_for_all_namespaces(limit=limit, **self._getSelectorArguments(label_selector=self._settings.deployment_label_selector))
+
+    # One watch of deployments of all namespaces instead of a watch per namespace. It is filtered by DEPLOYMENT_LABEL_SELECTOR on the server
+    # and by namespaces (any container which supports "in") in the process, so deployments of other namespaces don't reach the cache
+    def watchAllDeployments(self, callback=None, namespaces=None, stop_event=None):
+        KubeEngine.logger.debug("Cluster deployments watcher has been started")
+        selectors = self._getSelectorArguments(label_selector=self._settings.deployment_label_selector)
+        name = self._getWatchName('deployments', '*', selectors)
+        self._runWatch(self._api_appsv1.list_deployment_for_all_namespaces, self._getDeploymentEventHandler(callback, name, namespaces), name,
+                       stop_event, raw=self._isRawDecoder(), **selectors)
+
+    def watchConfigMaps(self, namespace, callback=None, field_selector=None):
         KubeEngine.logger.debug("Configmaps watcher has been started")
-        while True:
-            w = watch.Watch()
-            try:
-                for event in w.stream(self._api_corev1.list_namespaced_config_map, namespace=namespace):
-                        KubeEngine.logger.debug("Event: %s %s %s to watch" % (event['type'], event['object'].metadata.name, event['object'].metadata.resource_version))
-                        if callback is not None:
-                            callback(event)
-            except ApiException as e:
-                KubeEngine.logger.error("Exception when calling CoreV1Api->list_namespaced_configmap: %s\n" % e)
-            except Exception as ex:
-                KubeEngine.logger.exception(ex)
-
-    @kubapi_call
+        selectors = self._getSelectorArguments(field_selector=field_selector)
+        self._runWatch(self._api_corev1.list_namespaced_config_map, self._getConfigMapEventHandler(callback),
+                       self._getWatchName('configmaps', namespace, selectors), None, namespace=namespace, **selectors)
+
+    # Deployment watches decode objects to KubeRawObject if DEPLOYMENT_DECODER is "raw"
+    def _isRawDecoder(self):
+        return self._settings.deployment_decoder == 'raw'
+
+    # Every deployment event is pruned and reduced to a snapshot once, the snapshot updates the cache and is checked by the predicates.
+    # Only events accepted by the predicates are passed to the callback, so status-only and redelivered events don't reach handlers
+    def _getDeploymentEventHandler(self, callback, name, namespaces=None):
+        pipeline = self._predicate_pipelines[name] = KubePredicatePipeline(self._settings.deployment_event_predicates)
+
+        def handleEvent(event):
+            if namespaces is not None and event['object'].metadata.namespace not in namespaces:
+                return
+            KubeDeploymentSnapshot.prune(event['object'])
+            snapshot_event = {'type': event['type'], 'object': KubeDeploymentSnapshot.fromDeployment(event['object'])}
+            self._deployment_cache.handleEvent(snapshot_event)
+            if callback is not None and pipeline.isAccepted(snapshot_event):
+                KubeEngine.logger.debug("Event: %s %s to watch" % (event['type'], event['object'].metadata.name))
+                callback(event)
+        return handleEvent
+
+    # Returns numbers of accepted and dropped deployment events by watch name
+    def getPredicateStats(self):
+        return {name: pipeline.getStats() for name, pipeline in list(self._predicate_pipelines.items())}
+
+    def _getConfigMapEventHandler(self, callback):
+        def handleEvent(event):
+            KubeEngine.logger.debug("Event: %s %s %s to watch" % (event['type'], event['object'].metadata.name, event['object'].metadata.resource_version))
+            if callback is not None:
+                callback(event)
+        return handleEvent
+
+    @staticmethod
+    def _getSelectorArguments(field_selector=None, label_selector=None):
+        selectors = {}
+        if field_selector is not None:
+            selectors['field_selector'] = field_selector
+        if label_selector is not None:
+            selectors['label_selector'] = label_selector
+        return selectors
+
+    @staticmethod
+    def _getWatchName(resource, namespace, selectors):
+        return '%s/%s' % (resource, namespace) + ''.join('?%s' % selector for selector in selectors.values())
+
+    # Runs list+watch which is resumed from the last resourceVersion. Returns only if stop_event is set
+    # A stopped watch is removed from watch states
+    def _runWatch(self, list_func, callback, name, stop_event=None, raw=False, **kwargs):
+        resumable_watch = KubeResumableWatch(list_func, callback, self._settings, KubeEngine.logger, name, raw=raw, **kwargs)
+        self._watches[name] = resumable_watch
+        try:
+            resumable_watch.run(stop_event)
+        finally:
+            self._forgetWatch(name, resumable_watch)
+
+    def _forgetWatch(self, name, resumable_watch):
+        if self._watches.get(name) is resumable_watch:
+            del self._watches[name]
+
+    # Returns KubeWatchState of every running watch
+    def getWatchStates(self):
+        return [resumable_watch.getState() for resumable_watch in list(self._watches.values())]
+
+    @kubapi_call('patch', 'deployments')
     def patchDeployment(self, name, namespace, patch_body):
-        return self._api_appsv1.patch_namespaced_deployment(name=name, namespace=namespace, body=patch_body)
+        return self._deployment_cache.put(self._api_appsv1.patch_namespaced_deployment(name=name, namespace=namespace, body=patch_body))
+
+    # Changes replicas through the scale subresource. Request and response are tiny V1Scale objects instead of whole deployments
+    # Returns the cached snapshot updated with replicas from the response
+    @kubapi_call('patch', 'deployments/scale')
+    def patchDeploymentScale(self, name, namespace, patch_body):
+        return self._deployment_cache.putScale(self._api_appsv1.patch_namespaced_deployment_scale(name=name, namespace=namespace, body=patch_body))
+
+    @kubapi_call('list', 'leases')
+    def listLeases(self, namespace, label_selector=None):
+        return self._api_coordinationv1.list_namespaced_lease(namespace, **self._getSelectorArguments(label_selector=label_selector))
+
+    @kubapi_call('create', 'leases')
+    def createLease(self, lease, namespace):
+        return self._api_coordinationv1.create_namespaced_lease(namespace, lease)
+
+    # The lease is replaced only if its resourceVersion isn't changed, otherwise 409 Conflict is logged and None is returned
+    @kubapi_call('update', 'leases')
+    def replaceLease(self, name, namespace, lease):
+        return self._api_coordinationv1.replace_namespaced_lease(name, namespace, lease)
+
+    # body is V1DeleteOptions, f.e. with a precondition on resourceVersion
+    @kubapi_call('delete', 'leases')
+    def deleteLease(self, name, namespace, body=None):
+        return self._api_coordinationv1.delete_namespaced_lease(name, namespace, body=body)
 
-    @kubapi_call
+    @kubapi_call('get', 'customobjects')
     def getCrd(self, crd_group, crd_version, namespace, crd_plural, name):
-        custom_api = kubernetes.client.CustomObjectsApi(self._getApiClient().getApiClient())
-        crd = custom_api.get_namespaced_custom_object(
+        crd = self._api_custom.get_namespaced_custom_object(
             crd_group,
             crd_version,
             namespace,
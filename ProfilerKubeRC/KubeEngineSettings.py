@@ -0,0 +1,112 @@
+import os
+import socket
+
+
+class KubeEngineSettings:
+    """
+    Tuning parameters for the kubernetes engine.
+    Every value can be overridden with an environment variable, otherwise the default value is used.
+
+    Watch parameters:
+        - WATCH_TIMEOUT: (int) seconds after which the API server closes a watch request. The watch is resumed from the last resourceVersion
+        - WATCH_STALL_GRACE: (int) extra seconds to wait for data before a watch connection is considered dead
+        - WATCH_BACKOFF_BASE: (float) first delay in seconds before a failed watch is reconnected
+        - WATCH_BACKOFF_MAX: (float) maximal delay in seconds between reconnects of a failed watch
+        - WATCH_SCOPE: (str) "namespace" to watch deployments by a watch per namespace, "cluster" to watch deployments of all namespaces by one watch.
+          The cluster watch needs permission to list deployments in all namespaces, otherwise namespace watches are used
+        - DEPLOYMENT_DECODER: (str) "model" to deserialize deployments of watches to OpenAPI models, "raw" to decode them by a fast JSON parser
+          to plain dicts. Raw objects are reduced to snapshots, a model is built only for the body of a clone
+
+    Event handling parameters:
+        - WORKERS: (int) number of threads which handle events of different deployments in parallel
+        - RECONCILE_API_CALL_BUDGET: (int) API calls allowed to handle one event of a source deployment. Reconciles over the budget are logged and counted
+
+        - DEPLOYMENT_EVENT_PREDICATES: (str) comma separated predicates to drop deployment events before handlers, "none" to pass all events.
+          "duplicate" drops redelivered resourceVersions, "spec" drops events without changes of generation, replicas or template hash
+
+    Selector parameters:
+        - DEPLOYMENT_LABEL_SELECTOR: (str) label selector of managed deployments. Source deployments have to be labeled, clones copy their labels
+        - FIELD_SELECTOR_MAX_WATCHES: (int) maximal number of deployments in a namespace which are watched by name. Every deployment
+          opens two watches, of the source and of the clone. More deployments are watched with one namespace watch
+
+    Connection parameters:
+        - API_POOL_SIZE: (int) connections to API server kept open by the synchronous engine. Requests over the pool size open extra connections
+          which are closed after the request. It has to cover workers, watches and background tasks, WORKERS + 8 by default
+        - API_CONNECT_TIMEOUT: (float) seconds to connect to API server
+        - API_READ_TIMEOUT: (float) seconds to wait for a response of an API call. Watches use their own read timeout
+        - API_COMPRESSION: (str) "gzip" to ask API server for compressed responses of API calls and lists, "none" to disable it.
+          Watch streams are never compressed
+
+    Rate limit parameters:
+        - API_QPS: (float) average API calls per second of the application, 0 to disable the client-side limit. Watches aren't limited
+        - API_BURST: (int) API calls which can be sent at once before calls are limited by API_QPS
+        - API_THROTTLE_RETRIES: (int) retries of a call which is answered with 429 Too Many Requests. All calls wait for its Retry-After
+
+    Write parameters:
+        - FIELD_MANAGER: (str) field manager of server-side apply requests. Fields applied by this manager are owned by the application
+        - REMOVED_CLONE_POLICY: (str) what to do with the clone of a deployment which was removed from the configuration:
+          "scale-down" scales it to 0 replicas, "delete" deletes it, "keep" leaves it unchanged
+
+    Health parameters:
+        - HEALTH_HOST: (str) address of the HTTP server with /livez, /readyz and /metrics
+        - HEALTH_PORT: (int) port of the HTTP server
+        - HEALTH_LIVENESS_STALE: (int) seconds without data or failed requests of a watch after which the watch is stuck and /livez fails
+
+    Sharding parameters:
+        - SHARD_GROUP: (str) name of the group of operator replicas which split managed deployments. Sharding is disabled if it is empty
+        - SHARD_IDENTITY: (str) unique name of the replica in the group, the host (pod) name by default
+        - SHARD_LEASE_DURATION: (int) seconds after which a replica which doesn't renew its lease leaves the group
+        - SHARD_RENEW_INTERVAL: (float) seconds between renewals of the lease
+        - SHARD_VIRTUAL_NODES: (int) points of every replica on the hash ring. More points give more even split of deployments
+        - SHARD_LEASE_RETENTION: (int) seconds after which the lease of a replica which has left the group is deleted
+    """
+
+    def __init__(self, environ=None):
+        self._environ = os.environ if environ is None else environ
+        self.watch_timeout = self._getInt('WATCH_TIMEOUT', 15)
+        self.watch_stall_grace = self._getInt('WATCH_STALL_GRACE', 5)
+        self.watch_backoff_base = self._getFloat('WATCH_BACKOFF_BASE', 0.5)
+        self.watch_backoff_max = self._getFloat('WATCH_BACKOFF_MAX', 30.0)
+        self.watch_scope = self._getChoice('WATCH_SCOPE', 'namespace', ('namespace', 'cluster'))
+        self.deployment_decoder = self._getChoice('DEPLOYMENT_DECODER', 'model', ('model', 'raw'))
+        self.workers = self._getInt('WORKERS', 4)
+        self.reconcile_api_call_budget = self._getInt('RECONCILE_API_CALL_BUDGET', 2)
+        self.deployment_event_predicates = self._getList('DEPLOYMENT_EVENT_PREDICATES', 'duplicate,spec')
+        self.deployment_label_selector = self._getStr('DEPLOYMENT_LABEL_SELECTOR', None)
+        self.field_selector_max_watches = self._getInt('FIELD_SELECTOR_MAX_WATCHES', 2)
+        self.api_pool_size = self._getInt('API_POOL_SIZE', self.workers + 8)
+        self.api_connect_timeout = self._getFloat('API_CONNECT_TIMEOUT', 5.0)
+        self.api_read_timeout = self._getFloat('API_READ_TIMEOUT', 30.0)
+        self.api_compression = self._getChoice('API_COMPRESSION', 'gzip', ('gzip', 'none'))
+        self.api_qps = self._getFloat('API_QPS', 20.0)
+        self.api_burst = self._getInt('API_BURST', 40)
+        self.api_throttle_retries = self._getInt('API_THROTTLE_RETRIES', 3)
+        self.field_manager = self._getStr('FIELD_MANAGER', 'kube-deploy-duplicate')
+        self.removed_clone_policy = self._getChoice('REMOVED_CLONE_POLICY', 'scale-down', ('scale-down', 'delete', 'keep'))
+        self.health_host = self._getStr('HEALTH_HOST', '0.0.0.0')
+        self.health_port = self._getInt('HEALTH_PORT', 8234)
+        self.health_liveness_stale = self._getInt('HEALTH_LIVENESS_STALE', 300)
+        self.shard_group = self._getStr('SHARD_GROUP', None)
+        self.shard_identity = self._getStr('SHARD_IDENTITY', socket.gethostname())
+        self.shard_lease_duration = self._getInt('SHARD_LEASE_DURATION', 15)
+        self.shard_renew_interval = self._getFloat('SHARD_RENEW_INTERVAL', 5.0)
+        self.shard_virtual_nodes = self._getInt('SHARD_VIRTUAL_NODES', 64)
+        self.shard_lease_retention = self._getInt('SHARD_LEASE_RETENTION', 600)
+
+    def _getInt(self, variable, default):
+        return int(self._environ.get(variable, default))
+
+    def _getFloat(self, variable, default):
+        return float(self._environ.get(variable, default))
+
+    def _getStr(self, variable, default):
+        return self._environ.get(variable, default) or default
+
+    def _getChoice(self, variable, default, choices):
+        value = self._getStr(variable, default)
+        if value not in choices:
+            raise ValueError("%s has to be one of %s, got %s" % (variable, ', '.join(choices), value))
+        return value
+
+    def _getList(self, variable, default):
+        return [item.strip() for item in self._getStr(variable, default).split(',') if item.strip() not in ('', 'none')]
@@ -1,22 +1,23 @@
 from abc import ABC, abstractmethod
-from dependency_injector.wiring import inject, Provide
 import threading
+import time
+from dependency_injector.wiring import inject, Provide
 
 from ProfilerKubeRC.KubeEngine import KubeEngine
-from ProfilerKubeRC.container import EngineContainer
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
+from ProfilerKubeRC.TasksManager import TasksManager
+from ProfilerKubeRC.container import EngineContainer, TasksContainer
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 
 
-lock = threading.Lock()
-
 '''
  Interfaces for event handler object. Should be refactored
 '''
 class KubeEventListenerInterface(ABC):
 
     @abstractmethod
-    def runWatcher(self):
+    def runWatcher(self, selector=None):
         pass
 
     @abstractmethod
@@ -33,6 +34,11 @@ class KubeEventHandlerInterface(ABC):
     def update(self):
         pass
 
+    # Names of kubernetes objects which events the handler needs
+    @abstractmethod
+    def getWatchedNames(self):
+        pass
+
 class AKubeEventListener(ABC):
 
     @abstractmethod
@@ -45,12 +51,25 @@ class AKubeEventListener(ABC):
 
 
 class KubeEventListener(AKubeEventListener):
+    """
+    Base class of events' listeners.
+    Events are not handled in watcher threads, they are queued in the work queue by the key "namespace/name" of the handler.
+    Workers of the queue handle events of different keys in parallel and events of one key one by one.
+    Watchers run as tasks of TasksManager and don't catch their errors, so a failed watch is logged, recorded and restarted by the manager.
+    With an asyncio engine the manager supervises runWatcherAsync in the engine's event loop, so watches don't hold threads
+
+    Public methods:
+        - getNamespace: returns the watched namespace
+        - addWatcherTask: register the watcher as a task of TasksManager
+    """
 
     def __init__(self, namespace):
         self._setLogger()
         self._namespace = namespace
         self._event_listeners = []
         self._setKubeEngine()
+        self._setWorkQueue()
+        self._setTasksManager()
 
     @inject
     def _setKubeEngine(self, engine: KubeEngine = Provide[EngineContainer.kube_engine]):
@@ -60,6 +79,23 @@ class KubeEventListener(AKubeEventListener):
     def _setLogger(self, logger: SLogger = Provide[LoggerContainer.logger_svc]):
         self._logger = logger
 
+    @inject
+    def _setWorkQueue(self, work_queue: KubeWorkQueue = Provide[TasksContainer.work_queue]):
+        self._work_queue = work_queue
+
+    @inject
+    def _setTasksManager(self, tasks_manager: TasksManager = Provide[TasksContainer.tasks_manager]):
+        self._tasks_manager = tasks_manager
+
+    def getNamespace(self):
+        return self._namespace
+
+    # Watches of an asyncio engine are supervised as coroutines in its event loop
+    def addWatcherTask(self, arguments=(), name=None):
+        if self._kube_engine.isAsync():
+            return self._tasks_manager.addTask(self.runWatcherAsync, arguments, name=name, runner=self._kube_engine.runCoroutine)
+        return self._tasks_manager.addTask(self.runWatcher, arguments, name=name)
+
     def addEventHandler(self, listener: KubeEventHandlerInterface):
         self._event_listeners.append(listener)
 
@@ -70,42 +106,166 @@ class KubeEventListener(AKubeEventListener):
 class KubeDeploymentEventListener(KubeEventListener):
     """
     Watch deployments' events and run callback to handle them
+    Handlers are indexed by namespace and names of their source and cloned deployments,
+    so an event is passed only to its own handler
 
     Public methods:
-        - runWatcher: Watch k8s events
+        - runWatcher: Watch k8s events until stop_event is set. With an asyncio engine the watch runs in the engine's event loop and the method waits for it
+        - runWatcherAsync: Coroutine to watch k8s events in the event loop of an asyncio engine
+        - runWatchers: Start a watch task for every selector of the handlers and stop watches which aren't needed anymore
+        - getWatchSelectors: Server-side selectors to watch only deployments of the handlers
+        - addEventHandler: Register a handler and index its deployment names
+        - removeEventHandler: Unregister a handler. Its events aren't handled anymore
+        - hasEventHandlers: Are there registered handlers
+        - reindexEventHandler: Update index of the handler if names of its deployments were changed
         - update: run callback function to handle  k8s events
     """
-    def runWatcher(self):
-        try:
-            self._kube_engine.watchDeployments(self._namespace, self.update)
-        except Exception as e:
-            self._logger.exception(e)
+    def __init__(self, namespace):
+        super().__init__(namespace)
+        self._handlers = {}                 # (namespace, name) -> handler
+        self._handler_keys = {}             # handler -> list of its (namespace, name) keys
+        self._watchers = {}                 # selector as a sorted tuple of items -> stop event of its watch
+        self._watchers_lock = threading.Lock()
+
+    def runWatcher(self, selector=None, stop_event=None):
+        if self._kube_engine.isAsync():
+            return self._kube_engine.runCoroutine(self.runWatcherAsync(selector, stop_event)).result()
+        self._kube_engine.watchDeployments(self._namespace, self.update, stop_event=stop_event, **(selector or {}))
+
+    async def runWatcherAsync(self, selector=None, stop_event=None):
+        await self._kube_engine.watchDeploymentsAsync(self._namespace, self.update, stop_event=stop_event, **(selector or {}))
+
+    # Selectors depend on names of the handlers, so they are changed when handlers are added or removed.
+    # A namespace without handlers isn't watched
+    def runWatchers(self):
+        with self._watchers_lock:
+            selectors = {tuple(sorted(selector.items())): selector for selector in self.getWatchSelectors()} if self._event_listeners else {}
+            for key in set(self._watchers) - set(selectors):
+                self._watchers.pop(key).set()
+            for key, selector in selectors.items():
+                if key not in self._watchers:
+                    stop_event = self._watchers[key] = threading.Event()
+                    self.addWatcherTask((selector, stop_event), name='deployments/%s %s' % (self._namespace, selector))
+
+    # Each selector has to be watched by a separate runWatcher call
+    def getWatchSelectors(self):
+        return self._kube_engine.getDeploymentWatchSelectors([deploy.getWatchedNames() for deploy in self._event_listeners])
+
+    def addEventHandler(self, listener: KubeEventHandlerInterface):
+        super().addEventHandler(listener)
+        self._indexEventHandler(listener)
+
+    def hasEventHandlers(self):
+        return len(self._event_listeners) > 0
+
+    def removeEventHandler(self, listener: KubeEventHandlerInterface):
+        if listener in self._event_listeners:
+            self._event_listeners.remove(listener)
+        for key in self._handler_keys.pop(listener, []):
+            if self._handlers.get(key) is listener:
+                del self._handlers[key]
+
+    # New keys are added before stale ones are removed, so watcher threads never miss the handler
+    def reindexEventHandler(self, listener: KubeEventHandlerInterface):
+        if listener in self._handler_keys:
+            old_keys = self._handler_keys[listener]
+            self._indexEventHandler(listener)
+            for key in set(old_keys) - set(self._handler_keys[listener]):
+                if self._handlers.get(key) is listener:
+                    del self._handlers[key]
+
+    def _indexEventHandler(self, listener: KubeEventHandlerInterface):
+        keys = [(self._namespace, name) for name in listener.getWatchedNames()]
+        for key in keys:
+            self._handlers[key] = listener
+        self._handler_keys[listener] = keys
+
+    # Events of the source and the cloned deployments are queued by the key of the handler,
+    # so they are never handled in parallel. Each deployment has its own slot to keep only its latest event
+    def update(self, event):
+        deploy = self._handlers.get((event['object'].metadata.namespace, event['object'].metadata.name))
+        if deploy is None:
+            return
+        event['received_at'] = time.monotonic()         # to measure latency from the event to the converged clone
+        self._work_queue.add(deploy.getKey(), event['object'].metadata.name, deploy.eventHandler, event)
+
+
+class KubeClusterDeploymentEventListener(KubeEventListener):
+    """
+    Watch deployments of all namespaces by one watch and route events to listeners of their namespaces.
+    Events of namespaces without a listener are dropped by the engine before they reach the cache
+
+    Public methods:
+        - runWatcher: Watch k8s events until stop_event is set. With an asyncio engine the watch runs in the engine's event loop and the method waits for it
+        - runWatcherAsync: Coroutine to watch k8s events in the event loop of an asyncio engine
+        - runWatchers: Start the watch task once
+        - addNamespaceListener: Route events of the namespace to its deployments' listener
+        - removeNamespaceListener: Stop routing events of the namespace
+        - getNamespaces: returns namespaces with listeners
+        - update: pass k8s event to the listener of its namespace
+    """
+    def __init__(self):
+        super().__init__(None)
+        self._namespace_listeners = {}      # namespace -> KubeDeploymentEventListener
+        self._stop_event = None
+
+    def addNamespaceListener(self, listener: KubeDeploymentEventListener):
+        self._namespace_listeners[listener.getNamespace()] = listener
+
+    def removeNamespaceListener(self, namespace):
+        self._namespace_listeners.pop(namespace, None)
+
+    def getNamespaces(self):
+        return sorted(self._namespace_listeners)
+
+    def runWatcher(self, selector=None, stop_event=None):
+        if self._kube_engine.isAsync():
+            return self._kube_engine.runCoroutine(self.runWatcherAsync(selector, stop_event)).result()
+        self._kube_engine.watchAllDeployments(self.update, self._namespace_listeners, stop_event=stop_event)
+
+    async def runWatcherAsync(self, selector=None, stop_event=None):
+        await self._kube_engine.watchAllDeploymentsAsync(self.update, self._namespace_listeners, stop_event=stop_event)
+
+    # The watch doesn't depend on handlers, so it is started only once
+    def runWatchers(self):
+        if self._stop_event is None:
+            self._stop_event = threading.Event()
+            self.addWatcherTask((None, self._stop_event), name='deployments/*')
 
     def update(self, event):
-        # lock all listeners while the update
-        with lock:
-            self._logger.debug("Updating deployments")
-            for deploy in self._event_listeners:
-                deploy.eventHandler(event)
+        listener = self._namespace_listeners.get(event['object'].metadata.namespace)
+        if listener is not None:
+            listener.update(event)
 
 
 class KubeCmEventListener(KubeEventListener):
     """
     Watch configmaps' events and run callback to handle them
+    :param namespace: namespace of configmaps
+    :param name: (optional) name of the only watched configmap. The API server filters events of other configmaps by a field selector
 
     Public methods:
-        - runWatcher: Watch k8s events
+        - runWatcher: Watch k8s events. With an asyncio engine the watch runs in the engine's event loop and the method waits for it
+        - runWatcherAsync: Coroutine to watch k8s events in the event loop of an asyncio engine
         - update: run callback function to handle  k8s events
     """
-    def runWatcher(self):
-        try:
-            self._kube_engine.watchConfigMaps(self._namespace, self.update)
-        except Exception as e:
-            self._logger.exception(e)
+    def __init__(self, namespace, name=None):
+        super().__init__(namespace)
+        self._name = name
+
+    def _getFieldSelector(self):
+        return 'metadata.name=%s' % self._name if self._name is not None else None
+
+    def runWatcher(self, selector=None):
+        if self._kube_engine.isAsync():
+            return self._kube_engine.runCoroutine(self.runWatcherAsync(selector)).result()
+        self._kube_engine.watchConfigMaps(self._namespace, self.update, self._getFieldSelector())
+
+    async def runWatcherAsync(self, selector=None):
+        await self._kube_engine.watchConfigMapsAsync(self._namespace, self.update, self._getFieldSelector())
 
     def update(self, event):
-        # lock all listeners while the update
-        with lock:
-            self._logger.debug("Updating configmaps")
-            for cm in self._event_listeners:
-                cm.eventHandler(event)
+        self._logger.debug("Updating configmaps")
+        key = '%s/%s' % (event['object'].metadata.namespace, event['object'].metadata.name)
+        for cm in self._event_listeners:
+            self._work_queue.add(key, cm, cm.eventHandler, event)
@@ -0,0 +1,92 @@
+import threading
+
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot
+
+
+class KubeInformerCache:
+    """
+    In-process store of the latest deployments seen by list/watch streams and by API responses.
+    Deployments are kept as frozen KubeDeploymentSnapshot objects keyed by (namespace, name), so full objects aren't held in memory.
+
+    Public methods:
+        - get(name, namespace): returns a tuple (hit, object). hit is False if the cache knows nothing about the object,
+          object is None if the cache knows that the object doesn't exist
+        - put(obj): store the snapshot of a deployment if it isn't older than the cached one. Returns the cached snapshot
+        - putScale(scale): apply replicas of a scale subresource response to the cached snapshot
+        - delete(name, namespace): forget an object and remember that it doesn't exist
+        - forget(name, namespace): forget everything about an object, f.e. when it isn't watched anymore
+        - handleEvent(event): apply a watch event to the cache
+        - clear(): drop all cached objects
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._objects = {}                  # (namespace, name) -> KubeDeploymentSnapshot
+        self._absent = set()                # (namespace, name) of objects which are known as not existing
+
+    # resourceVersion is an opaque string, but in practice it's a growing integer.
+    # Compare it only if both values are numeric otherwise a new object always wins
+    @staticmethod
+    def _isOlder(resource_version, cached):
+        try:
+            return int(resource_version) < int(cached.resource_version)
+        except (TypeError, ValueError):
+            return False
+
+    def get(self, name, namespace):
+        key = (namespace, name)
+        with self._lock:
+            if key in self._objects:
+                return True, self._objects[key]
+            return key in self._absent, None
+
+    def put(self, obj):
+        if obj is None or (not isinstance(obj, KubeDeploymentSnapshot) and obj.metadata is None):
+            return None
+        snapshot = KubeDeploymentSnapshot.fromDeployment(obj)           # built outside of the lock
+        key = (snapshot.namespace, snapshot.name)
+        with self._lock:
+            cached = self._objects.get(key)
+            if cached is not None and KubeInformerCache._isOlder(snapshot.resource_version, cached):
+                return cached
+            self._objects[key] = snapshot
+            self._absent.discard(key)
+        return snapshot
+
+    # Snapshots are frozen, so the cached one is replaced by a copy with new replicas and resourceVersion
+    def putScale(self, scale):
+        key = (scale.metadata.namespace, scale.metadata.name)
+        with self._lock:
+            cached = self._objects.get(key)
+            if cached is None or KubeInformerCache._isOlder(scale.metadata.resource_version, cached):
+                return cached
+            self._objects[key] = cached.withScale(scale)
+            return self._objects[key]
+
+    def delete(self, name, namespace):
+        key = (namespace, name)
+        with self._lock:
+            self._objects.pop(key, None)
+            self._absent.add(key)
+
+    def forget(self, name, namespace):
+        key = (namespace, name)
+        with self._lock:
+            self._objects.pop(key, None)
+            self._absent.discard(key)
+
+    def handleEvent(self, event):
+        obj = KubeDeploymentSnapshot.fromDeployment(event['object'])
+        if event['type'] == 'DELETED':
+            self.delete(obj.name, obj.namespace)
+        elif event['type'] in ('ADDED', 'MODIFIED'):
+            self.put(obj)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._absent.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._objects)
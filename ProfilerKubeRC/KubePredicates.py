@@ -0,0 +1,122 @@
+#
+# This file contents of:
+# - AKubeEventPredicate            : Interface of a filter of watch events
+# - KubeDuplicateVersionPredicate  : Drops redelivered events with an already seen resourceVersion
+# - KubeSpecChangePredicate        : Drops events which don't change generation, replicas or template hash of an object
+# - KubePredicatePipeline          : Runs events through predicates and counts filtered events per predicate
+
+import threading
+from abc import ABC, abstractmethod
+
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot, DESIRED_HASH_ANNOTATION
+
+
+class AKubeEventPredicate(ABC):
+    """
+    Filter of watch events. Predicates remember the last accepted version of each object.
+    Objects of events are KubeDeploymentSnapshot, so predicates don't depend on the decoding of objects
+
+    Public methods:
+        - isAccepted: returns False if the event has to be dropped
+    """
+    name = None
+
+    @staticmethod
+    def _getKey(obj):
+        return obj.namespace, obj.name
+
+    @abstractmethod
+    def isAccepted(self, event) -> bool:
+        pass
+
+
+class KubeDuplicateVersionPredicate(AKubeEventPredicate):
+    """
+    Drops events with the same resourceVersion as the last accepted event of the object,
+    f.e. events which are delivered again after a reconnect or a relist
+    """
+    name = 'duplicate'
+
+    def __init__(self):
+        self._versions = {}                 # (namespace, name) -> last accepted resourceVersion
+
+    def isAccepted(self, event) -> bool:
+        obj = event['object']
+        key = AKubeEventPredicate._getKey(obj)
+        if event['type'] == 'DELETED':
+            self._versions.pop(key, None)
+            return True
+        if self._versions.get(key) == obj.resource_version:
+            return False
+        self._versions[key] = obj.resource_version
+        return True
+
+
+class KubeSpecChangePredicate(AKubeEventPredicate):
+    """
+    Drops events which change only status of a deployment, f.e. progress of a rollout.
+    An event is accepted if generation, spec replicas or the template hash differs from the last accepted version of the object.
+    Generation is increased by the API server on every change of the spec. The template hash covers labels and annotations too,
+    they are changed without a new generation
+    """
+    name = 'spec'
+
+    def __init__(self):
+        self._states = {}                   # (namespace, name) -> state of the last accepted version
+
+    @staticmethod
+    def _getState(obj):
+        return obj.generation, obj.replicas, obj.template_hash
+
+    def isAccepted(self, event) -> bool:
+        obj = event['object']
+        key = AKubeEventPredicate._getKey(obj)
+        if event['type'] == 'DELETED':
+            self._states.pop(key, None)
+            return True
+        state = KubeSpecChangePredicate._getState(obj)
+        if self._states.get(key) == state:
+            return False
+        self._states[key] = state
+        return True
+
+
+class KubePredicatePipeline:
+    """
+    Runs watch events of deployments through a chain of predicates. An event is dropped by the first predicate which doesn't accept it
+
+    :param names: names of predicates in the order to run them, f.e. ['duplicate', 'spec']
+
+    Public methods:
+        - isAccepted: returns False if any predicate drops the event
+        - getStats: returns numbers of accepted events and events dropped by each predicate
+    """
+    predicates = {
+        KubeDuplicateVersionPredicate.name: KubeDuplicateVersionPredicate,
+        KubeSpecChangePredicate.name: KubeSpecChangePredicate
+    }
+
+    def __init__(self, names):
+        unknown = [name for name in names if name not in KubePredicatePipeline.predicates]
+        if unknown:
+            raise ValueError("Unknown event predicates: %s" % ', '.join(unknown))
+        self._predicates = [KubePredicatePipeline.predicates[name]() for name in names]
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._dropped = {name: 0 for name in names}
+
+    # The engine passes events with snapshots. Other objects are reduced to snapshots here
+    def isAccepted(self, event) -> bool:
+        if not isinstance(event['object'], KubeDeploymentSnapshot):
+            event = {'type': event['type'], 'object': KubeDeploymentSnapshot.fromDeployment(event['object'])}
+        with self._lock:
+            for predicate in self._predicates:
+                if not predicate.isAccepted(event):
+                    self._dropped[predicate.name] += 1
+                    return False
+            self._accepted += 1
+            return True
+
+    def getStats(self):
+        with self._lock:
+            return {'accepted': self._accepted, 'dropped': dict(self._dropped)}
@@ -0,0 +1,118 @@
+#
+# This file contents of:
+# - KubeRateLimiter     : Client-side token bucket of kubernetes API calls with priority lanes and pauses by 429 Retry-After
+#
+# Lanes in order of priority:
+# - replicas : changes of replicas through the scale subresource. They are waited by HPAs and users and must not stay behind other writes
+# - default  : reads, configmaps, leases and custom objects
+# - writes   : creates, applies, patches and deletes of deployments which change templates and configuration
+
+import threading
+import time
+
+LANE_REPLICAS = 'replicas'
+LANE_DEFAULT = 'default'
+LANE_WRITES = 'writes'
+LANES = (LANE_REPLICAS, LANE_DEFAULT, LANE_WRITES)
+
+WRITE_VERBS = ('create', 'apply', 'patch', 'update', 'delete')
+
+
+class KubeRateLimiter:
+    """
+    Token bucket which allows qps API calls per second on average and bursts of burst calls.
+    A call of a lane waits while calls of lanes with higher priority are waiting, so replica changes get the next free token
+    before template writes queued earlier. A 429 response pauses all lanes for its Retry-After seconds, after the pause
+    tokens are given at qps rate again. The limiter is disabled if qps is 0
+
+    :param qps: average number of calls per second
+    :param burst: maximal number of calls without waiting
+    :param clock: monotonic clock in seconds
+
+    Public methods:
+        - getLane: returns the lane of an API call by its verb and resource
+        - isEnabled: returns False if qps is 0
+        - acquire: wait for a token of the lane, returns seconds of waiting
+        - pause: stop giving tokens for some seconds
+        - getStats: returns calls, delayed calls and seconds of waiting by lane, pauses and paused seconds
+    """
+
+    def __init__(self, qps, burst, clock=time.monotonic):
+        self._qps = float(qps)
+        self._burst = max(1, int(burst))
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._tokens = float(self._burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._waiting = {lane: 0 for lane in LANES}
+        self._stats = {lane: [0, 0, 0.0] for lane in LANES}     # lane -> [calls, delayed calls, seconds of waiting]
+        self._pauses = 0
+        self._paused_seconds = 0.0
+
+    @staticmethod
+    def getLane(verb, resource):
+        if resource == 'deployments/scale':
+            return LANE_REPLICAS
+        if resource == 'deployments' and verb in WRITE_VERBS:
+            return LANE_WRITES
+        return LANE_DEFAULT
+
+    def isEnabled(self):
+        return self._qps > 0
+
+    def acquire(self, lane=LANE_DEFAULT) -> float:
+        if not self.isEnabled():
+            return 0.0
+        started_at = self._clock()
+        delayed = False
+        with self._condition:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    delay = self._getDelay(lane, self._clock())
+                    if delay <= 0:
+                        self._tokens -= 1
+                        break
+                    delayed = True
+                    self._condition.wait(delay)
+            finally:
+                self._waiting[lane] -= 1
+                self._condition.notify_all()                    # calls of lower lanes check the bucket again
+            waited = self._clock() - started_at if delayed else 0.0
+            stats = self._stats[lane]
+            stats[0] += 1
+            stats[1] += 1 if delayed else 0
+            stats[2] += waited
+        return waited
+
+    # Seconds to wait before the next check. Calls of lanes with higher priority take tokens first
+    def _getDelay(self, lane, now):
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._qps)
+        self._updated = now
+        if any(self._waiting[higher] for higher in LANES[:LANES.index(lane)]):
+            return 1.0 / self._qps
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self._qps
+
+    def pause(self, seconds):
+        with self._condition:
+            now = self._clock()
+            paused_until = now + seconds
+            if paused_until <= self._paused_until:
+                return
+            self._paused_seconds += paused_until - max(now, self._paused_until)
+            self._pauses += 1
+            self._paused_until = self._updated = paused_until
+            self._tokens = 0.0
+            self._condition.notify_all()
+
+    def getStats(self):
+        with self._condition:
+            return {
+                'lanes': {lane: {'calls': calls, 'delayed': delayed, 'wait_seconds_total': seconds}
+                          for lane, (calls, delayed, seconds) in self._stats.items()},
+                'pauses': self._pauses,
+                'paused_seconds_total': self._paused_seconds
+            }
@@ -0,0 +1,103 @@
+#
+# This file contents of:
+# - KubeRawMetadata  : Metadata of a decoded object which is read by watches, listeners and logs
+# - KubeRawObject    : Kubernetes object decoded from JSON to plain dicts. Its OpenAPI model is built only on demand
+# - KubeRawDecoder   : Decoder of list responses and watch events without deserialization to OpenAPI models
+#
+# orjson is an optional dependency. The standard json module is used without it
+
+import json
+import threading
+from types import SimpleNamespace
+from kubernetes import client, watch
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LIST_SUFFIX = 'List'
+
+
+class KubeRawMetadata:
+    """
+    Name, namespace and resourceVersion of a decoded object. They are read as attributes like metadata of OpenAPI models
+    """
+    __slots__ = ('name', 'namespace', 'resource_version')
+
+    def __init__(self, metadata):
+        self.name = metadata.get('name')
+        self.namespace = metadata.get('namespace')
+        self.resource_version = metadata.get('resourceVersion')
+
+
+class KubeRawObject:
+    """
+    Kubernetes object decoded from JSON. The object is kept as plain dicts, only its metadata is read as attributes
+
+    :param raw: decoded object
+    :param model_type: name of the OpenAPI model of the object, f.e. 'V1Deployment'
+
+    Public methods:
+        - toModel: returns the object deserialized to its OpenAPI model. Models are built only if they are really needed
+    """
+    __slots__ = ('raw', 'metadata', '_model_type')
+
+    def __init__(self, raw, model_type):
+        self.raw = raw
+        self.metadata = KubeRawMetadata(raw.get('metadata') or {})
+        self._model_type = model_type
+
+    def toModel(self):
+        return KubeRawDecoder.deserialize(self.raw, self._model_type)
+
+
+class KubeRawDecoder:
+    """
+    Decodes list responses and watch events which were requested with _preload_content=False by orjson if it is installed.
+    Objects are returned as KubeRawObject instead of OpenAPI models, so reflection of the kubernetes client isn't run for every object.
+    The interface of watch events is the same as kubernetes.watch.Watch has
+
+    Public methods:
+        - get_return_type: returns the model type of items of a list function
+        - unmarshal_event: decode a line of a watch stream. ERROR events are returned as they are, their object stays a dict
+        - decodeList: decode a list response, returns items and resourceVersion of the list
+        - deserialize: build the OpenAPI model of a decoded object
+        - loads / dumps: JSON parser and serializer
+    """
+    _api_client = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+
+    @staticmethod
+    def dumps(value):
+        return orjson.dumps(value) if orjson is not None else json.dumps(value)
+
+    # The return type is parsed from the docstring of the list function, f.e. V1DeploymentList -> V1Deployment
+    @staticmethod
+    def get_return_type(func):
+        return_type = watch.watch._find_return_type(func)
+        return return_type[:-len(LIST_SUFFIX)] if return_type.endswith(LIST_SUFFIX) else return_type
+
+    def unmarshal_event(self, line, return_type):
+        event = KubeRawDecoder.loads(line)
+        event['raw_object'] = event['object']
+        if event['type'] != 'ERROR':
+            event['object'] = KubeRawObject(event['object'], return_type)
+        return event
+
+    def decodeList(self, data, return_type):
+        result = KubeRawDecoder.loads(data)
+        items = [KubeRawObject(item, return_type) for item in result.get('items') or ()]
+        return items, (result.get('metadata') or {}).get('resourceVersion')
+
+    # Models of the synchronous client are built for both engines, they are serialized by both API clients the same way
+    @classmethod
+    def deserialize(cls, raw, model_type):
+        with cls._lock:
+            if cls._api_client is None:
+                cls._api_client = client.ApiClient()
+        return cls._api_client.deserialize(SimpleNamespace(data=KubeRawDecoder.dumps(raw)), model_type)
@@ -0,0 +1,286 @@
+#
+# This file contents of:
+# - KubeHashRing          : Consistent hashing of keys "namespace/name" to members of a shard group
+# - KubeShardCoordinator  : Membership of operator replicas in a shard group through Lease objects
+#
+# Every replica of the operator holds its own Lease and renews it. Replicas with renewed leases are members of the group,
+# managed deployments are split between members by the hash ring. When a replica joins or leaves the group, only keys which
+# move to or from it change their owner. A replica which can't renew its lease leaves its own ring when the lease expires,
+# at the same time as other replicas take its keys over. A joining replica takes its keys only after other members have seen
+# its lease at their renewals and dropped them, so keys have two owners only while renewals of other members fail
+
+import bisect
+import hashlib
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from dependency_injector.wiring import inject, Provide
+from kubernetes.client import V1DeleteOptions, V1Lease, V1LeaseSpec, V1ObjectMeta, V1Preconditions
+
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.container import EngineContainer
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.logger import SLogger
+
+SHARD_GROUP_LABEL = 'ddprofiler-rc/shard-group'
+
+
+class KubeHashRing:
+    """
+    Consistent hash ring. Every member gets virtual_nodes points on the ring, a key belongs to the member of the next point.
+    Hashes don't depend on the process, so all replicas agree on owners of keys if they know the same members
+
+    :param members: names of members
+    :param virtual_nodes: number of points of every member
+
+    Public methods:
+        - getOwner: returns the member which owns the key or None if there are no members
+        - getMembers: returns sorted names of members
+    """
+
+    def __init__(self, members, virtual_nodes=64):
+        self._members = sorted(set(members))
+        points = sorted((KubeHashRing._hash('%s#%d' % (member, i)), member) for member in self._members for i in range(virtual_nodes))
+        self._hashes = [point for point, member in points]
+        self._owners = [member for point, member in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def getOwner(self, key):
+        if not self._owners:
+            return None
+        return self._owners[bisect.bisect(self._hashes, KubeHashRing._hash(key)) % len(self._owners)]
+
+    def getMembers(self):
+        return list(self._members)
+
+
+class KubeShardCoordinator:
+    """
+    Membership of this replica in the shard group SHARD_GROUP and ownership of managed keys.
+    The replica holds the Lease "<group>-<identity>" labeled with the group in the namespace of the operator
+    and renews it every SHARD_RENEW_INTERVAL seconds. Leases of the group are listed at every renewal.
+    A lease which wasn't renewed for its leaseDurationSeconds is expired. The time is measured by the local clock since the renewal
+    was seen, so clocks of replicas don't have to be synchronized. This replica is a member of its own ring only while its own lease
+    isn't expired: the time is measured since the last successful renewal was sent, so this replica drops its keys not later than others take them.
+    A replica which joins a group with other members owns no keys for 2 * SHARD_RENEW_INTERVAL: other members see its lease
+    at their next renewal and drop its keys, the second interval is a grace for slow renewals.
+    The lease is deleted when the replica leaves the group. Leases of replicas which left the group without it are deleted
+    after SHARD_LEASE_RETENTION seconds by the member which owns the name of the lease on the ring.
+    Without SHARD_GROUP sharding is disabled and every key is owned
+
+    :param namespace: namespace of leases
+    :param identity: (optional) name of this replica instead of SHARD_IDENTITY
+
+    Public methods:
+        - isEnabled: is sharding configured
+        - join: renew the lease and read members once. It is called at start to know own keys before the first reconcile
+        - renew: renew the lease and read members. Returns True if members were changed
+        - runMembership: renew the lease every SHARD_RENEW_INTERVAL seconds until stop_event is set, then leave the group. Runs in its own task
+        - leave: delete the own lease, so other replicas take its keys over without waiting for its expiration. Does nothing if it has left already
+        - isOwned: does this replica own the key "namespace/name"
+        - addRebalanceHandler: register a function which is called without arguments after members or own keys were changed
+        - getMembers: returns names of members
+        - getStats: returns members, renewals, failed renewals, rebalances and deleted expired leases
+    """
+
+    def __init__(self, namespace, identity=None):
+        self._setLogger()
+        self._setKubeEngine()
+        self._setEngineSettings()
+        self._namespace = namespace
+        self._group = self._settings.shard_group
+        self._identity = identity if identity is not None else self._settings.shard_identity
+        self._lease: V1Lease = None                 # the latest own lease from API server
+        self._renewed_at = None                     # local time when the latest successful renewal was sent
+        self._observed = {}                         # holder identity -> (renew time, local time when it was seen)
+        self._ring = KubeHashRing([self._identity], self._settings.shard_virtual_nodes)
+        self._is_member = False                     # this replica was in the members of the latest renewal
+        self._handoff_at = None                     # local time after which a joined replica takes its keys
+        self._handlers = []
+        self._lock = threading.Lock()               # guards the ring and the handoff
+        self._membership_lock = threading.Lock()    # serializes renewals and leaving of the membership task and of the stopping service
+        self._renewals = 0
+        self._failed_renewals = 0
+        self._rebalances = 0
+        self._collected_leases = 0
+
+    @inject
+    def _setLogger(self, logger: SLogger = Provide[LoggerContainer.logger_svc]):
+        self._logger = logger
+
+    @inject
+    def _setKubeEngine(self, engine: KubeEngine = Provide[EngineContainer.kube_engine]):
+        self._kube_engine = engine
+
+    @inject
+    def _setEngineSettings(self, settings: KubeEngineSettings = Provide[EngineContainer.engine_settings]):
+        self._settings = settings
+
+    def isEnabled(self):
+        return self._group is not None
+
+    def _getLeaseName(self):
+        return re.sub(r'[^a-z0-9.-]', '-', ('%s-%s' % (self._group, self._identity)).lower())
+
+    def join(self):
+        if self.isEnabled():
+            self.renew()
+            self._logger.info("Shard %s has joined group %s with members %s" % (self._identity, self._group, self.getMembers()))
+
+    def runMembership(self, stop_event: threading.Event = None):
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        while not stop_event.wait(self._settings.shard_renew_interval):
+            self.renew()
+        self.leave()
+
+    # The stopping service and the membership task can both leave, the lease is deleted only once
+    def leave(self):
+        if not self.isEnabled():
+            return
+        with self._membership_lock:
+            lease, self._lease = self._lease, None
+            if lease is None:
+                return
+            self._renewed_at = None
+            self._setMembers([member for member in self.getMembers() if member != self._identity])
+            if self._kube_engine.deleteLease(lease.metadata.name, self._namespace) is not None:
+                self._logger.info("Shard %s has left group %s" % (self._identity, self._group))
+
+    # Members other than this replica are kept if leases can't be listed, this replica leaves them when its own lease expires
+    def renew(self):
+        with self._membership_lock:
+            self._renewLease()
+            leases = self._kube_engine.listLeases(self._namespace, label_selector='%s=%s' % (SHARD_GROUP_LABEL, self._group))
+            if leases is None:
+                members = [member for member in self.getMembers() if member != self._identity]
+                members = sorted(members + [self._identity]) if self._isOwnLeaseAlive() else members
+            else:
+                members = self._getLiveMembers(leases.items)
+            changed = self._setMembers(members)
+            changed = self._completeHandoff() or changed
+            if leases is not None:
+                self._collectExpiredLeases(leases.items)
+            return changed
+
+    def _setMembers(self, members):
+        with self._lock:
+            is_member = self._identity in members
+            if is_member and not self._is_member and len(members) > 1:
+                self._handoff_at = time.monotonic() + 2 * self._settings.shard_renew_interval
+            elif not is_member:
+                self._handoff_at = None
+            self._is_member = is_member
+            if members == self._ring.getMembers():
+                return False
+            self._ring = KubeHashRing(members, self._settings.shard_virtual_nodes)
+            self._rebalances += 1
+        self._logger.info("Members of shard group %s have been changed: %s" % (self._group, members))
+        self._callHandlers()
+        return True
+
+    # Other members have dropped keys of this replica when the handoff time has passed, it takes them now
+    def _completeHandoff(self):
+        with self._lock:
+            if self._handoff_at is None or time.monotonic() < self._handoff_at:
+                return False
+            self._handoff_at = None
+            self._rebalances += 1
+        self._logger.info("Shard %s has taken its keys over in group %s" % (self._identity, self._group))
+        self._callHandlers()
+        return True
+
+    def _callHandlers(self):
+        for handler in list(self._handlers):
+            handler()
+
+    # Creates the lease at first and replaces it later. A conflict or an error forces to read the lease again at the next renewal
+    def _renewLease(self):
+        now = datetime.now(timezone.utc)
+        sent_at = time.monotonic()
+        if self._lease is None:
+            self._lease = self._findLease()
+        if self._lease is None:
+            self._lease = self._kube_engine.createLease(V1Lease(
+                metadata=V1ObjectMeta(name=self._getLeaseName(), namespace=self._namespace, labels={SHARD_GROUP_LABEL: self._group}),
+                spec=V1LeaseSpec(holder_identity=self._identity, lease_duration_seconds=self._settings.shard_lease_duration,
+                                 acquire_time=now, renew_time=now)), self._namespace)
+        else:
+            self._lease.spec.renew_time = now
+            self._lease.spec.lease_duration_seconds = self._settings.shard_lease_duration
+            self._lease = self._kube_engine.replaceLease(self._lease.metadata.name, self._namespace, self._lease)
+        if self._lease is None:
+            self._failed_renewals += 1
+        else:
+            self._renewals += 1
+            self._renewed_at = sent_at
+
+    def _isOwnLeaseAlive(self):
+        return self._renewed_at is not None and time.monotonic() - self._renewed_at <= self._settings.shard_lease_duration
+
+    def _findLease(self):
+        leases = self._kube_engine.listLeases(self._namespace, label_selector='%s=%s' % (SHARD_GROUP_LABEL, self._group))
+        for lease in leases.items if leases is not None else []:
+            if lease.metadata.name == self._getLeaseName():
+                return lease
+        return None
+
+    def _getLiveMembers(self, leases):
+        now = time.monotonic()
+        members = {self._identity} if self._isOwnLeaseAlive() else set()
+        observed = {}
+        for lease in leases:
+            identity = lease.spec.holder_identity if lease.spec is not None else None
+            if identity is None or identity == self._identity:
+                continue
+            renew_time, seen_at = self._observed.get(identity, (None, now))
+            if lease.spec.renew_time != renew_time:
+                seen_at = now
+            observed[identity] = (lease.spec.renew_time, seen_at)
+            if now - seen_at <= (lease.spec.lease_duration_seconds or self._settings.shard_lease_duration):
+                members.add(identity)
+        self._observed = observed
+        return sorted(members)
+
+    # Every member sees the same members, so only one of them deletes a lease. The precondition keeps a lease which was renewed meanwhile
+    def _collectExpiredLeases(self, leases):
+        now = time.monotonic()
+        for lease in leases:
+            identity = lease.spec.holder_identity if lease.spec is not None else None
+            if identity is None or identity == self._identity or identity not in self._observed:
+                continue
+            renew_time, seen_at = self._observed[identity]
+            expired_for = now - seen_at - (lease.spec.lease_duration_seconds or self._settings.shard_lease_duration)
+            if expired_for <= self._settings.shard_lease_retention or not self.isOwned(lease.metadata.name):
+                continue
+            body = V1DeleteOptions(preconditions=V1Preconditions(resource_version=lease.metadata.resource_version))
+            if self._kube_engine.deleteLease(lease.metadata.name, self._namespace, body) is not None:
+                self._logger.info("Expired lease %s of shard %s has been deleted" % (lease.metadata.name, identity))
+                self._observed.pop(identity, None)
+                self._collected_leases += 1
+
+    def isOwned(self, key):
+        if not self.isEnabled():
+            return True
+        with self._lock:
+            return self._handoff_at is None and self._ring.getOwner(key) == self._identity
+
+    def addRebalanceHandler(self, handler):
+        self._handlers.append(handler)
+
+    def getMembers(self):
+        with self._lock:
+            return self._ring.getMembers()
+
+    def getStats(self):
+        return {
+            'members': len(self.getMembers()),
+            'renewals': self._renewals,
+            'failed_renewals': self._failed_renewals,
+            'rebalances': self._rebalances,
+            'collected_leases': self._collected_leases
+        }
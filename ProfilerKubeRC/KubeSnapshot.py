@@ -0,0 +1,156 @@
+#
+# This file contents of:
+# - KubeDeploymentSnapshot  : Compact frozen state of a deployment which is kept in memory instead of V1Deployment
+#
+# Deployment objects are pruned at ingest and reduced to snapshots. Only the informer cache and the reconcilers hold snapshots,
+# the full object of a source deployment is read only when the body of its clone has to be built.
+# Snapshots are built from OpenAPI models and from raw decoded objects the same way
+
+import datetime
+import hashlib
+import json
+
+from ProfilerKubeRC.KubeRawDecoder import KubeRawObject
+
+# Annotation with a hash of the desired state of a cloned deployment
+DESIRED_HASH_ANNOTATION = 'ddprofiler-rc/desired-hash'
+LAST_APPLIED_ANNOTATION = 'kubectl.kubernetes.io/last-applied-configuration'
+
+
+class KubeDeploymentSnapshot:
+    """
+    Fields of a deployment which are read by reconcilers. Snapshots are shared by the cache and reconcilers and can't be changed
+
+    :param name, namespace, resource_version, generation: metadata of the deployment
+    :param replicas: spec replicas
+    :param status_replicas: running replicas
+    :param desired_hash: the desired-state hash annotation of a cloned deployment
+    :param template_hash: hash of labels, annotations and spec without replicas. It is changed when the clone has to be rebuilt
+    :param image: image of the first container
+    :param env: tuple of (name, value) pairs of env variables of the first container
+
+    Public methods:
+        - fromDeployment: build the snapshot of a deployment model or a KubeRawObject. A snapshot or None is returned as it is
+        - withScale: returns a copy with replicas and resourceVersion of a scale subresource response
+        - getKey: returns "namespace/name"
+        - prune: drop managedFields, the last-applied annotation and status conditions of a deployment object in place
+        - buildDesiredStateHash: hash of the desired state of a deployment object
+    """
+    __slots__ = ('name', 'namespace', 'resource_version', 'generation', 'replicas', 'status_replicas',
+                 'desired_hash', 'template_hash', 'image', 'env')
+
+    def __init__(self, name, namespace, resource_version=None, generation=None, replicas=None, status_replicas=None,
+                 desired_hash=None, template_hash=None, image=None, env=()):
+        for slot, value in zip(KubeDeploymentSnapshot.__slots__, (name, namespace, resource_version, generation, replicas, status_replicas,
+                                                                   desired_hash, template_hash, image, tuple(env))):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("KubeDeploymentSnapshot is frozen")
+
+    def __delattr__(self, name):
+        raise AttributeError("KubeDeploymentSnapshot is frozen")
+
+    def __repr__(self):
+        return 'KubeDeploymentSnapshot(%s)' % ', '.join('%s=%r' % (slot, getattr(self, slot)) for slot in KubeDeploymentSnapshot.__slots__
+                                                        if slot != 'env')
+
+    def getKey(self):
+        return '%s/%s' % (self.namespace, self.name)
+
+    @classmethod
+    def fromDeployment(cls, deployment):
+        if deployment is None or isinstance(deployment, KubeDeploymentSnapshot):
+            return deployment
+        if isinstance(deployment, KubeRawObject):
+            return cls._fromRaw(deployment)
+        metadata, spec, status = deployment.metadata, deployment.spec, deployment.status
+        container = cls._getFirstContainer(deployment)
+        return cls(
+            metadata.name, metadata.namespace, metadata.resource_version, metadata.generation,
+            replicas=spec.replicas if spec is not None else None,
+            status_replicas=status.replicas if status is not None else None,
+            desired_hash=(metadata.annotations or {}).get(DESIRED_HASH_ANNOTATION),
+            template_hash=cls.buildDesiredStateHash(deployment) if spec is not None else None,
+            image=container.image if container is not None else None,
+            env=((item.name, item.value) for item in (container.env or ())) if container is not None else ())
+
+    @classmethod
+    def _fromRaw(cls, deployment):
+        metadata, spec, status = deployment.raw.get('metadata') or {}, deployment.raw.get('spec'), deployment.raw.get('status') or {}
+        containers = (((spec or {}).get('template') or {}).get('spec') or {}).get('containers') or ()
+        container = containers[0] if containers else None
+        return cls(
+            metadata.get('name'), metadata.get('namespace'), metadata.get('resourceVersion'), metadata.get('generation'),
+            replicas=spec.get('replicas') if spec is not None else None,
+            status_replicas=status.get('replicas'),
+            desired_hash=(metadata.get('annotations') or {}).get(DESIRED_HASH_ANNOTATION),
+            template_hash=cls.buildDesiredStateHash(deployment) if spec is not None else None,
+            image=container.get('image') if container is not None else None,
+            env=((item.get('name'), item.get('value')) for item in (container.get('env') or ())) if container is not None else ())
+
+    @staticmethod
+    def _getFirstContainer(deployment):
+        spec = deployment.spec
+        if spec is None or spec.template is None or spec.template.spec is None or not spec.template.spec.containers:
+            return None
+        return spec.template.spec.containers[0]
+
+    # The scale subresource changes only replicas, so the template hash, image and env are kept
+    def withScale(self, scale):
+        return KubeDeploymentSnapshot(
+            self.name, self.namespace, scale.metadata.resource_version, self.generation,
+            replicas=scale.spec.replicas,
+            status_replicas=scale.status.replicas if scale.status is not None else self.status_replicas,
+            desired_hash=self.desired_hash, template_hash=self.template_hash, image=self.image, env=self.env)
+
+    # Fields which are large and never read by the application. They are dropped before an object is queued or cached
+    @staticmethod
+    def prune(deployment):
+        if isinstance(deployment, KubeRawObject):
+            metadata = deployment.raw.get('metadata') or {}
+            metadata.pop('managedFields', None)
+            (metadata.get('annotations') or {}).pop(LAST_APPLIED_ANNOTATION, None)
+            (deployment.raw.get('status') or {}).pop('conditions', None)
+            return deployment
+        if deployment is None or deployment.metadata is None:
+            return deployment
+        deployment.metadata.managed_fields = None
+        if deployment.metadata.annotations:
+            deployment.metadata.annotations.pop(LAST_APPLIED_ANNOTATION, None)
+        if deployment.status is not None:
+            deployment.status.conditions = None
+        return deployment
+
+    # Replicas aren't a part of the hash, they are changed by scale requests without a rollout.
+    # The hash is built from the JSON form of the object, so a model and a raw object of the same version have the same hash.
+    # The standard json module is used, so all replicas of the application get the same hash whatever JSON libraries are installed
+    @staticmethod
+    def buildDesiredStateHash(deployment):
+        if isinstance(deployment, KubeRawObject):
+            metadata = deployment.raw.get('metadata') or {}
+            labels, annotations, spec = metadata.get('labels'), metadata.get('annotations'), deployment.raw.get('spec')
+        else:
+            labels, annotations, spec = deployment.metadata.labels, deployment.metadata.annotations, deployment.spec
+        spec = KubeDeploymentSnapshot._toPlain(spec) or {}
+        spec.pop('replicas', None)
+        state = {
+            'labels': KubeDeploymentSnapshot._toPlain(labels),
+            'annotations': KubeDeploymentSnapshot._toPlain(annotations),
+            'spec': spec
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+    # JSON form of a model or of decoded JSON without empty fields, like the kubernetes client serializes models
+    @staticmethod
+    def _toPlain(value):
+        if isinstance(value, dict):
+            return {key: KubeDeploymentSnapshot._toPlain(item) for key, item in value.items() if item is not None}
+        if isinstance(value, (list, tuple)):
+            return [KubeDeploymentSnapshot._toPlain(item) for item in value]
+        if hasattr(value, 'openapi_types'):
+            return {value.attribute_map[attribute]: KubeDeploymentSnapshot._toPlain(getattr(value, attribute))
+                    for attribute in value.openapi_types if getattr(value, attribute) is not None}
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return value
@@ -0,0 +1,244 @@
+#
+# This file contents of:
+# - KubeBackoff            : Exponential backoff with jitter between reconnects
+# - KubeWatchState         : Progress of one resumable watch: last resourceVersion, resourceVersions of known objects and counters
+# - KubeResumableWatch     : list+watch loop which resumes from the last resourceVersion and relists only on 410 Gone
+
+import random
+import threading
+import time
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from ProfilerKubeRC.KubeRawDecoder import KubeRawDecoder, KubeRawObject
+
+HTTP_STATUS_GONE = 410
+
+
+class KubeBackoff:
+    """
+    Exponential backoff with full jitter
+
+    :param base: first delay in seconds
+    :param maximum: maximal delay in seconds
+
+    Public methods:
+        - nextDelay: returns a delay before the next attempt
+        - reset: start from the first delay after a successful attempt
+    """
+
+    def __init__(self, base, maximum):
+        self._base = base
+        self._maximum = maximum
+        self._attempt = 0
+
+    def nextDelay(self) -> float:
+        delay = min(self._maximum, self._base * (2 ** self._attempt))
+        self._attempt += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self._attempt = 0
+
+
+class KubeWatchState:
+    """
+    Progress of one resumable watch stream.
+    Only resourceVersions of known objects are kept, objects themselves are held by the informer cache as snapshots or aren't held at all
+
+    :param name: name of the watch to use in logs
+
+    Public methods:
+        - observe: remember an event received from the watch stream
+        - relistEvents: build synthetic events to sync known objects with a fresh list result
+        - expire: forget resourceVersion to force a relist
+        - touch: remember that the stream is alive
+        - fail: remember a failed request of the stream
+        - secondsSinceActivity: seconds since the last data from API server
+        - secondsSinceProgress: seconds since the last data or failed request. A watch without progress is stuck
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.resource_version = None        # Last seen resourceVersion. None means the list has to be reloaded
+        self.events = 0
+        self.bookmarks = 0
+        self.reconnects = 0
+        self.relists = 0
+        self.failures = 0
+        self.last_error = None
+        self._known = {}                    # (namespace, name) -> last seen resourceVersion
+        self._last_activity = time.monotonic()
+        self._last_progress = self._last_activity
+
+    @staticmethod
+    def _getKey(obj):
+        return obj.metadata.namespace, obj.metadata.name
+
+    def touch(self):
+        self._last_activity = self._last_progress = time.monotonic()
+
+    def fail(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+        self._last_progress = time.monotonic()
+
+    def secondsSinceActivity(self) -> float:
+        return time.monotonic() - self._last_activity
+
+    def secondsSinceProgress(self) -> float:
+        return time.monotonic() - self._last_progress
+
+    def expire(self):
+        self.resource_version = None
+
+    def observe(self, event):
+        obj = event['object']
+        self.resource_version = obj.metadata.resource_version
+        if event['type'] == 'BOOKMARK':
+            self.bookmarks += 1
+            return
+        self.events += 1
+        if event['type'] == 'DELETED':
+            self._known.pop(KubeWatchState._getKey(obj), None)
+        else:
+            self._known[KubeWatchState._getKey(obj)] = obj.metadata.resource_version
+
+    # Compares a fresh list with known objects.
+    # Objects which weren't known are ADDED, objects with another resourceVersion are MODIFIED,
+    # known objects which are missing in the list are DELETED. Objects of DELETED events have only metadata
+    # with name, namespace and the last seen resourceVersion, handlers of DELETED events don't read other fields
+    def relistEvents(self, items, resource_version, return_type=None):
+        events = []
+        known = self._known
+        self._known = {}
+        for obj in items:
+            key = KubeWatchState._getKey(obj)
+            if key not in known:
+                events.append({'type': 'ADDED', 'object': obj})
+            elif known.pop(key) != obj.metadata.resource_version:
+                events.append({'type': 'MODIFIED', 'object': obj})
+            self._known[key] = obj.metadata.resource_version
+        for (namespace, name), version in known.items():
+            deleted = KubeRawObject({'metadata': {'name': name, 'namespace': namespace, 'resourceVersion': version}}, return_type)
+            events.append({'type': 'DELETED', 'object': deleted})
+        self.resource_version = resource_version
+        self.relists += 1
+        return events
+
+
+class KubeResumableWatch:
+    """
+    Runs list+watch for one kubernetes list function and passes events to a callback.
+    The watch is resumed from the last seen resourceVersion and asks the API server for bookmarks,
+    so reconnects don't replay the whole namespace. The list is reloaded only at start and on 410 Gone.
+    Failed requests are retried with jittered exponential backoff.
+    The API server closes every request after watch_timeout seconds and the client read timeout is a bit longer,
+    so a dead connection is noticed within watch_timeout + watch_stall_grace seconds.
+    Raw watches request the list and the stream with _preload_content=False and decode them by KubeRawDecoder,
+    events of raw watches have KubeRawObject objects instead of OpenAPI models
+
+    :param list_func: kubernetes API list function, f.e. AppsV1Api.list_namespaced_deployment
+    :param callback: function to handle an event
+    :param settings: KubeEngineSettings
+    :param logger: logger
+    :param name: name of the watch to use in logs
+    :param raw: decode objects to KubeRawObject instead of OpenAPI models
+    :param kwargs: arguments of list_func, f.e. namespace
+
+    Public methods:
+        - run: run the watch loop until stop event is set
+        - getState: returns KubeWatchState
+    """
+
+    def __init__(self, list_func, callback, settings, logger, name, raw=False, **kwargs):
+        self._list_func = list_func
+        self._raw = raw
+        self._callback = callback
+        self._settings = settings
+        self._logger = logger
+        self._kwargs = kwargs
+        self._state = KubeWatchState(name)
+        self._backoff = KubeBackoff(settings.watch_backoff_base, settings.watch_backoff_max)
+        self._decoder = self._createDecoder()
+        self._return_type = self._decoder.get_return_type(list_func) if self._decoder is not None else None
+
+    def _createDecoder(self):
+        return KubeRawDecoder() if self._raw else watch.Watch()
+
+    def getState(self) -> KubeWatchState:
+        return self._state
+
+    def run(self, stop_event: threading.Event = None):
+        stop_event = stop_event if stop_event is not None else threading.Event()
+        while not stop_event.is_set():
+            try:
+                if self._state.resource_version is None:
+                    self._relist()
+                self._watch(stop_event)
+                self._backoff.reset()
+            except ApiException as e:
+                if e.status == HTTP_STATUS_GONE:
+                    self._logger.info("Watch %s: resourceVersion %s is expired, reloading the list" % (self._state.name, self._state.resource_version))
+                    self._state.expire()
+                    continue
+                self._onFailure(e, stop_event)
+                self._logger.error("Watch %s: exception when calling %s: %s" % (self._state.name, self._list_func.__name__, e))
+            except Exception as e:
+                self._onFailure(e, stop_event)
+                self._logger.exception(e)
+
+    def _onFailure(self, error, stop_event):
+        self._state.fail(error)
+        stop_event.wait(self._backoff.nextDelay())
+
+    def _getRequestTimeout(self):
+        return self._settings.watch_timeout + self._settings.watch_stall_grace
+
+    def _relist(self):
+        if self._raw:
+            response = self._list_func(_request_timeout=self._getRequestTimeout(), _preload_content=False, **self._kwargs)
+            try:
+                items, resource_version = self._decoder.decodeList(response.data, self._return_type)
+            finally:
+                response.release_conn()
+        else:
+            result = self._list_func(_request_timeout=self._getRequestTimeout(), **self._kwargs)
+            items, resource_version = result.items, result.metadata.resource_version
+        self._state.touch()
+        self._logger.debug("Watch %s: list is loaded at resourceVersion %s" % (self._state.name, resource_version))
+        for event in self._state.relistEvents(items, resource_version, self._return_type):
+            self._dispatch(event)
+
+    def _watch(self, stop_event):
+        self._state.reconnects += 1
+        response = self._list_func(
+            watch=True,
+            resource_version=self._state.resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=self._settings.watch_timeout,
+            _request_timeout=self._getRequestTimeout(),
+            _preload_content=False,
+            **self._kwargs)
+        self._state.touch()
+        try:
+            for line in watch.watch.iter_resp_lines(response):
+                self._state.touch()
+                event = self._decoder.unmarshal_event(line, self._return_type)
+                if event['type'] == 'ERROR':
+                    raise ApiException(status=event['raw_object'].get('code'), reason=event['raw_object'].get('message'))
+                self._state.observe(event)
+                if event['type'] != 'BOOKMARK':
+                    self._dispatch(event)
+                if stop_event.is_set():
+                    break
+        finally:
+            response.close()
+            response.release_conn()
+
+    # Errors of a handler mustn't break the watch stream
+    def _dispatch(self, event):
+        try:
+            self._callback(event)
+        except Exception as e:
+            self._logger.exception(e)
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque, OrderedDict
+from dependency_injector.wiring import inject, Provide
+
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.logger import SLogger
+
+
+class KubeWorkQueueStats:
+    """
+    Counters of a work queue
+
+    Public methods:
+        - asDict: returns counters as a dictionary
+    """
+
+    def __init__(self):
+        self.adds = 0                       # Number of added work items
+        self.coalesced = 0                  # Number of work items merged with a pending item of the same key and slot
+        self.processed = 0                  # Number of processed keys
+        self.wait_seconds_total = 0.0       # Time between the first pending work item of a key and the start of its processing
+        self.wait_seconds_max = 0.0
+        self.processing_seconds_total = 0.0
+        self.processing_seconds_max = 0.0
+
+    def observeWait(self, seconds):
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def observeProcessing(self, seconds):
+        self.processed += 1
+        self.processing_seconds_total += seconds
+        self.processing_seconds_max = max(self.processing_seconds_max, seconds)
+
+    def asDict(self):
+        return dict(self.__dict__)
+
+
+class KubeWorkQueue:
+    """
+    Work queue between watch threads and event handlers like a client-go workqueue.
+    Work is queued by a key, f.e. "namespace/name":
+        - pending work items of the same key and slot are merged, only the latest one is kept
+        - the same key is never processed by two workers at once. Work added while the key is processed waits for the end of processing
+        - different keys are processed in parallel by all running workers
+
+    Public methods:
+        - add: queue a work item for the key
+        - runWorker: process queued keys until shutdown. Has to be run in several threads to process keys in parallel
+        - shutdown: stop all workers
+        - getStats: returns queue depth, wait and processing time
+    """
+
+    def __init__(self):
+        self._setLogger()
+        self._condition = threading.Condition()
+        self._ready = deque()               # Keys ready to be processed in FIFO order
+        self._pending = {}                  # key -> OrderedDict(slot -> (task, args))
+        self._queued_at = {}                # key -> time when the first pending work item was added
+        self._processing = set()            # Keys processed at the moment
+        self._shutdown = False
+        self._stats = KubeWorkQueueStats()
+
+    @inject
+    def _setLogger(self, logger: SLogger = Provide[LoggerContainer.logger_svc]):
+        self._logger = logger
+
+    # Queue task(*args) for the key. A pending work item of the same key and slot is replaced with this one
+    def add(self, key, slot, task, *args):
+        with self._condition:
+            self._stats.adds += 1
+            work = self._pending.get(key)
+            if work is None:
+                work = self._pending[key] = OrderedDict()
+                self._queued_at[key] = time.monotonic()
+                if key not in self._processing:
+                    self._ready.append(key)
+                    self._condition.notify()
+            elif slot in work:
+                self._stats.coalesced += 1
+                del work[slot]
+            work[slot] = (task, args)
+
+    def runWorker(self):
+        while True:
+            item = self._get()
+            if item is None:
+                return
+            key, work, queued_at = item
+            started_at = time.monotonic()
+            try:
+                for task, args in work.values():
+                    try:
+                        task(*args)
+                    except Exception as e:
+                        self._logger.exception(e)
+            finally:
+                self._done(key, started_at - queued_at, time.monotonic() - started_at)
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+    def _get(self):
+        with self._condition:
+            while not self._ready and not self._shutdown:
+                self._condition.wait()
+            if self._shutdown:
+                return None
+            key = self._ready.popleft()
+            self._processing.add(key)
+            return key, self._pending.pop(key), self._queued_at.pop(key)
+
+    def _done(self, key, wait_seconds, processing_seconds):
+        with self._condition:
+            self._processing.discard(key)
+            self._stats.observeWait(wait_seconds)
+            self._stats.observeProcessing(processing_seconds)
+            if key in self._pending:                    # work was added while the key was processed
+                self._ready.append(key)
+                self._condition.notify()
+
+    def getStats(self):
+        with self._condition:
+            stats = self._stats.asDict()
+            stats['depth'] = len(self._pending)
+            stats['processing'] = len(self._processing)
+            return stats
@@ -1,30 +1,50 @@
 import concurrent.futures
+import threading
 import time
 from dependency_injector.wiring import inject, Provide
 from ProfilerKubeRC.KubeConfigMap import KubeConfigMap
-from ProfilerKubeRC.KubeDeployment import AKubeDeployment, KubeDeploymentWithClone, DeploymentConfigDto
-from ProfilerKubeRC.KubeEventListener import KubeDeploymentEventListener, KubeCmEventListener
+from ProfilerKubeRC.KubeDeployment import AKubeDeployment, KubeDeploymentWithClone
+from ProfilerKubeRC.KubeConfigModel import OperatorConfig, DeploymentConfig
+from ProfilerKubeRC.KubeEventListener import KubeDeploymentEventListener, KubeClusterDeploymentEventListener, KubeCmEventListener
 from ProfilerKubeRC.KubeEventListener import KubeEventListenerInterface, KubeEventHandlerInterface
 from ProfilerKubeRC.KubeCrd import KubeCrd
+from ProfilerKubeRC.KubeSharding import KubeShardCoordinator
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 from ProfilerKubeRC.TasksManager import TasksManager
-from ProfilerKubeRC.container import TasksContainer
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeClient import KubeClient
+from ProfilerKubeRC.container import TasksContainer, EngineContainer, MetricsContainer
+from ProfilerKubeRC.metrics import MetricsRegistry, MetricFamily, collectProcessMetrics
 # from ProfilerKubeRC.healthcheck import HealthCheck
 
 
 class ServiceInit:
     """
     Start/stop/control services
+    With SHARD_GROUP several replicas of the application split configured deployments by their keys "namespace/name".
+    Each replica creates handlers and watches only for its own deployments. When members of the group are changed,
+    deployments which moved to this replica are loaded and deployments which moved away are dropped without changes of their clones
+    With WATCH_SCOPE=cluster deployments of all configured namespaces are watched by one watch if the service account may list them in all namespaces
+    Deployments and namespaces which are added to or removed from the configmap are started and stopped at runtime,
+    other deployments aren't touched. Clones of removed deployments are handled by REMOVED_CLONE_POLICY
 
     Public methods:
         - runInit: Load configuration. Prepare event listeners
         - runListeners: Start event listeners
-        - healthCheck: Test is the application running
+        - stop: Leave the shard group at shutdown
+        - getLivenessFailures: Failed liveness checks of watches by their cached state. Doesn't call kubernetes API
+        - getReadinessFailures: Failed readiness checks of watches by their cached state. Doesn't call kubernetes API
         - eventHandler: Temporary configmap event handler. Will be moved to configmap class
 
     Private methods:
         - _updKubeDeployments: Temporary method for updating a deployment if the configmap is changed
+        - _addMetricsCollectors: Export state of the engine, the work queue, tasks and deployments on /metrics
+        - _rebalance: Queue loading or dropping of deployments which changed their shard
+        - _syncKubeDeployment: Start or stop handling of a deployment by the current configuration and its shard
+        - _isClusterWatchAllowed: Check WATCH_SCOPE and permissions of the cluster watch
 
     """
     configuraton_tag = 'config'
@@ -32,9 +52,16 @@ class ServiceInit:
     def __init__(self, crd_name, crd_namespace):
         self._setLogger()
         self._setTasksManager()
+        self._setWorkQueue()
+        self._setEngineSettings()
+        self._setKubeClient()
+        self._setKubeEngine()
+        self._setMetrics()
         # We need a CRD to get information how to find a configmap with configuration
         # Name and namespace of CRD have to be provided at start this application
         crdConfig = KubeCrd(crd_name, crd_namespace)
+        self._shards = KubeShardCoordinator(crd_namespace)              # Leases of replicas are kept near the CRD
+        self._shards_stop_event = threading.Event()
         config = None
         while config is None:                                          # When we start the application from helm chart first time, deployment of crd will take some time
             self._logger.info("Waiting for crd %s in namespace %s" % (crd_name, crd_namespace))
@@ -45,13 +72,15 @@ class ServiceInit:
         self._configmap = KubeConfigMap(config["cmName"], config["cmNamespace"])
         self._logger.debug("Start service initialization")
         #
-        self._config = self._configmap.getConfigurationValue(ServiceInit.configuraton_tag)
+        self._config: OperatorConfig = self._configmap.getDeploymentsConfig(ServiceInit.configuraton_tag)
         if self._config is None:
             self._logger.error("No config found in the configmap")
             return
         else:
             self._logger.debug("Configmap is loaded")
         self._kube_event_listeners = []
+        self._listeners_lock = threading.Lock()    # deployments of one namespace are synced by different workers in parallel
+        self._kube_cluster_listener: KubeClusterDeploymentEventListener = None
         self._kube_cm_listener: KubeEventListenerInterface = None
         self._kube_deployments: [AKubeDeployment] = []
 
@@ -63,57 +92,302 @@ class ServiceInit:
     def _setTasksManager(self, tasks_manager: TasksManager = Provide[TasksContainer.tasks_manager]):
         self._tasks_manager = tasks_manager
 
+    @inject
+    def _setWorkQueue(self, work_queue: KubeWorkQueue = Provide[TasksContainer.work_queue]):
+        self._work_queue = work_queue
+
+    @inject
+    def _setEngineSettings(self, settings: KubeEngineSettings = Provide[EngineContainer.engine_settings]):
+        self._settings = settings
+
+    @inject
+    def _setKubeEngine(self, engine: KubeEngine = Provide[EngineContainer.kube_engine]):
+        self._engine = engine
+
+    @inject
+    def _setKubeClient(self, kube_client: KubeClient = Provide[EngineContainer.kube_client]):
+        self._kube_client = kube_client
+
+    @inject
+    def _setMetrics(self, metrics: MetricsRegistry = Provide[MetricsContainer.registry]):
+        self._metrics = metrics
+
     def runInit(self):
+        self._shards.join()
+        self._shards.addRebalanceHandler(self._rebalance)
+        if self._isClusterWatchAllowed():
+            self._kube_cluster_listener = KubeClusterDeploymentEventListener()
         # Read items "deployments" from configmap for configured namespaces
-        for ns, ns_config in self._config.items():
-            kube_event_listener = KubeDeploymentEventListener(ns)
-            for deployment_name, deployment_value in ns_config.get('deployments', {}).items():
-                try:
-                    kube_deployment = KubeDeploymentWithClone(
-                        name=deployment_name,
-                        namespace=ns,
-                        name_suffix=deployment_value.get('name_suffix', '0'),
-                        cloned_factor=deployment_value.get('scale_factor', '0'),
-                        image=deployment_value.get('cloned_image', None),
-                        env=deployment_value.get('env', None)
-                    )
-                    self._kube_deployments.append(kube_deployment)
-                    kube_event_listener.addEventHandler(kube_deployment)
-                    self._logger.info('====================================================================> Deployment %s has been added to handle' % kube_deployment.getName())
-                except Exception as e:
-                    self._logger.exception(e)
-            self._updKubeDeployments(self._configmap.getConfigData(ServiceInit.configuraton_tag))  # resync current running deployments with configmap
-            self._kube_event_listeners.append(kube_event_listener)
-            self._kube_cm_listener = KubeCmEventListener(self._configmap.getNamespace())
-            self._kube_cm_listener.addEventHandler(self)
-            self.runListeners()
+        with self._listeners_lock:
+            for ns in self._config.getNamespaces():
+                self._getDeploymentListener(ns, create=True)
+        for deployment_config in self._config.getDeployments():
+            if self._shards.isOwned(deployment_config.getKey()):
+                self._addKubeDeployment(deployment_config)
+        self._updKubeDeployments(self._configmap.getConfigData(ServiceInit.configuraton_tag))  # resync current running deployments with configmap
+        self._kube_cm_listener = KubeCmEventListener(self._configmap.getNamespace(), self._configmap.getName())
+        self._kube_cm_listener.addEventHandler(self)
+        self._addMetricsCollectors()
+        self.runListeners()
         self._logger.info("Services have been initialized")
 
+    # Listeners of new namespaces are created when the first deployment of the namespace is added.
+    # Listeners are looked up, created and removed with _listeners_lock locked, so a namespace never gets two listeners
+    def _getDeploymentListener(self, ns, create=False) -> KubeDeploymentEventListener:
+        listener = next((listener for listener in self._kube_event_listeners if listener.getNamespace() == ns), None)
+        if listener is None and create:
+            listener = KubeDeploymentEventListener(ns)
+            self._kube_event_listeners.append(listener)
+            if self._kube_cluster_listener is not None:
+                self._kube_cluster_listener.addNamespaceListener(listener)
+        return listener
+
+    def _removeDeploymentListener(self, listener: KubeDeploymentEventListener):
+        self._logger.info("Namespace %s has been removed from configuration" % listener.getNamespace())
+        self._kube_event_listeners.remove(listener)
+        if self._kube_cluster_listener is not None:
+            self._kube_cluster_listener.removeNamespaceListener(listener.getNamespace())
+
+    # The cluster watch needs permissions to list deployments in all namespaces. Without them every namespace is watched separately
+    def _isClusterWatchAllowed(self):
+        if self._settings.watch_scope != 'cluster':
+            return False
+        if self._engine.listAllDeployments(limit=1) is None:
+            self._logger.warning("Deployments of all namespaces can't be listed, namespaces are watched separately")
+            return False
+        self._logger.info("Deployments of all namespaces are watched by one watch")
+        return True
+
+    # The deployment loads its clone before it is registered, so workers which sync other deployments don't wait for the lock.
+    # Returns the listener of its namespace or None if the deployment can't be handled
+    def _addKubeDeployment(self, config: DeploymentConfig) -> KubeDeploymentEventListener:
+        try:
+            kube_deployment = KubeDeploymentWithClone(
+                name=config.name,
+                namespace=config.namespace,
+                name_suffix=config.name_suffix,
+                cloned_factor=config.scale_factor,
+                image=config.image,
+                env=config.env
+            )
+        except Exception as e:
+            self._logger.exception(e)
+            return None
+        with self._listeners_lock:
+            kube_event_listener = self._getDeploymentListener(config.namespace, create=True)
+            self._kube_deployments.append(kube_deployment)
+            kube_event_listener.addEventHandler(kube_deployment)
+        self._logger.info('====================================================================> Deployment %s has been added to handle' % kube_deployment.getName())
+        return kube_event_listener
+
     def runListeners(self):
         # Make a list of listeners to run each one in a separate thread
-        for listener in self._kube_event_listeners:
-            self._tasks_manager.addTask(listener.runWatcher, ())
-        self._tasks_manager.addTask(self._kube_cm_listener.runWatcher, ())
+        if self._kube_cluster_listener is not None:
+            self._kube_cluster_listener.runWatchers()
+        for listener in list(self._kube_event_listeners):
+            self._runDeploymentWatchers(listener)
+        self._kube_cm_listener.addWatcherTask(name='configmaps/%s' % self._kube_cm_listener.getNamespace())
+        if self._shards.isEnabled():
+            self._tasks_manager.addTask(self._shards.runMembership, (self._shards_stop_event,), name='shards')
+        if self._kube_client.needsTokenRefresh():
+            self._tasks_manager.addTask(self._kube_client.runTokenRefresher, (), name='token-refresher')
+        for i in range(self._settings.workers):
+            self._tasks_manager.addTask(self._work_queue.runWorker, (), name='worker-%d' % i)
+
+    # Renewals are stopped and the lease of this replica is deleted, so other replicas don't wait for its expiration to take its deployments.
+    # The lease is deleted here, because the process can exit before the membership task wakes up, the task doesn't delete it again
+    def stop(self):
+        self._shards_stop_event.set()
+        self._shards.leave()
+
+    # Counters of the engine, the work queue and tasks are kept by their objects and are read at scrape time
+    def _addMetricsCollectors(self):
+        self._metrics.addCollector(self._collectEngineMetrics)
+        self._metrics.addCollector(self._collectServiceMetrics)
+        self._metrics.addCollector(collectProcessMetrics)
+
+    def _collectEngineMetrics(self):
+        calls = MetricFamily('kube_api_calls_total', 'counter', 'Kubernetes API calls by verb, resource, namespace, reconcile path and outcome')
+        seconds = MetricFamily('kube_api_call_seconds_total', 'counter', 'Total duration of kubernetes API calls')
+        for call in self._engine.getApiStats().getCalls():
+            labels = {key: call[key] for key in ('verb', 'resource', 'namespace', 'path', 'outcome')}
+            calls.addSample(labels, call['count'])
+            seconds.addSample(labels, call['seconds_total'])
+        exceeded = MetricFamily('reconcile_budget_exceeded_total', 'counter', 'Reconciles which made more API calls than their budget')
+        for path, reconciles in self._engine.getApiStats().getReconciles().items():
+            exceeded.addSample({'path': path}, reconciles['budget_exceeded'])
+        watch_families = [MetricFamily('watch_%s_total' % counter, 'counter', help) for counter, help in (
+            ('events', 'Events received by watches'),
+            ('reconnects', 'Watch reconnects from the last resource version'),
+            ('relists', 'Full lists of watched objects'),
+            ('failures', 'Failed watch requests'))]
+        for state in self._engine.getWatchStates():
+            for family, counter in zip(watch_families, ('events', 'reconnects', 'relists', 'failures')):
+                family.addSample({'watch': state.name}, getattr(state, counter))
+        dropped = MetricFamily('watch_events_dropped_total', 'counter', 'Deployment events dropped by event predicates')
+        for watch, stats in self._engine.getPredicateStats().items():
+            for predicate, count in stats['dropped'].items():
+                dropped.addSample({'watch': watch, 'predicate': predicate}, count)
+        return [calls, seconds, exceeded] + watch_families + [dropped] + self._collectConnectionPoolMetrics() + self._collectRateLimitMetrics()
+
+    # Saturated requests mean that API_POOL_SIZE is too small for workers and watches
+    def _collectConnectionPoolMetrics(self):
+        pool_stats = self._engine.getConnectionPoolStats()
+        if pool_stats is None:
+            return []
+        return [
+            MetricFamily('kube_api_pool_size', 'gauge', 'Connections to API server kept in the pool').addSample({}, pool_stats['size']),
+            MetricFamily('kube_api_pool_connections_in_use', 'gauge', 'Pooled connections used by running requests').addSample({}, pool_stats['in_use']),
+            MetricFamily('kube_api_pool_connections_opened_total', 'counter', 'Connections opened to API server').addSample({}, pool_stats['connections']),
+            MetricFamily('kube_api_pool_requests_total', 'counter', 'Requests sent through the pool').addSample({}, pool_stats['requests']),
+            MetricFamily('kube_api_pool_saturated_total', 'counter', 'Requests which found all pooled connections busy').addSample({}, pool_stats['saturated']),
+            MetricFamily('kube_api_pool_discarded_total', 'counter', 'Connections closed because the pool was full').addSample({}, pool_stats['discarded'])
+        ]
+
+    # Waiting in the writes lane is expected during bursts of config changes, waiting in the replicas lane means API_QPS is too small
+    def _collectRateLimitMetrics(self):
+        limiter_stats = self._engine.getRateLimiter().getStats()
+        families = [MetricFamily('kube_api_rate_limit_%s' % counter, 'counter', help) for counter, help in (
+            ('calls_total', 'API calls which passed the client-side rate limiter'),
+            ('delayed_total', 'API calls which waited for the client-side rate limiter'),
+            ('wait_seconds_total', 'Seconds API calls waited for the client-side rate limiter'))]
+        for lane, stats in limiter_stats['lanes'].items():
+            for family, counter in zip(families, ('calls', 'delayed', 'wait_seconds_total')):
+                family.addSample({'lane': lane}, stats[counter])
+        return families + [
+            MetricFamily('kube_api_throttled_total', 'counter', 'Pauses of API calls by 429 responses of API server').addSample({}, limiter_stats['pauses']),
+            MetricFamily('kube_api_throttled_seconds_total', 'counter', 'Seconds API calls were paused by Retry-After').addSample({}, limiter_stats['paused_seconds_total'])
+        ]
+
+    def _collectServiceMetrics(self):
+        queue_stats = self._work_queue.getStats()
+        queue = [
+            MetricFamily('work_queue_depth', 'gauge', 'Keys waiting in the work queue').addSample({}, queue_stats['depth']),
+            MetricFamily('work_queue_processing', 'gauge', 'Keys processed by workers').addSample({}, queue_stats['processing']),
+            MetricFamily('work_queue_adds_total', 'counter', 'Work items added to the work queue').addSample({}, queue_stats['adds']),
+            MetricFamily('work_queue_coalesced_total', 'counter', 'Work items merged with a pending item').addSample({}, queue_stats['coalesced'])
+        ]
+        task_up = MetricFamily('task_up', 'gauge', 'Is the supervised task running')
+        task_restarts = MetricFamily('task_restarts_total', 'counter', 'Restarts of the supervised task after failures')
+        for info in self._tasks_manager.getTasksInfo():
+            task_up.addSample({'task': info.name}, 1 if info.running else 0)
+            task_restarts.addSample({'task': info.name}, info.restarts)
+        states = {'converged': 0, 'drifted': 0, 'missing': 0, 'unknown': 0}
+        for deployment in list(self._kube_deployments):
+            states[deployment.getCloneState()] += 1
+        clones = MetricFamily('clones', 'gauge', 'Managed deployments by state of their clones')
+        for state, count in states.items():
+            clones.addSample({'state': state}, count)
+        managed = MetricFamily('managed_deployments', 'gauge', 'Deployments managed with clones').addSample({}, len(self._kube_deployments))
+        shard_stats = self._shards.getStats()
+        shards = [
+            MetricFamily('shard_members', 'gauge', 'Live replicas in the shard group').addSample({}, shard_stats['members']),
+            MetricFamily('shard_rebalances_total', 'counter', 'Changes of members of the shard group').addSample({}, shard_stats['rebalances']),
+            MetricFamily('shard_failed_renewals_total', 'counter', 'Failed renewals of the lease of this replica').addSample({}, shard_stats['failed_renewals']),
+            MetricFamily('shard_collected_leases_total', 'counter', 'Expired leases of other replicas deleted by this replica').addSample({}, shard_stats['collected_leases'])
+        ]
+        return queue + [task_up, task_restarts, managed, clones] + shards
 
-    def _updKubeDeployments(self, change_list: [DeploymentConfigDto]):
+    # Called by the shard coordinator when members were changed. Ownership is checked again when the work item is processed,
+    # so only the latest ownership of a deployment is applied
+    def _rebalance(self):
+        managed = {deployment.getKey() for deployment in list(self._kube_deployments)}
+        for deployment_config in self._getCurrentConfig().getDeployments():
+            key = deployment_config.getKey()
+            if self._shards.isOwned(key) != (key in managed):
+                self._work_queue.add(key, 'shard', self._syncKubeDeployment, deployment_config.namespace, deployment_config.name)
+
+    # A deployment is handled if it is configured and owned by this replica. The current configuration is read when the work item
+    # is processed, so the latest change wins and repeated calls don't change anything.
+    # A deployment which moved to another shard is dropped without changes of its clone, the clone of a removed deployment
+    # is handled by REMOVED_CLONE_POLICY. A namespace without configured deployments isn't watched anymore
+    def _syncKubeDeployment(self, ns, deployment_name):
+        key = '%s/%s' % (ns, deployment_name)
+        config = self._getCurrentConfig()
+        deployment_config = config.getDeployment(ns, deployment_name)
+        deployment = next((deployment for deployment in self._kube_deployments if deployment.getKey() == key), None)
+        if deployment_config is not None and self._shards.isOwned(key):
+            if deployment is not None:
+                return
+            self._logger.info("Deployment %s is handled by this replica" % key)
+            listener = self._addKubeDeployment(deployment_config)
+            if listener is None:
+                return
+        else:
+            if deployment is None:
+                return
+            with self._listeners_lock:
+                listener = self._getDeploymentListener(ns)
+                listener.removeEventHandler(deployment)
+                self._kube_deployments.remove(deployment)
+                if ns not in config.getNamespaces() and not listener.hasEventHandlers():
+                    self._removeDeploymentListener(listener)
+            if deployment_config is None:
+                deployment.removeClonedDeployment(self._settings.removed_clone_policy)
+            else:
+                self._logger.info("Deployment %s has moved to another shard" % key)
+            for name in deployment.getWatchedNames():                   # they aren't watched anymore, so the cache can't be trusted
+                self._engine.getDeploymentCache().forget(name, ns)
+        self._runDeploymentWatchers(listener)
+
+    # Watches of a namespace are changed with its handlers. The cluster watch serves all handlers of all namespaces
+    def _runDeploymentWatchers(self, listener: KubeDeploymentEventListener):
+        if self._kube_cluster_listener is None:
+            listener.runWatchers()
+
+    # The latest valid configuration. An invalid configmap is never set as the current content
+    def _getCurrentConfig(self) -> OperatorConfig:
+        return self._configmap.getDeploymentsConfig(ServiceInit.configuraton_tag) or OperatorConfig()
+
+    def _updKubeDeployments(self, change_list: [DeploymentConfig]):
         # Send the new config to all cloned deployment.
+        # The update is queued by the deployment's key to not run in parallel with its events
         for item in change_list:
             self._logger.info("Config has been changed for deploy %s" % item.name)
             for deployment in self._kube_deployments:
-                if deployment.getName() == item.name:
-                    deployment.updateClonedDeploymentConfig(item)
+                if deployment.getKey() == item.getKey():
+                    self._work_queue.add(deployment.getKey(), 'config', self._updKubeDeployment, deployment, item)
+
+    def _updKubeDeployment(self, deployment: KubeDeploymentWithClone, config: DeploymentConfig):
+        deployment.updateClonedDeploymentConfig(config)
+        for listener in list(self._kube_event_listeners):     # the name suffix of the clone could be changed
+            listener.reindexEventHandler(deployment)
+            if listener.getNamespace() == config.namespace:
+                self._runDeploymentWatchers(listener)   # the renamed clone could need its own watch
 
     def eventHandler(self, event):
         # Handle configmap change events. Should be moved to KubeConfigMap later
         # It is here at present because of it has to have access to deployments list
-        if event['object'].kind == 'ConfigMap' and event['object'].metadata.name == self._configmap.getName() and event['type'] == 'MODIFIED':
+        # The object of the event is the new content, so the configmap isn't read again. A relisted watch gives ADDED events,
+        # they are applied only if the configmap was changed while the watch was broken. Objects of relists have no kind,
+        # the watch is scoped to the configmap by its field selector
+        # Only added, removed and changed deployments are queued, so the work depends on the size of the change
+        if event['type'] in ('ADDED', 'MODIFIED') and event['object'].metadata.name == self._configmap.getName():
+            if self._configmap.getDeploymentsConfig(ServiceInit.configuraton_tag, event['object']) is None:
+                self._logger.error("Configuration in the configmap %s is invalid, the current configuration is kept" % self._configmap.getName())
+                return
             old_config = self._configmap.getContent()
-            self._configmap.refresh()
-            self._updKubeDeployments(self._configmap.diffConfig(old_config, ServiceInit.configuraton_tag))
+            if self._configmap.setContent(event['object']):
+                added, removed, changed = self._configmap.diffDeployments(old_config, ServiceInit.configuraton_tag)
+                for item in added + removed:
+                    self._work_queue.add(item.getKey(), 'config', self._syncKubeDeployment, item.namespace, item.name)
+                self._updKubeDeployments(changed)
 
-    def healthCheck(self):
-        health = True
-        for deployment in self._kube_deployments:
-            health = health & deployment.healthCheck()
-        return health
+    # A watch which has neither data nor failed requests for HEALTH_LIVENESS_STALE seconds is stuck and won't recover itself
+    def getLivenessFailures(self):
+        return ['watch %s is stuck for %.0f seconds' % (state.name, state.secondsSinceProgress())
+                for state in self._engine.getWatchStates() if state.secondsSinceProgress() > self._settings.health_liveness_stale]
 
+    # Ready if all watches are synced and have got data from API server recently.
+    # A healthy watch gets data at least once per its request, so no data for two requests means API server isn't reachable.
+    # State of clones isn't checked: clones drift after every source change until they are reconciled, and a clone which can't be
+    # created mustn't drop the service from its Service endpoints. It is exported by the clones gauge
+    def getReadinessFailures(self):
+        failures = []
+        stale = 2 * (self._settings.watch_timeout + self._settings.watch_stall_grace)
+        for state in self._engine.getWatchStates():
+            if state.resource_version is None:
+                failures.append('watch %s is not synced' % state.name)
+            elif state.secondsSinceActivity() > stale:
+                failures.append('watch %s has no data for %.0f seconds' % (state.name, state.secondsSinceActivity()))
+        return failures
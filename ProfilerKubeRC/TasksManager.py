@@ -1,14 +1,168 @@
+import asyncio
 import concurrent.futures
+import threading
+import time
+from dependency_injector.wiring import inject, Provide
+
+from ProfilerKubeRC.KubeWatch import KubeBackoff
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.logger import SLogger
+
+
+class TaskInfo:
+    """
+    State of a supervised task
+
+    :param name: name of the task
+    :param restart: restart the task if it fails
+
+    Public methods:
+        - getUptime: seconds since the last start of a running task
+        - asDict: returns the state as a dictionary
+    """
+
+    def __init__(self, name, restart=True):
+        self.name = name
+        self.restart = restart
+        self.running = False
+        self.restarts = 0
+        self.last_error = None
+        self._started_at = None
+
+    def onStart(self):
+        self.running = True
+        self._started_at = time.monotonic()
+
+    def onStop(self, error=None):
+        self.running = False
+        if error is not None:
+            self.last_error = repr(error)
+
+    def getUptime(self) -> float:
+        return time.monotonic() - self._started_at if self.running else 0.0
+
+    def asDict(self):
+        return {
+            'name': self.name,
+            'running': self.running,
+            'uptime': self.getUptime(),
+            'restarts': self.restarts,
+            'last_error': self.last_error
+        }
+
 
 class TasksManager:
+    """
+    Runs tasks in separate threads and supervises them.
+    Each task gets its own thread, so the capacity always matches the number of registered tasks.
+    Coroutine tasks registered with a runner, f.e. watches of the asyncio engine, are supervised in the runner's event loop without threads.
+    A failed task is restarted with jittered exponential backoff unless it was registered with restart=False.
+    A task which returns without an error is finished and isn't restarted
 
-    def __init__(self):
+    :param backoff_base: first delay in seconds before a failed task is restarted
+    :param backoff_max: maximal delay in seconds before a failed task is restarted
+
+    Public methods:
+        - addTask: register a task. Tasks added after runTasks are started immediately.
+          With runner (f.e. KubeAsyncEngine.runCoroutine) the task is a coroutine function run in the runner's event loop
+        - runTasks: start registered tasks and wait while any of them is running
+        - getTasksInfo: returns TaskInfo of every task
+    """
+
+    def __init__(self, backoff_base=1.0, backoff_max=60.0):
+        self._setLogger()
         self.tasks = []
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._threads = []
+        self._futures = []
+        self._started = False
+        self._lock = threading.Lock()
+
+    @inject
+    def _setLogger(self, logger: SLogger = Provide[LoggerContainer.logger_svc]):
+        self._logger = logger
 
-    def addTask(self, task, arguments=None):
-        self.tasks.append((task, arguments))
+    def addTask(self, task, arguments=None, name=None, restart=True, runner=None):
+        arguments = arguments if arguments is not None else ()
+        info = TaskInfo(name if name is not None else getattr(task, '__qualname__', str(task)), restart)
+        with self._lock:
+            self.tasks.append((task, arguments, info, runner))
+            if self._started:
+                self._startTask(task, arguments, info, runner)
+        return info
 
     def runTasks(self):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            for task in self.tasks:
-                executor.submit(task[0], *task[1])
+        with self._lock:
+            self._started = True
+            for task, arguments, info, runner in self.tasks:
+                self._startTask(task, arguments, info, runner)
+        while True:
+            with self._lock:
+                threads = [thread for thread in self._threads if thread.is_alive()]
+                futures = [future for future in self._futures if not future.done()]
+            if threads:
+                threads[0].join()
+            elif futures:
+                concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                return
+
+    def getTasksInfo(self) -> [TaskInfo]:
+        with self._lock:
+            return [info for task, arguments, info, runner in self.tasks]
+
+    def _startTask(self, task, arguments, info, runner):
+        if runner is not None:
+            self._futures.append(runner(self._superviseTaskAsync(task, arguments, info)))
+            return
+        thread = threading.Thread(target=self._superviseTask, args=(task, arguments, info), name=info.name, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _superviseTask(self, task, arguments, info: TaskInfo):
+        backoff = KubeBackoff(self._backoff_base, self._backoff_max)
+        while True:
+            info.onStart()
+            try:
+                task(*arguments)
+                self._onTaskFinished(info)
+                return
+            except Exception as e:
+                self._onTaskFailed(info, backoff, e)
+            if not info.restart:
+                return
+            time.sleep(self._getRestartDelay(info, backoff))
+            info.restarts += 1
+
+    # The same supervision for a coroutine task in an event loop
+    async def _superviseTaskAsync(self, task, arguments, info: TaskInfo):
+        backoff = KubeBackoff(self._backoff_base, self._backoff_max)
+        while True:
+            info.onStart()
+            try:
+                await task(*arguments)
+                self._onTaskFinished(info)
+                return
+            except Exception as e:
+                self._onTaskFailed(info, backoff, e)
+            if not info.restart:
+                return
+            await asyncio.sleep(self._getRestartDelay(info, backoff))
+            info.restarts += 1
+
+    def _onTaskFinished(self, info: TaskInfo):
+        info.onStop()
+        self._logger.debug("Task %s has finished" % info.name)
+
+    def _onTaskFailed(self, info: TaskInfo, backoff: KubeBackoff, error):
+        if info.getUptime() > self._backoff_max:                    # the task worked for a long time, don't penalize it
+            backoff.reset()
+        info.onStop(error)
+        self._logger.error("Task %s has failed: %r" % (info.name, error))
+        self._logger.exception(error)
+
+    def _getRestartDelay(self, info: TaskInfo, backoff: KubeBackoff):
+        delay = backoff.nextDelay()
+        self._logger.info("Task %s will be restarted in %.1f seconds" % (info.name, delay))
+        return delay
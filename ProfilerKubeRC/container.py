@@ -1,7 +1,11 @@
 from dependency_injector import containers, providers
 from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeAsyncEngine import KubeAsyncEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
 from ProfilerKubeRC.KubeClient import KubeLocalClient, KubeEKSClient, KubeInclusterClient
 from ProfilerKubeRC.TasksManager import TasksManager
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
+from ProfilerKubeRC.metrics import MetricsRegistry
 
 class EngineContainer(containers.DeclarativeContainer):
     """
@@ -10,7 +14,8 @@ class EngineContainer(containers.DeclarativeContainer):
     client for access to local cluster f.e. minicube
     client for access to kubernetes cluster to run from kubernetes inside
     client for access to EKS cluster with aws role permissions
-    engine to wrap kubernetes API calls
+    engine to wrap kubernetes API calls: synchronous one or asyncio one with all watches on one event loop
+    engine settings to tune watches and API calls
     """
 
     config = providers.Configuration()
@@ -39,10 +44,30 @@ class EngineContainer(containers.DeclarativeContainer):
         incluster=incluster_kube_client
     )
 
+    # Tuning parameters of the engine from environment variables
+    engine_settings = providers.Singleton(
+        KubeEngineSettings
+    )
+
     # Create class to run kubernetes API
-    kube_engine = providers.Singleton(
+    sync_kube_engine = providers.Singleton(
         KubeEngine,
-        kube_client
+        kube_client,
+        engine_settings
+    )
+
+    # Create class to run kubernetes API on asyncio event loop. Requires kubernetes_asyncio
+    async_kube_engine = providers.Singleton(
+        KubeAsyncEngine,
+        kube_client,
+        engine_settings
+    )
+
+    # Select active kubernetes engine
+    kube_engine = providers.Selector(
+        config.engine_type,
+        sync=sync_kube_engine,
+        asyncio=async_kube_engine
     )
 
 
@@ -54,4 +79,13 @@ class TasksContainer(containers.DeclarativeContainer):
 
     tasks_manager = providers.Singleton(TasksManager)
 
+    # Keyed queue between watchers and event handlers
+    work_queue = providers.Singleton(KubeWorkQueue)
+
+
+class MetricsContainer(containers.DeclarativeContainer):
+    """
+    Container for application metrics exported on /metrics
+    """
 
+    registry = providers.Singleton(MetricsRegistry)
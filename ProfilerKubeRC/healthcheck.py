@@ -1,59 +1,83 @@
 from abc import ABC, abstractmethod
-import time
 from http.server import BaseHTTPRequestHandler
-from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
 
 from dependency_injector.wiring import inject, Provide
 from ProfilerKubeRC.logger import LoggerContainer
 from ProfilerKubeRC.logger import SLogger
 from ProfilerKubeRC.TasksManager import TasksManager
-from ProfilerKubeRC.container import TasksContainer
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.container import TasksContainer, MetricsContainer, EngineContainer
+from ProfilerKubeRC.metrics import MetricsRegistry, METRICS_CONTENT_TYPE
 
 
 class HealthCheck(BaseHTTPRequestHandler):
     """
-    Healthcheck for kubernetes probes
+    Healthcheck for kubernetes probes and metrics in Prometheus text format on /metrics
+    Probes are answered from cached state of watches and clones without kubernetes API calls:
+        - /livez: fails if a watch is stuck
+        - /readyz (and / for old probes): fails until the service is initialized, if a watch isn't synced or has no data from API server
+    Requests are served by a threaded server, so a slow client doesn't block probes
 
     Public methods:
         - do_GET(): processing get request
         - init(): Initialize class
-            - set a function to check service
+            - set a service to check
             - add start http server method to task list (It will be  started later)
-        - startHttp(): start http server method
+        - startHttp(): start http server method on HEALTH_HOST:HEALTH_PORT
 
     """
 
-    service_check = None                                                    # Test function
+    service_check = None                                                    # Service to check. None until it is initialized
     logger: SLogger = Provide[LoggerContainer.logger_svc]                   # Logger
     tasks_manager: TasksManager = Provide[TasksContainer.tasks_manager]     # Inject multithread tasks manager
+    metrics: MetricsRegistry = Provide[MetricsContainer.registry]           # Application metrics
+    settings: KubeEngineSettings = Provide[EngineContainer.engine_settings]
 
     @classmethod
     def init(cls, service_check):
         cls.service_check = service_check
-        cls.tasks_manager.addTask(cls.startHttp, ())       # Add task to mulitasks pool to submit. Must be run in a separate thread from the main task
+        cls.tasks_manager.addTask(cls.startHttp, (), name='healthcheck')       # Add task to mulitasks pool to submit. Must be run in a separate thread from the main task
 
-    #
-    # Test is service working
-    # Checks number of replicas
-    # Returns HTTP 200 if success
-    #
     def do_GET(self):
-        health = HealthCheck.service_check.healthCheck()
-        # Do multiple checks because of clone can being refreshed in this time exactly
-        i = 0
-        while not health and i < 5:
-            HealthCheck.logger.info("Healthcheck is potentially failed")
-            time.sleep(10)
-            health = HealthCheck.service_check.healthCheck()
-            i += 1
-        HealthCheck.logger.info("Healthcheck is success" if health else "Healthcheck is failed")
-        self.send_response(200) if health else self.send_response(204)
-        self.send_header("Content-type", "text/html")
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            self._send(200, HealthCheck.metrics.render(), METRICS_CONTENT_TYPE)
+        elif path == '/livez':
+            self._sendProbe(self._getFailures(lambda service: service.getLivenessFailures()))
+        elif path in ('/readyz', '/'):
+            self._sendProbe(self._getFailures(lambda service: service.getReadinessFailures()))
+        else:
+            self._send(404, 'not found\n')
+
+    @staticmethod
+    def _getFailures(check):
+        if HealthCheck.service_check is None:
+            return ['service is not initialized']
+        return check(HealthCheck.service_check)
+
+    # HTTP 200 if all checks are passed, otherwise HTTP 503 with failed checks
+    def _sendProbe(self, failures):
+        if failures:
+            HealthCheck.logger.info("Healthcheck %s is failed: %s" % (self.path, '; '.join(failures)))
+            self._send(503, '\n'.join(failures) + '\n')
+        else:
+            self._send(200, 'ok\n')
+
+    def _send(self, status, text, content_type='text/plain; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are logged by the application logger instead of stderr
+    def log_message(self, format, *args):
+        HealthCheck.logger.debug("Healthcheck %s - %s" % (self.address_string(), format % args))
 
     @classmethod
     def startHttp(cls):
-        webServer = HTTPServer(('localhost', 8234), cls)
+        webServer = ThreadingHTTPServer((cls.settings.health_host, cls.settings.health_port), cls)
+        webServer.daemon_threads = True
         webServer.serve_forever()
-
-
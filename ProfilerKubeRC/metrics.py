@@ -0,0 +1,196 @@
+#
+# Minimal registry of application metrics in Prometheus text format
+# This file contents of:
+# - MetricFamily       : Samples of one metric to render
+# - Counter            : Monotonic counter with labels
+# - Gauge              : Value which can go up and down with labels
+# - Histogram          : Distribution of observed values in cumulative buckets with labels
+# - MetricsRegistry    : Registered metrics and collectors to render them for /metrics
+# - getProcessRss      : Resident memory of the process
+
+import os
+import resource
+import threading
+from bisect import bisect_left
+
+METRICS_PREFIX = 'ddprofiler_rc_'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """
+    Samples of one metric. Collectors return metric families to render them at scrape time
+
+    :param name: metric name without the application prefix
+    :param metric_type: counter, gauge or histogram
+    :param help: description of the metric
+
+    Public methods:
+        - addSample: add a value with labels. suffix is added to the name, f.e. _bucket
+        - render: returns lines in Prometheus text format
+    """
+
+    def __init__(self, name, metric_type, help):
+        self.name = METRICS_PREFIX + name
+        self.type = metric_type
+        self.help = help
+        self.samples = []
+
+    def addSample(self, labels, value, suffix=''):
+        self.samples.append((suffix, labels, value))
+        return self
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, labels, value in self.samples:
+            label_text = ','.join('%s="%s"' % (key, _escapeLabel(label)) for key, label in labels.items())
+            lines.append('%s%s%s %s' % (self.name, suffix, '{%s}' % label_text if label_text else '', _formatValue(value)))
+        return lines
+
+
+class Metric:
+    """
+    Base class of metrics with labels. Values are kept by a tuple of label values in the order of label names
+    """
+    metric_type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _getKey(self, labels):
+        return tuple(labels.get(label, '') for label in self.labels)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.metric_type, self.help)
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                family.addSample(dict(zip(self.labels, key)), value)
+        return family
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._getKey(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._getKey(labels)] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._getKey(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0, 0.0]      # counts by bucket, count, sum
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[0][index] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.metric_type, self.help)
+        with self._lock:
+            for key, (bucket_counts, count, total) in sorted(self._values.items()):
+                labels = dict(zip(self.labels, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    family.addSample(dict(labels, le=_formatValue(float(bound))), cumulative, '_bucket')
+                family.addSample(dict(labels, le='+Inf'), count, '_bucket')
+                family.addSample(labels, count, '_count')
+                family.addSample(labels, total, '_sum')
+        return family
+
+
+class MetricsRegistry:
+    """
+    Registry of application metrics.
+    Metrics which are changed by the application are created once by name. Values which are kept by other objects,
+    f.e. watch states or the work queue, are read by collectors at scrape time
+
+    Public methods:
+        - counter, gauge, histogram: create a metric or return the registered one with the same name
+        - addCollector: register a function which returns a list of MetricFamily
+        - render: returns all metrics in Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _getMetric(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._getMetric(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self._getMetric(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._getMetric(Histogram, name, help, labels, buckets)
+
+    def addCollector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            families = [metric.collect() for metric in self._metrics.values()]
+            collectors = list(self._collectors)
+        for collector in collectors:
+            families.extend(collector())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Resident memory of the process in bytes. Falls back to the peak value where /proc isn't available
+def getProcessRss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def collectProcessMetrics():
+    return [MetricFamily('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes').addSample({}, getProcessRss())]
@@ -1,4 +1,5 @@
 import sys, os
+import signal
 from dependency_injector.wiring import Provide, inject
 
 from ProfilerKubeRC.ServiceInit import ServiceInit
@@ -20,8 +21,13 @@ def startReplicationController(tasks_manager: TasksManager = Provide[TasksContai
     service_init = ServiceInit(crd_config, crd_namespace)
     service_init.runInit()
     HealthCheck.init(service_init)
+    # Kubernetes stops the pod by SIGTERM. The service is stopped in the main thread, so other replicas take its deployments at once
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     # Start listeners
-    tasks_manager.runTasks()
+    try:
+        tasks_manager.runTasks()
+    finally:
+        service_init.stop()
 
 
 if __name__ == '__main__':
@@ -1,20 +1,22 @@
 import sys, os
 
 import ProfilerKubeRC
-from ProfilerKubeRC.container import EngineContainer, TasksContainer
+from ProfilerKubeRC.container import EngineContainer, TasksContainer, MetricsContainer
 from ProfilerKubeRC.ServiceInit import ServiceInit
 from ProfilerKubeRC.logger import LoggerContainer
 from dependency_injector.wiring import Provide
 from ProfilerKubeRC.logger import SLogger
-from ProfilerKubeRC.KubeEventListener import KubeEventListener
+from ProfilerKubeRC.KubeEventListener import KubeEventListener, KubeDeploymentEventListener, KubeClusterDeploymentEventListener
 from ProfilerKubeRC.KubeConfigMap import KubeConfigMap
 from ProfilerKubeRC.KubeEngine import KubeEngine
 from ProfilerKubeRC.KubeDeployment import KubeDeploymentWithClone
 from ProfilerKubeRC.KubeClient import KubeClient
 from ProfilerKubeRC.KubeEKSClusterInfo import KubeEKSClusterInfo
 from ProfilerKubeRC.KubeCrd import KubeCrd
+from ProfilerKubeRC.KubeSharding import KubeShardCoordinator
 from ProfilerKubeRC.ServiceInit import ServiceInit
 from ProfilerKubeRC.TasksManager import TasksManager
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
 from ProfilerKubeRC.healthcheck import HealthCheck
 from ProfilerKubeRC.runApp import startReplicationController
 
@@ -33,11 +35,15 @@ if __name__ == '__main__':
     engine_container.config.cluster_type.from_env('CLIENT')
     engine_container.config.cluster.from_env('CLUSTER')
     engine_container.config.region.from_env('REGION')
+    engine_container.config.engine_type.from_env('ENGINE', 'sync')
     engine_container.wire(modules=[sys.modules[__name__]])
 
     tasks_container = TasksContainer()
     tasks_container.wire(modules=[sys.modules[__name__]])
 
+    metrics_container = MetricsContainer()
+    metrics_container.wire(modules=[sys.modules[__name__]])
+
     crdConfig = os.environ.get('CRD_NAME', 'profiler-deployment')
     crdNamespace = os.environ.get('CRD_NAMESPACE', 'default')
     # Start application
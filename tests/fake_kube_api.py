@@ -0,0 +1,562 @@
+#
+# Local fake of kubernetes API server for offline end-to-end and performance tests.
+# This file contents of:
+# - FakeKubeApi     : HTTP server with in-memory deployments, configmaps, leases and custom objects
+# - FakeKubeClient  : KubeClient which points the real kubernetes client to FakeKubeApi through KubeClientConfig
+#
+# Supported requests:
+# - apps/v1 deployments: list and watch in a namespace or in all namespaces, get, create, delete, patch (merge, strategic merge, server-side apply), get/patch of the scale subresource
+# - core/v1 configmaps: list, watch, get, create, patch
+# - custom objects, f.e. crds.grove ddprofcrds: get, create
+# - coordination.k8s.io/v1 leases: list, watch, get, create, replace and delete with a check of resourceVersion
+# - /version
+# A simple deployment controller copies spec.replicas to status after every change of the spec like kube-controller-manager does,
+# so every change of a deployment gives a spec event and a status-only event.
+# Responses over COMPRESSION_MIN_SIZE bytes are compressed if the request accepts gzip. Watch streams aren't compressed like in API server
+
+import bisect
+import gzip
+import json
+import re
+import threading
+import time
+import uuid
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import kubernetes
+
+from ProfilerKubeRC.KubeClient import KubeClient, KubeClientConfig
+
+DEPLOYMENTS = 'deployments'
+CONFIGMAPS = 'configmaps'
+CUSTOM_OBJECTS = 'customobjects'
+LEASES = 'leases'
+
+DEPLOYMENT_PATH = re.compile(r'^/apis/apps/v1/namespaces/([^/]+)/deployments(?:/([^/]+))?(/scale)?$')
+ALL_DEPLOYMENTS_PATH = re.compile(r'^/apis/apps/v1/deployments$')
+CONFIGMAP_PATH = re.compile(r'^/api/v1/namespaces/([^/]+)/configmaps(?:/([^/]+))?$')
+LEASE_PATH = re.compile(r'^/apis/coordination.k8s.io/v1/namespaces/([^/]+)/leases(?:/([^/]+))?$')
+CUSTOM_OBJECT_PATH = re.compile(r'^/apis/([^/]+)/([^/]+)/namespaces/([^/]+)/([^/]+)(?:/([^/]+))?$')
+
+COMPRESSION_MIN_SIZE = 1024
+
+KINDS = {
+    DEPLOYMENTS: ('apps/v1', 'Deployment'),
+    CONFIGMAPS: ('v1', 'ConfigMap'),
+    LEASES: ('coordination.k8s.io/v1', 'Lease')
+}
+
+
+class FakeKubeClient(KubeClient):
+    """
+    Kubernetes client to work with FakeKubeApi
+
+    :param endpoint: URL of FakeKubeApi
+
+    Public methods:
+    - getApiClient(): returns kubernetes.client.ApiClient for executing  API request
+    """
+
+    def __init__(self, endpoint):
+        super().__init__()
+        self._config = KubeClientConfig(endpoint)
+        self._api_client = kubernetes.client.ApiClient(self._config.getConfiguration())
+
+    def getApiClient(self) -> kubernetes.client.ApiClient:
+        return self._api_client
+
+
+class FakeKubeApi:
+    """
+    In-memory kubernetes API server on a local port.
+    Every change of an object gets a new resourceVersion and is kept in the event log for watches.
+    Watches are resumed from resourceVersion, send bookmarks if they are allowed and answer 410 Gone if the version is compacted
+
+    :param latency: seconds to wait before answering every request except watch streams
+    :param max_events: number of events to keep for watches. Older resourceVersions are answered with 410 Gone
+
+    Public methods:
+        - start / stop: run the server in a background thread / stop it and all watches
+        - getEndpoint: returns URL of the server
+        - createClient: returns FakeKubeClient for the server
+        - addDeployment, addConfigMap, addCustomObject: create objects without requests
+        - setReplicas: change replicas of a deployment like kubectl scale
+        - updateConfigMap: change data of a configmap
+        - deleteObject: delete an object
+        - getObject: returns a copy of a stored object as a dictionary
+        - failNext: answer next matching requests with an error status
+        - compact: forget the event log to force 410 Gone on resumed watches
+        - getRequestCounts: returns numbers of requests by (verb, resource)
+        - getCompressedResponses: returns the number of gzip responses
+        - getAuthorizations: returns Authorization headers of requests in order of their first use
+    """
+
+    def __init__(self, latency=0.0, max_events=10000):
+        self._latency = latency
+        self._max_events = max_events
+        self._condition = threading.Condition()
+        self._resource_version = 0
+        self._objects = {DEPLOYMENTS: {}, CONFIGMAPS: {}, CUSTOM_OBJECTS: {}, LEASES: {}}     # resource -> (namespace, name) -> object
+        self._events = []                   # (resourceVersion, resource, type, object) in resourceVersion order
+        self._event_versions = []           # resourceVersions of self._events for bisect
+        self._oldest_version = 0            # watches from older versions get 410 Gone
+        self._failures = []                 # [method, status, count, path pattern]
+        self._request_counts = {}
+        self._compressed_responses = 0
+        self._authorizations = []
+        self._stopped = False
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        fake = self
+
+        class Handler(FakeKubeApiHandler):
+            api = fake
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-kube-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def getEndpoint(self):
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def createClient(self) -> FakeKubeClient:
+        return FakeKubeClient(self.getEndpoint())
+
+    # Objects
+
+    def addDeployment(self, namespace, name, replicas=1, image='nginx:latest', labels=None):
+        labels = labels if labels is not None else {'app': name}
+        body = {
+            'metadata': {'name': name, 'labels': labels},
+            'spec': {
+                'replicas': replicas,
+                'selector': {'matchLabels': {'app': name}},
+                'template': {
+                    'metadata': {'labels': {'app': name}},
+                    'spec': {'containers': [{'name': name, 'image': image}]}
+                }
+            }
+        }
+        with self._condition:
+            return self._create(DEPLOYMENTS, namespace, body)
+
+    def addConfigMap(self, namespace, name, data):
+        with self._condition:
+            return self._create(CONFIGMAPS, namespace, {'metadata': {'name': name}, 'data': data})
+
+    def addCustomObject(self, group, version, namespace, plural, name, body):
+        body = deepcopy(body)
+        body.setdefault('apiVersion', '%s/%s' % (group, version))
+        body.setdefault('metadata', {})['name'] = name
+        with self._condition:
+            return self._create(CUSTOM_OBJECTS, namespace, body, key=(group, plural, namespace, name))
+
+    def setReplicas(self, namespace, name, replicas):
+        with self._condition:
+            return self._patch(DEPLOYMENTS, namespace, name, {'spec': {'replicas': replicas}})
+
+    def updateConfigMap(self, namespace, name, data):
+        with self._condition:
+            return self._patch(CONFIGMAPS, namespace, name, {'data': data})
+
+    def deleteObject(self, resource, namespace, name):
+        with self._condition:
+            return self._delete(resource, namespace, name)
+
+    def getObject(self, resource, namespace, name):
+        with self._condition:
+            obj = self._objects[resource].get((namespace, name))
+            return deepcopy(obj) if obj is not None else None
+
+    # Fault injection and statistics
+
+    def failNext(self, method, status, count=1, path=None):
+        with self._condition:
+            self._failures.append([method, status, count, re.compile(path) if path is not None else None])
+
+    def compact(self):
+        with self._condition:
+            self._events.clear()
+            self._event_versions.clear()
+            self._oldest_version = self._resource_version + 1          # even watches from the latest version have to relist
+
+    def getRequestCounts(self):
+        with self._condition:
+            return dict(self._request_counts)
+
+    def getAuthorizations(self):
+        with self._condition:
+            return list(self._authorizations)
+
+    def getCompressedResponses(self):
+        with self._condition:
+            return self._compressed_responses
+
+    # Storage. Methods below are called with self._condition locked
+
+    def _nextVersion(self):
+        self._resource_version += 1
+        return str(self._resource_version)
+
+    def _writeEvent(self, resource, event_type, obj):
+        version = int(obj['metadata']['resourceVersion'])
+        self._events.append((version, resource, event_type, deepcopy(obj)))
+        self._event_versions.append(version)
+        if len(self._events) > self._max_events:
+            removed = len(self._events) - self._max_events
+            self._oldest_version = self._event_versions[removed - 1]
+            del self._events[:removed]
+            del self._event_versions[:removed]
+        self._condition.notify_all()
+
+    def _create(self, resource, namespace, body, key=None):
+        key = key if key is not None else (namespace, body['metadata']['name'])
+        if key in self._objects[resource]:
+            return None
+        obj = deepcopy(body)
+        if resource in KINDS:
+            obj['apiVersion'], obj['kind'] = KINDS[resource]
+        metadata = obj.setdefault('metadata', {})
+        metadata['namespace'] = namespace
+        metadata['uid'] = str(uuid.uuid4())
+        metadata['creationTimestamp'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        metadata['resourceVersion'] = self._nextVersion()
+        if resource == DEPLOYMENTS:
+            metadata['generation'] = 1
+            obj['status'] = {}
+        self._objects[resource][key] = obj
+        self._writeEvent(resource, 'ADDED', obj)
+        if resource == DEPLOYMENTS:
+            self._runDeploymentController(obj)
+        return obj
+
+    def _patch(self, resource, namespace, name, patch, apply=False):
+        obj = self._objects[resource].get((namespace, name))
+        if obj is None:
+            return None
+        old_spec = deepcopy(obj.get('spec'))
+        if apply:
+            FakeKubeApi._apply(obj, patch)
+        else:
+            FakeKubeApi._merge(obj, patch)
+        if resource == DEPLOYMENTS and obj.get('spec') != old_spec:
+            obj['metadata']['generation'] = obj['metadata'].get('generation', 0) + 1
+        obj['metadata']['resourceVersion'] = self._nextVersion()
+        self._writeEvent(resource, 'MODIFIED', obj)
+        if resource == DEPLOYMENTS:
+            self._runDeploymentController(obj)
+        return obj
+
+    def _delete(self, resource, namespace, name):
+        obj = self._objects[resource].pop((namespace, name), None)
+        if obj is not None:
+            obj['metadata']['resourceVersion'] = self._nextVersion()
+            self._writeEvent(resource, 'DELETED', obj)
+        return obj
+
+    # Returns (status, object). The object is replaced only if resourceVersion of the body is empty or the same as the stored one
+    def _replace(self, resource, namespace, name, body):
+        obj = self._objects[resource].get((namespace, name))
+        if obj is None:
+            return 404, None
+        body_version = body.get('metadata', {}).get('resourceVersion')
+        if body_version and body_version != obj['metadata']['resourceVersion']:
+            return 409, None
+        replaced = deepcopy(body)
+        replaced['apiVersion'], replaced['kind'] = KINDS[resource]
+        replaced['metadata'] = dict(replaced.get('metadata', {}), namespace=namespace, name=name, uid=obj['metadata']['uid'],
+                                    creationTimestamp=obj['metadata']['creationTimestamp'], resourceVersion=self._nextVersion())
+        self._objects[resource][(namespace, name)] = replaced
+        self._writeEvent(resource, 'MODIFIED', replaced)
+        return 200, replaced
+
+    # Server-side apply of one field manager which owns the whole spec
+    @staticmethod
+    def _apply(obj, body):
+        metadata = body.get('metadata', {})
+        if 'labels' in metadata:
+            obj['metadata']['labels'] = metadata['labels']
+        obj['metadata'].setdefault('annotations', {}).update(metadata.get('annotations') or {})
+        if 'spec' in body:
+            obj['spec'] = body['spec']
+        if 'data' in body:
+            obj['data'] = body['data']
+
+    # JSON merge patch. Strategic merge patches of the operator don't use list merge keys, so they are applied the same way
+    @staticmethod
+    def _merge(target, patch):
+        for key, value in patch.items():
+            if value is None:
+                target.pop(key, None)
+            elif isinstance(value, dict) and isinstance(target.get(key), dict):
+                FakeKubeApi._merge(target[key], value)
+            else:
+                target[key] = deepcopy(value)
+
+    def _runDeploymentController(self, obj):
+        replicas = obj['spec'].get('replicas', 1)
+        status = {'replicas': replicas, 'readyReplicas': replicas, 'availableReplicas': replicas, 'observedGeneration': obj['metadata']['generation']}
+        if obj.get('status') != status:
+            obj['status'] = status
+            obj['metadata']['resourceVersion'] = self._nextVersion()
+            self._writeEvent(DEPLOYMENTS, 'MODIFIED', obj)
+
+    @staticmethod
+    def _toScale(obj):
+        return {
+            'apiVersion': 'autoscaling/v1',
+            'kind': 'Scale',
+            'metadata': {key: obj['metadata'][key] for key in ('name', 'namespace', 'uid', 'resourceVersion', 'creationTimestamp')},
+            'spec': {'replicas': obj['spec'].get('replicas', 1)},
+            'status': {'replicas': obj.get('status', {}).get('replicas', 0)}
+        }
+
+    @staticmethod
+    def _isSelected(obj, field_selector, label_selector):
+        if field_selector:
+            for item in field_selector.split(','):
+                field, value = item.split('=', 1)
+                if field == 'metadata.name' and obj['metadata']['name'] != value:
+                    return False
+        if label_selector:
+            labels = obj['metadata'].get('labels') or {}
+            for item in label_selector.split(','):
+                label, value = item.split('=', 1)
+                if labels.get(label) != value:
+                    return False
+        return True
+
+    def _takeFailure(self, method, path):
+        with self._condition:
+            for failure in self._failures:
+                if failure[0] == method and (failure[3] is None or failure[3].search(path)):
+                    failure[2] -= 1
+                    if failure[2] == 0:
+                        self._failures.remove(failure)
+                    return failure[1]
+        return None
+
+    def _addAuthorization(self, authorization):
+        with self._condition:
+            if authorization is not None and authorization not in self._authorizations:
+                self._authorizations.append(authorization)
+
+    def _countRequest(self, verb, resource):
+        with self._condition:
+            self._request_counts[(verb, resource)] = self._request_counts.get((verb, resource), 0) + 1
+
+
+class FakeKubeApiHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of FakeKubeApi. The api class attribute is set by FakeKubeApi.start
+    """
+    api: FakeKubeApi = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self._readBody()
+        self.api._addAuthorization(self.headers.get('Authorization'))
+        status = self.api._takeFailure(method, self.path)
+        if status is not None:
+            return self._sendStatus(status, 'Injected failure')
+        watch = query.get('watch', '').lower() in ('true', '1')
+        if not watch and self.api._latency:
+            time.sleep(self.api._latency)
+        if url.path == '/version' and method == 'GET':
+            return self._sendObject(200, {'major': '1', 'minor': '18', 'gitVersion': 'v1.18.0-fake'})
+        match = DEPLOYMENT_PATH.match(url.path)
+        if match:
+            return self._handleObject(method, DEPLOYMENTS, match.group(1), match.group(2), query, body, scale=match.group(3) is not None)
+        if ALL_DEPLOYMENTS_PATH.match(url.path) and method == 'GET':
+            return self._handleObject(method, DEPLOYMENTS, None, None, query, body)
+        match = CONFIGMAP_PATH.match(url.path)
+        if match:
+            return self._handleObject(method, CONFIGMAPS, match.group(1), match.group(2), query, body)
+        match = LEASE_PATH.match(url.path)
+        if match:
+            return self._handleObject(method, LEASES, match.group(1), match.group(2), query, body)
+        match = CUSTOM_OBJECT_PATH.match(url.path)
+        if match:
+            return self._handleCustomObject(method, *match.groups(), body)
+        self._sendStatus(404, 'Unknown path %s' % url.path)
+
+    def _readBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _handleObject(self, method, resource, namespace, name, query, body, scale=False):
+        api = self.api
+        resource_name = resource + '/scale' if scale else resource
+        if name is None and method == 'GET':
+            if query.get('watch', '').lower() in ('true', '1'):
+                api._countRequest('watch', resource)
+                return self._watch(resource, namespace, query)
+            api._countRequest('list', resource)
+            return self._list(resource, namespace, query)
+        with api._condition:
+            if method == 'POST' and name is None:
+                api._countRequest('create', resource)
+                obj = api._create(resource, namespace, body)
+                return self._sendObject(201, obj) if obj is not None else self._sendStatus(409, 'Already exists')
+            if method == 'GET':
+                api._countRequest('get', resource_name)
+                obj = api._objects[resource].get((namespace, name))
+            elif method == 'PATCH':
+                is_apply = self.headers.get('Content-Type', '').startswith('application/apply-patch')
+                api._countRequest('apply' if is_apply else 'patch', resource_name)
+                if is_apply and (namespace, name) not in api._objects[resource]:
+                    body.setdefault('metadata', {})['name'] = name
+                    obj = api._create(resource, namespace, body)
+                    return self._sendObject(201, obj)
+                obj = api._patch(resource, namespace, name, body, apply=is_apply)
+            elif method == 'PUT':
+                api._countRequest('update', resource_name)
+                status, obj = api._replace(resource, namespace, name, body)
+                if status == 409:
+                    return self._sendStatus(409, 'Operation cannot be fulfilled on %s "%s": the object has been modified' % (resource, name))
+            elif method == 'DELETE' and not scale:
+                api._countRequest('delete', resource)
+                obj = api._objects[resource].get((namespace, name))
+                precondition = ((body or {}).get('preconditions') or {}).get('resourceVersion')
+                if obj is not None and precondition and precondition != obj['metadata']['resourceVersion']:
+                    return self._sendStatus(409, 'Precondition failed: resourceVersion of %s "%s" is changed' % (resource, name))
+                if api._delete(resource, namespace, name) is not None:
+                    return self._sendObject(200, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Success', 'details': {'name': name, 'kind': resource}})
+                obj = None
+            else:
+                return self._sendStatus(405, 'Method is not allowed')
+            if obj is None:
+                return self._sendStatus(404, '%s "%s" not found' % (resource, name))
+            return self._sendObject(200, FakeKubeApi._toScale(obj) if scale else obj)
+
+    def _handleCustomObject(self, method, group, version, namespace, plural, name, body):
+        api = self.api
+        with api._condition:
+            if method == 'POST' and name is None:
+                api._countRequest('create', CUSTOM_OBJECTS)
+                obj = api._create(CUSTOM_OBJECTS, namespace, body, key=(group, plural, namespace, body['metadata']['name']))
+                return self._sendObject(201, obj) if obj is not None else self._sendStatus(409, 'Already exists')
+            if method != 'GET' or name is None:
+                return self._sendStatus(405, 'Method is not allowed')
+            api._countRequest('get', CUSTOM_OBJECTS)
+            obj = api._objects[CUSTOM_OBJECTS].get((group, plural, namespace, name))
+            if obj is None:
+                return self._sendStatus(404, '%s "%s" not found' % (plural, name))
+            return self._sendObject(200, obj)
+
+    # namespace None lists and watches objects of all namespaces.
+    # Items of a list have no kind and apiVersion like items of API server lists, only the list has them
+    def _list(self, resource, namespace, query):
+        api = self.api
+        api_version, kind = KINDS[resource]
+        with api._condition:
+            items = [{key: deepcopy(value) for key, value in obj.items() if key not in ('kind', 'apiVersion')}
+                     for (ns, name), obj in api._objects[resource].items()
+                     if namespace in (None, ns) and FakeKubeApi._isSelected(obj, query.get('fieldSelector'), query.get('labelSelector'))]
+            result = {'apiVersion': api_version, 'kind': kind + 'List', 'metadata': {'resourceVersion': str(api._resource_version)}, 'items': items}
+        self._sendObject(200, result)
+
+    def _watch(self, resource, namespace, query):
+        api = self.api
+        deadline = time.monotonic() + int(query.get('timeoutSeconds', 30))
+        bookmarks = query.get('allowWatchBookmarks', '').lower() in ('true', '1')
+        field_selector, label_selector = query.get('fieldSelector'), query.get('labelSelector')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        with api._condition:
+            version = int(query.get('resourceVersion') or api._resource_version)
+            if query.get('resourceVersion') and version < api._oldest_version:
+                self._writeChunk({'type': 'ERROR', 'object': {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'code': 410, 'reason': 'Expired',
+                                                              'message': 'too old resource version: %d (%d)' % (version, api._oldest_version)}})
+                return self._endChunks()
+        try:
+            while True:
+                with api._condition:
+                    if api._stopped:
+                        break
+                    start = bisect.bisect_right(api._event_versions, version)
+                    events = [event for event in api._events[start:] if event[1] == resource and namespace in (None, event[3]['metadata']['namespace'])]
+                    events = [event for event in events if FakeKubeApi._isSelected(event[3], field_selector, label_selector)]
+                    if api._events[start:]:
+                        version = api._event_versions[-1]
+                    elif time.monotonic() < deadline:
+                        api._condition.wait(deadline - time.monotonic())
+                for event_version, event_resource, event_type, obj in events:
+                    self._writeChunk({'type': event_type, 'object': obj})
+                if time.monotonic() >= deadline:
+                    if bookmarks:
+                        api_version, kind = KINDS[resource]
+                        self._writeChunk({'type': 'BOOKMARK', 'object': {'apiVersion': api_version, 'kind': kind, 'metadata': {'resourceVersion': str(version)}}})
+                    break
+            self._endChunks()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _writeChunk(self, event):
+        data = (json.dumps(event) + '\n').encode('utf8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _endChunks(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _sendObject(self, status, obj):
+        data = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if len(data) > COMPRESSION_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+            with self.api._condition:
+                self.api._compressed_responses += 1
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass                            # the client has given up by its read timeout
+
+    def _sendStatus(self, code, message):
+        data = json.dumps({'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'code': code, 'message': message}).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if code == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(data)
@@ -102,7 +102,7 @@ def assertUpdateDeployment(env_update):
     source_deployment = readDeployment(profiler_test_config['source_deployment'])
     container_name = source_deployment.spec.template.spec.containers[0].name
     env_update_var = env_update.split(':')
-    patch_body = KubeDeploymentTemplates.buildEnvPatch(container_name, env_update_var)
+    patch_body = {'spec': {'template': {'spec': {'containers': [{'name': container_name, 'env': [{'name': env_update_var[0], 'value': env_update_var[1]}]}]}}}}
     api = client.AppsV1Api()
     api.patch_namespaced_deployment(name=profiler_test_config['source_deployment'], namespace=profiler_test_config['namespace'], body=patch_body)
     while getEnvValue(readDeployment(profiler_test_config['source_deployment']), env_update_var[0]) != env_update_var[1]:
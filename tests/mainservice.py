@@ -9,21 +9,23 @@ from kubernetes.client import V1CustomResourceDefinitionSpec, V1CustomResourceDe
 from kubernetes.client import V1CustomResourceValidation, V1JSONSchemaProps
 from kubernetes.client.exceptions import ApiException, OpenApiException
 
-from ProfilerKubeRC.container import EngineContainer, TasksContainer
+from ProfilerKubeRC.container import EngineContainer, TasksContainer, MetricsContainer
 from ProfilerKubeRC.ServiceInit import ServiceInit
 from ProfilerKubeRC.logger import LoggerContainer
 from dependency_injector.wiring import Provide
 from ProfilerKubeRC.logger import SLogger
-from ProfilerKubeRC.KubeEventListener import KubeEventListener
+from ProfilerKubeRC.KubeEventListener import KubeEventListener, KubeDeploymentEventListener, KubeClusterDeploymentEventListener
 from ProfilerKubeRC.KubeConfigMap import KubeConfigMap
 from ProfilerKubeRC.KubeEngine import KubeEngine
 from ProfilerKubeRC.KubeDeployment import KubeDeploymentWithClone
 from ProfilerKubeRC.KubeClient import KubeClient
 from ProfilerKubeRC.KubeEKSClusterInfo import KubeEKSClusterInfo
 from ProfilerKubeRC.KubeCrd import KubeCrd
+from ProfilerKubeRC.KubeSharding import KubeShardCoordinator
 from ProfilerKubeRC.runApp import startReplicationController
 from ProfilerKubeRC.KubeDeploymentTemplates import KubeDeploymentTemplates
 from ProfilerKubeRC.TasksManager import TasksManager
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
 from ProfilerKubeRC.healthcheck import HealthCheck
 
 from tests.kube_tests_lib import profiler_test_config
@@ -77,11 +79,15 @@ def initContainer():
     engine_container.config.cluster_type.from_env('CLIENT')
     engine_container.config.cluster.from_env('CLUSTER')
     engine_container.config.region.from_env('REGION')
+    engine_container.config.engine_type.from_env('ENGINE', 'sync')
     engine_container.wire(modules=[sys.modules[__name__]])
 
     tasks_container = TasksContainer()
     tasks_container.wire(modules=[sys.modules[__name__]])
 
+    metrics_container = MetricsContainer()
+    metrics_container.wire(modules=[sys.modules[__name__]])
+
 
 def createCrd():
     config.load_kube_config()
@@ -0,0 +1,78 @@
+import logging
+import threading
+
+from kubernetes.client.rest import ApiException
+
+from ProfilerKubeRC.KubeApiStats import KubeApiCallStats
+from ProfilerKubeRC.KubeEngine import kubapi_call
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeRateLimiter import KubeRateLimiter
+
+
+class StatsEngine:
+    def __init__(self):
+        self._api_stats = KubeApiCallStats()
+        self._rate_limiter = KubeRateLimiter(0, 1)
+        self._settings = KubeEngineSettings({})
+
+    def getLogger(self):
+        return logging.getLogger('test_api_stats')
+
+    def getApiStats(self):
+        return self._api_stats
+
+    def getRateLimiter(self):
+        return self._rate_limiter
+
+    def getSettings(self):
+        return self._settings
+
+    @kubapi_call('get', 'deployments')
+    def readDeployment(self, name, namespace):
+        if name == 'missing':
+            raise ApiException(status=404)
+        return name
+
+    @kubapi_call('patch', 'deployments/scale')
+    def patchDeploymentScale(self, name, namespace, patch_body):
+        return patch_body
+
+
+def getCounts(stats):
+    return {(call['verb'], call['resource'], call['namespace'], call['path'], call['outcome']): call['count'] for call in stats.getCalls()}
+
+
+def test_calls_are_tallied_by_path_and_outcome():
+    engine = StatsEngine()
+    stats = engine.getApiStats()
+    engine.readDeployment('app', 'ns')
+    with stats.reconcile('source-event'):
+        assert engine.readDeployment('missing', namespace='ns') is None
+        engine.patchDeploymentScale('app', 'ns', {})
+        engine.patchDeploymentScale('app', 'ns', {})
+    assert getCounts(stats) == {
+        ('get', 'deployments', 'ns', 'other', 'success'): 1,
+        ('get', 'deployments', 'ns', 'source-event', 'error:404'): 1,
+        ('patch', 'deployments/scale', 'ns', 'source-event', 'success'): 2
+    }
+
+
+def test_budget_is_checked_per_reconcile():
+    engine = StatsEngine()
+    stats = engine.getApiStats()
+    for calls in (1, 3, 2):
+        with stats.reconcile('source-event', budget=2):
+            for i in range(calls):
+                engine.readDeployment('app', 'ns')
+    assert stats.getReconciles() == {'source-event': {'reconciles': 3, 'calls': 6, 'calls_max': 3, 'budget_exceeded': 1, 'budget': 2}}
+
+
+def test_reconcile_path_is_kept_per_thread():
+    engine = StatsEngine()
+    stats = engine.getApiStats()
+    with stats.reconcile('config'):
+        thread = threading.Thread(target=engine.readDeployment, args=('app', 'ns'))
+        thread.start()
+        thread.join()
+    assert getCounts(stats) == {('get', 'deployments', 'ns', 'other', 'success'): 1}
+    assert stats.getReconciles()['config']['calls'] == 0
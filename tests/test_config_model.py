@@ -0,0 +1,55 @@
+import pytest
+
+from ProfilerKubeRC.KubeConfigModel import OperatorConfig, DeploymentConfig, ConfigError
+
+CONFIG = '''
+profiler:
+  deployments:
+    worker:
+      env: "PROFILING_ENABLED: True"
+      scale_factor: "0.5"
+      name_suffix: "profiler"
+    api:
+      cloned_image: "busybox"
+      env:
+        A: 1
+        B: two
+      scale_factor: 2
+      name_suffix: clone
+empty:
+'''
+
+
+def test_config_is_typed_and_frozen():
+    config = OperatorConfig.parse(CONFIG)
+    worker = config.getDeployment('profiler', 'worker')
+    assert worker == DeploymentConfig('profiler', 'worker', 'profiler', 0.5, None, (('PROFILING_ENABLED', 'True'),))
+    assert config.getDeployment('profiler', 'api').image == 'busybox'
+    assert config.getDeployment('profiler', 'api').env == (('A', '1'), ('B', 'two'))
+    assert config.getNamespaces() == ['empty', 'profiler'] and len(config) == 2
+    with pytest.raises(AttributeError):
+        worker.scale_factor = 1.0
+    with pytest.raises(AttributeError):
+        worker.extra = 1
+    assert OperatorConfig.parse(CONFIG) == config
+
+
+def test_diff_returns_only_changed_entries():
+    old = OperatorConfig.parse(CONFIG)
+    new = OperatorConfig.parse(CONFIG.replace('scale_factor: 2', 'scale_factor: 3').replace('    worker:', '    web:'))
+    added, removed, changed = new.diff(old)
+    assert [deployment.getKey() for deployment in added] == ['profiler/web']
+    assert [deployment.getKey() for deployment in removed] == ['profiler/worker']
+    assert [(deployment.getKey(), deployment.scale_factor) for deployment in changed] == [('profiler/api', 3.0)]
+
+
+def test_invalid_config_lists_all_errors():
+    with pytest.raises(ConfigError) as error:
+        OperatorConfig.parse('ns:\n  deployments:\n    a:\n      scale_factor: half\n      env: broken\n      replicas: 2\n')
+    message = str(error.value)
+    for problem in ('scale_factor has to be a number', 'name_suffix is required', 'env has to be', 'unknown keys replicas'):
+        assert problem in message
+    with pytest.raises(ConfigError):
+        OperatorConfig.parse('ns: [')
+    with pytest.raises(ConfigError):
+        OperatorConfig.parse('ns:\n  deployments:\n    a:\n      scale_factor: 1\n      name_suffix: x\n      image: a\n      cloned_image: b\n')
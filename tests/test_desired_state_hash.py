@@ -0,0 +1,36 @@
+from kubernetes import client
+
+from ProfilerKubeRC.KubeDeployment import KubeDeploymentManager, KubeDeploymentMetadataMixin
+
+
+def buildClone(replicas=1, image='app:1', revision='3'):
+    deployment = client.V1Deployment(
+        metadata=client.V1ObjectMeta(name='app', namespace='ns', resource_version='10', labels={'app': 'app'},
+                                     annotations={'deployment.kubernetes.io/revision': revision}),
+        spec=client.V1DeploymentSpec(
+            replicas=replicas,
+            selector=client.V1LabelSelector(match_labels={'app': 'app'}),
+            template=client.V1PodTemplateSpec(spec=client.V1PodSpec(containers=[client.V1Container(name='app', image=image)]))))
+    clone = KubeDeploymentManager('app-clone', 'ns')
+    clone._setBody(deployment)._resetDeployment()
+    return clone
+
+
+def test_hash_ignores_replicas_and_source_metadata():
+    assert buildClone(replicas=1, revision='3')._buildDesiredStateHash() == buildClone(replicas=5, revision='4')._buildDesiredStateHash()
+
+
+def test_hash_follows_template_changes():
+    clone = buildClone()
+    desired_hash = clone._buildDesiredStateHash()
+    assert buildClone(image='app:2')._buildDesiredStateHash() != desired_hash
+    clone._setDeploymentEnv('PROFILING_ENABLED', 'True')
+    assert clone._buildDesiredStateHash() != desired_hash
+
+
+def test_hash_annotation():
+    clone = buildClone()
+    assert KubeDeploymentMetadataMixin._getDesiredStateHash(clone._getBody()) is None
+    clone._setDesiredStateHash('abc')
+    assert KubeDeploymentMetadataMixin._getDesiredStateHash(clone._getBody()) == 'abc'
+    assert KubeDeploymentMetadataMixin._getDesiredStateHash(None) is None
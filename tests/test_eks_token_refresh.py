@@ -0,0 +1,108 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeClient import KubeEKSClient
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+
+from tests.fake_kube_api import FakeKubeApi
+
+NAMESPACE = 'eks'
+LAG = 60
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+class StubTokenSource:
+    """
+    Returns tokens "token-<n>" which have to be refreshed in about a second
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, cluster_name):
+        self.calls += 1
+        expiration = datetime.utcnow() + timedelta(seconds=LAG + 1)
+        return {'status': {'token': 'token-%d' % self.calls, 'expirationTimestamp': expiration.strftime('%Y-%m-%dT%H:%M:%SZ')}}
+
+
+def createClient(fake, token_source):
+    with mock.patch('ProfilerKubeRC.KubeEKSClusterInfo.boto3') as boto3:
+        boto3.client.return_value.describe_cluster.return_value = {'cluster': {'endpoint': fake.getEndpoint()}}
+        client = KubeEKSClient('cluster', lag=LAG, token_source=token_source)
+    assert boto3.client.return_value.describe_cluster.call_count == 1
+    return client
+
+
+def test_token_is_rotated_in_place_by_refresher():
+    fake = FakeKubeApi().start()
+    stop_event = threading.Event()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        token_source = StubTokenSource()
+        client = createClient(fake, token_source)
+        api_client = client.getApiClient()
+        engine = KubeEngine(client, KubeEngineSettings({}))
+        assert engine.readDeployment('app', NAMESPACE) is not None
+
+        threading.Thread(target=client.runTokenRefresher, args=(stop_event,), daemon=True).start()
+        deadline = time.monotonic() + 10
+        while token_source.calls < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert token_source.calls >= 3
+        assert engine.readDeployment('app', NAMESPACE) is not None
+        assert client.getApiClient() is api_client
+        assert api_client.configuration.api_key['authorization'] == 'token-%d' % token_source.calls
+        assert fake.getAuthorizations()[:3] == ['Bearer token-1', 'Bearer token-2', 'Bearer token-3']
+        assert engine.getConnectionPoolStats()['connections'] == 1                      # the pool isn't rebuilt
+    finally:
+        stop_event.set()
+        fake.stop()
+
+
+def test_expired_token_is_refreshed_by_request_without_refresher():
+    fake = FakeKubeApi().start()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        token_source = StubTokenSource()
+        engine = KubeEngine(createClient(fake, token_source), KubeEngineSettings({}))
+        assert engine.readDeployment('app', NAMESPACE) is not None
+        time.sleep(1.1)
+        assert engine.readDeployment('app', NAMESPACE) is not None
+        assert token_source.calls == 2 and fake.getAuthorizations() == ['Bearer token-1', 'Bearer token-2']
+    finally:
+        fake.stop()
+
+
+def test_endpoint_is_described_again_before_client_is_configured():
+    fake = FakeKubeApi().start()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        with mock.patch('ProfilerKubeRC.KubeEKSClusterInfo.boto3') as boto3:
+            describe_cluster = boto3.client.return_value.describe_cluster
+            describe_cluster.side_effect = [Exception('throttled'), {'cluster': {'endpoint': fake.getEndpoint()}}]
+            client = KubeEKSClient('cluster', lag=LAG, token_source=StubTokenSource())
+        assert describe_cluster.call_count == 2
+        assert client.getApiClient().configuration.host == fake.getEndpoint()
+        assert KubeEngine(client, KubeEngineSettings({})).readDeployment('app', NAMESPACE) is not None
+    finally:
+        fake.stop()
+
+
+def test_client_fails_to_start_if_endpoint_is_never_described():
+    with mock.patch('ProfilerKubeRC.KubeEKSClusterInfo.boto3') as boto3:
+        boto3.client.return_value.describe_cluster.side_effect = Exception('access denied')
+        with pytest.raises(Exception, match='access denied'):
+            KubeEKSClient('cluster', lag=LAG, token_source=StubTokenSource(), endpoint_attempts=2)
+        assert boto3.client.return_value.describe_cluster.call_count == 2
@@ -0,0 +1,36 @@
+import pytest
+from kubernetes import client
+
+from ProfilerKubeRC.KubePredicates import KubePredicatePipeline, DESIRED_HASH_ANNOTATION
+
+
+def buildEvent(event_type='MODIFIED', resource_version='1', generation=1, replicas=1, desired_hash=None, available=0, labels=None):
+    return {'type': event_type, 'object': client.V1Deployment(
+        metadata=client.V1ObjectMeta(name='app', namespace='ns', resource_version=resource_version, generation=generation, labels=labels,
+                                     annotations={DESIRED_HASH_ANNOTATION: desired_hash} if desired_hash else None),
+        spec=client.V1DeploymentSpec(replicas=replicas, selector=client.V1LabelSelector(), template=client.V1PodTemplateSpec()),
+        status=client.V1DeploymentStatus(available_replicas=available))}
+
+
+def test_status_only_and_duplicate_events_are_dropped():
+    pipeline = KubePredicatePipeline(['duplicate', 'spec'])
+    assert pipeline.isAccepted(buildEvent('ADDED', '1'))
+    assert not pipeline.isAccepted(buildEvent('MODIFIED', '1'))                     # redelivered
+    assert not pipeline.isAccepted(buildEvent('MODIFIED', '2', available=1))        # rollout progress
+    assert pipeline.isAccepted(buildEvent('MODIFIED', '3', replicas=2))
+    assert pipeline.isAccepted(buildEvent('MODIFIED', '4', replicas=2, generation=2))
+    assert pipeline.isAccepted(buildEvent('MODIFIED', '5', replicas=2, generation=2, desired_hash='abc'))
+    assert pipeline.isAccepted(buildEvent('MODIFIED', '6', replicas=2, generation=2, desired_hash='abc', labels={'team': 'a'}))  # no new generation
+    assert pipeline.isAccepted(buildEvent('DELETED', '7', replicas=2, generation=2, desired_hash='abc', labels={'team': 'a'}))
+    assert pipeline.isAccepted(buildEvent('ADDED', '8'))                            # created again
+    assert pipeline.getStats() == {'accepted': 7, 'dropped': {'duplicate': 1, 'spec': 1}}
+
+
+def test_predicates_can_be_disabled():
+    pipeline = KubePredicatePipeline([])
+    assert pipeline.isAccepted(buildEvent()) and pipeline.isAccepted(buildEvent())
+
+
+def test_unknown_predicate():
+    with pytest.raises(ValueError):
+        KubePredicatePipeline(['spec', 'conditions'])
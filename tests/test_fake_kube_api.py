@@ -0,0 +1,507 @@
+import pytest
+import sys
+import threading
+import time
+import yaml
+from copy import deepcopy
+from unittest import mock
+from dependency_injector import providers
+
+from ProfilerKubeRC.container import EngineContainer, TasksContainer, MetricsContainer
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeAsyncEngine import KubeAsyncEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeEventListener import KubeEventListener, KubeDeploymentEventListener, KubeClusterDeploymentEventListener, KubeCmEventListener
+from ProfilerKubeRC.KubeConfigMap import KubeConfigMap
+from ProfilerKubeRC.KubeCrd import KubeCrd
+from ProfilerKubeRC.KubeDeployment import KubeDeploymentManager, KubeDeploymentWithClone
+from ProfilerKubeRC.ServiceInit import ServiceInit
+from ProfilerKubeRC.TasksManager import TasksManager
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
+from ProfilerKubeRC.KubeSharding import KubeHashRing, KubeShardCoordinator
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot
+
+from tests.fake_kube_api import FakeKubeApi, DEPLOYMENTS, CONFIGMAPS, LEASES
+
+NAMESPACE = 'bench'
+CRD_NAME = 'ddprof-rcconfig'
+DEPLOYMENTS_COUNT = 20
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+def waitFor(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+# End-to-end tests run with both engines
+@pytest.fixture(params=['sync', 'asyncio'])
+def engine_type(request):
+    if request.param == 'asyncio':
+        pytest.importorskip('kubernetes_asyncio')
+    return request.param
+
+
+def createEngine(fake, engine_type, environ=None):
+    engine_class = KubeAsyncEngine if engine_type == 'asyncio' else KubeEngine
+    return engine_class(fake.createClient(), KubeEngineSettings(environ or {}))
+
+
+def test_engine_watch_resumes_and_relists_after_compaction(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        engine = createEngine(fake, engine_type, {'WATCH_TIMEOUT': '1', 'WATCH_BACKOFF_BASE': '0.01'})
+        events = []
+        threading.Thread(target=engine.watchDeployments, args=(NAMESPACE, events.append), daemon=True).start()
+        assert waitFor(lambda: [event['type'] for event in events] == ['ADDED'])
+        fake.setReplicas(NAMESPACE, 'app', 2)                                   # spec event and status-only event
+        assert waitFor(lambda: len(events) == 2)
+        assert waitFor(lambda: engine.getWatchStates()[0].bookmarks > 0, timeout=5)
+        state = engine.getWatchStates()[0]
+        fake.compact()                                                          # the next resume gets 410 Gone
+        assert waitFor(lambda: state.relists == 2, timeout=5)
+        fake.setReplicas(NAMESPACE, 'app', 3)
+        assert waitFor(lambda: len(events) == 3, timeout=5)
+        assert events[-1]['object'].spec.replicas == 3
+        assert engine.getPredicateStats()[state.name]['dropped']['spec'] >= 1
+        assert state.failures == 0
+    finally:
+        fake.stop()
+
+
+def test_engine_calls_and_injected_errors(engine_type):
+    fake = FakeKubeApi(latency=0.001).start()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        engine = createEngine(fake, engine_type)
+        clone = KubeDeploymentManager('app-clone', NAMESPACE)
+        clone._setBody(deepcopy(engine.readDeployment('app', NAMESPACE)))._resetDeployment()
+        assert engine.applyDeployment(clone._getBody(), NAMESPACE).name == 'app-clone'
+        fake.failNext('PATCH', 500, path='/scale')
+        assert engine.patchDeploymentScale('app-clone', NAMESPACE, {'spec': {'replicas': 2}}) is None
+        assert engine.patchDeploymentScale('app-clone', NAMESPACE, {'spec': {'replicas': 2}}).replicas == 2
+        assert fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-clone')['spec']['replicas'] == 2
+        assert fake.getRequestCounts() == {('get', 'deployments'): 1, ('apply', 'deployments'): 1, ('patch', 'deployments/scale'): 1}
+        outcomes = {(call['verb'], call['resource'], call['outcome']): call['count'] for call in engine.getApiStats().getCalls()}
+        assert outcomes == {
+            ('get', 'deployments', 'success'): 1,
+            ('apply', 'deployments', 'success'): 1,
+            ('patch', 'deployments/scale', 'error:500'): 1,
+            ('patch', 'deployments/scale', 'success'): 1
+        }
+    finally:
+        fake.stop()
+
+
+def test_engine_counts_deployments_not_names_against_max_watches():
+    fake = FakeKubeApi().start()
+    try:
+        engine = createEngine(fake, 'sync')
+        pairs = [['app-%d' % i, 'app-%d-clone' % i] for i in range(3)]
+        assert [selector['field_selector'] for selector in engine.getDeploymentWatchSelectors(pairs[:2])] == [
+            'metadata.name=app-0', 'metadata.name=app-0-clone', 'metadata.name=app-1', 'metadata.name=app-1-clone']
+        assert engine.getDeploymentWatchSelectors(pairs) == [{}]
+        assert createEngine(fake, 'sync', {'DEPLOYMENT_LABEL_SELECTOR': 'team=a'}).getDeploymentWatchSelectors(pairs[:1]) == [{'label_selector': 'team=a'}]
+    finally:
+        fake.stop()
+
+
+def test_engine_reuses_pooled_connections_with_gzip_and_timeouts():
+    fake = FakeKubeApi().start()
+    try:
+        for i in range(20):
+            fake.addDeployment(NAMESPACE, 'app-%d' % i)
+        engine = KubeEngine(fake.createClient(), KubeEngineSettings({'API_POOL_SIZE': '2', 'API_READ_TIMEOUT': '0.5'}))
+        assert len(engine.listAllDeployments().items) == 20
+        assert fake.getCompressedResponses() == 1
+        for i in range(5):
+            assert engine.readDeployment('app-%d' % i, NAMESPACE).metadata.name == 'app-%d' % i
+        stats = engine.getConnectionPoolStats()
+        assert (stats['size'], stats['connections'], stats['requests'], stats['saturated']) == (2, 1, 6, 0)
+
+        threads = [threading.Thread(target=engine.readDeployment, args=('app-0', NAMESPACE)) for i in range(4)]
+        fake._latency = 0.2
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert engine.getConnectionPoolStats()['saturated'] >= 1
+
+        fake._latency = 5.0                                                     # a hung API server doesn't block the caller
+        started_at = time.monotonic()
+        assert engine.readDeployment('app-0', NAMESPACE) is None                # read timeouts of GET are retried by urllib3
+        assert time.monotonic() - started_at < 5.0
+    finally:
+        fake.stop()
+
+
+def startOperator(fake, environ=None, engine_type='sync'):
+    engine_container = EngineContainer()
+    engine_container.config.engine_type.from_value(engine_type)
+    engine_container.kube_client.override(providers.Object(fake.createClient()))
+    engine_container.engine_settings.override(providers.Object(KubeEngineSettings(dict({'WATCH_TIMEOUT': '5'}, **(environ or {})))))
+    engine_container.wire(modules=[sys.modules[__name__]])
+    tasks_container = TasksContainer()
+    tasks_container.wire(modules=[sys.modules[__name__]])
+    metrics_container = MetricsContainer()
+    metrics_container.wire(modules=[sys.modules[__name__]])
+    service_init = ServiceInit(CRD_NAME, NAMESPACE)
+    service_init.runInit()
+    threading.Thread(target=tasks_container.tasks_manager().runTasks, daemon=True).start()
+    return service_init, engine_container.kube_engine(), tasks_container.work_queue(), metrics_container.registry()
+
+
+def getWrites(counts):
+    return sum(count for (verb, resource), count in counts.items() if verb not in ('list', 'watch'))
+
+
+def getNames(count):
+    return ['app-%d' % i for i in range(count)]
+
+
+def buildConfig(deployments, image=None):
+    config = ''
+    for ns, names in deployments.items():
+        config += '%s:\n  deployments:\n' % ns
+        for name in names:
+            config += '    %s:\n      scale_factor: "1"\n      name_suffix: "clone"\n' % name
+            if image is not None:
+                config += '      image: "%s"\n' % image
+    return config
+
+
+# Source deployments, the operator's configmap and the CRD which points to it. deployments is {namespace: [names]}
+def addOperatorConfig(fake, deployments, image=None):
+    for ns, names in deployments.items():
+        for name in names:
+            fake.addDeployment(ns, name)
+    fake.addConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': buildConfig(deployments, image)})
+    fake.addCustomObject('crds.grove', 'v1', NAMESPACE, 'ddprofcrds', CRD_NAME,
+                         {'cmName': 'ddprof-rcconfig', 'cmNamespace': NAMESPACE, 'cmConfigTag': 'profiler-rc-config', 'ruleType': 'configmap'})
+
+
+def test_operator_throughput(engine_type):
+    fake = FakeKubeApi(latency=0.001).start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(DEPLOYMENTS_COUNT)})
+        service_init, engine, work_queue, metrics = startOperator(fake, engine_type=engine_type)
+        assert all(fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-%d-clone' % i) is not None for i in range(DEPLOYMENTS_COUNT))
+        assert waitFor(lambda: len(engine.getWatchStates()) == 2 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert waitFor(lambda: work_queue.getStats()['depth'] == 0 and work_queue.getStats()['processing'] == 0)
+        assert service_init.getReadinessFailures() == [] and service_init.getLivenessFailures() == []
+
+        counts = fake.getRequestCounts()
+        started_at = time.monotonic()
+        for i in range(DEPLOYMENTS_COUNT):
+            fake.setReplicas(NAMESPACE, 'app-%d' % i, 3)
+        assert waitFor(lambda: all(fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-%d-clone' % i)['spec']['replicas'] == 3 for i in range(DEPLOYMENTS_COUNT)))
+        seconds = time.monotonic() - started_at
+
+        writes = getWrites(fake.getRequestCounts()) - getWrites(counts)
+        print("%d replica changes converged in %.3f seconds (%.1f changes/s), %d API calls" % (DEPLOYMENTS_COUNT, seconds, DEPLOYMENTS_COUNT / seconds, writes))
+        assert writes <= 2 * DEPLOYMENTS_COUNT
+        assert engine.getApiStats().getReconciles()['source-event']['budget_exceeded'] == 0
+
+        assert waitFor(lambda: 'ddprofiler_rc_event_to_converged_seconds_count %d\n' % DEPLOYMENTS_COUNT in metrics.render())
+        assert waitFor(lambda: work_queue.getStats()['depth'] == 0 and work_queue.getStats()['processing'] == 0)     # events of the clones
+        exposition = metrics.render()
+        assert 'ddprofiler_rc_clones{state="converged"} %d' % DEPLOYMENTS_COUNT in exposition
+        assert 'ddprofiler_rc_reconcile_duration_seconds_count{path="source-event"}' in exposition
+        assert 'ddprofiler_rc_work_queue_depth 0' in exposition
+        assert service_init.getReadinessFailures() == []
+    finally:
+        fake.stop()
+
+
+def getClonedReplicas(fake, name):
+    return fake.getObject(DEPLOYMENTS, NAMESPACE, name + '-clone')['spec']['replicas']
+
+
+def test_operator_shards_deployments_with_other_replica(engine_type):
+    fake = FakeKubeApi().start()
+    stop_other = threading.Event()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(8)})
+        environ = {'SHARD_GROUP': 'ops', 'SHARD_IDENTITY': 'operator', 'SHARD_LEASE_DURATION': '1', 'SHARD_RENEW_INTERVAL': '0.1',
+                   'FIELD_SELECTOR_MAX_WATCHES': '100'}
+        service_init, engine, work_queue, metrics = startOperator(fake, environ, engine_type)
+        names = getNames(8)
+        assert all(fake.getObject(DEPLOYMENTS, NAMESPACE, name + '-clone') is not None for name in names)
+
+        other = KubeShardCoordinator(NAMESPACE, 'other')                 # the second replica joins the group
+        other.join()
+        threading.Thread(target=other.runMembership, args=(stop_other,), daemon=True).start()
+        ring = KubeHashRing(['operator', 'other'])
+        own = [name for name in names if ring.getOwner('%s/%s' % (NAMESPACE, name)) == 'operator']
+        foreign = [name for name in names if name not in own]
+        assert own and foreign
+        assert waitFor(lambda: 'ddprofiler_rc_managed_deployments %d\n' % len(own) in metrics.render())
+        assert waitFor(lambda: len(engine.getWatchStates()) == 2 * len(own) + 1)       # source and clone of own deployments and the configmap
+
+        fake.setReplicas(NAMESPACE, foreign[0], 4)
+        fake.setReplicas(NAMESPACE, own[0], 4)
+        assert waitFor(lambda: getClonedReplicas(fake, own[0]) == 4)
+        assert getClonedReplicas(fake, foreign[0]) == 1                 # it is reconciled by the other replica
+
+        stop_other.set()                                                # the other replica leaves the group
+        assert waitFor(lambda: 'ddprofiler_rc_managed_deployments 8\n' in metrics.render())
+        assert waitFor(lambda: getClonedReplicas(fake, foreign[0]) == 4)
+        assert 'ddprofiler_rc_shard_members 1\n' in metrics.render()
+        service_init.stop()
+        time.sleep(0.3)
+        assert fake.getObject(LEASES, NAMESPACE, 'ops-operator') is None         # renewals are stopped, the lease isn't created again
+    finally:
+        stop_other.set()
+        fake.stop()
+
+
+def test_operator_watches_all_namespaces_by_one_watch(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        namespaces = [NAMESPACE, 'team-a', 'team-b']
+        addOperatorConfig(fake, {ns: getNames(3) for ns in namespaces})
+        fake.addDeployment('unmanaged', 'app-0')
+        service_init, engine, work_queue, metrics = startOperator(fake, {'WATCH_SCOPE': 'cluster'}, engine_type)
+        assert waitFor(lambda: sorted(state.name.split('?')[0] for state in engine.getWatchStates()) == ['configmaps/%s' % NAMESPACE, 'deployments/*'])
+        assert waitFor(lambda: all(state.resource_version is not None for state in engine.getWatchStates()))
+
+        fake.setReplicas('team-b', 'app-2', 5)
+        fake.setReplicas('unmanaged', 'app-0', 5)
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, 'team-b', 'app-2-clone')['spec']['replicas'] == 5)
+        assert fake.getObject(DEPLOYMENTS, 'unmanaged', 'app-0-clone') is None
+        assert engine.getDeploymentCache().get('app-0', 'unmanaged') == (False, None)  # events of other namespaces are dropped
+        assert fake.getRequestCounts()[('watch', DEPLOYMENTS)] == 1
+        assert waitFor(lambda: service_init.getReadinessFailures() == [])
+    finally:
+        fake.stop()
+
+
+def test_operator_watches_namespaces_if_cluster_list_is_forbidden(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(2), 'team-a': getNames(2)})
+        fake.failNext('GET', 403, path=r'^/apis/apps/v1/deployments\?')
+        service_init, engine, work_queue, metrics = startOperator(fake, {'WATCH_SCOPE': 'cluster'}, engine_type)
+        assert waitFor(lambda: {state.name.split('?')[0] for state in engine.getWatchStates()} ==
+                       {'configmaps/%s' % NAMESPACE, 'deployments/%s' % NAMESPACE, 'deployments/team-a'})
+        assert waitFor(lambda: all(state.resource_version is not None for state in engine.getWatchStates()))
+        fake.setReplicas('team-a', 'app-1', 2)
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, 'team-a', 'app-1-clone')['spec']['replicas'] == 2)
+    finally:
+        fake.stop()
+
+
+def test_operator_applies_configmap_from_event_without_reading_it(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(3)})
+        fake.addConfigMap(NAMESPACE, 'unrelated', {'key': 'value'})
+        service_init, engine, work_queue, metrics = startOperator(fake, engine_type=engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 2 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert 'configmaps/%s?metadata.name=ddprof-rcconfig' % NAMESPACE in [state.name for state in engine.getWatchStates()]
+        reads = fake.getRequestCounts()[('get', CONFIGMAPS)]
+
+        config = fake.getObject(CONFIGMAPS, NAMESPACE, 'ddprof-rcconfig')['data']['profiler-rc-config']
+        with mock.patch('ProfilerKubeRC.KubeConfigModel.yaml.load', side_effect=yaml.load) as yaml_load:
+            fake.updateConfigMap(NAMESPACE, 'unrelated', {'key': 'changed'})
+            fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': config.replace('scale_factor: "1"', 'scale_factor: "2"', 1)})
+            assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 2)
+            assert yaml_load.call_count == 1                                    # the old configuration is cached by its resourceVersion
+        assert fake.getRequestCounts()[('get', CONFIGMAPS)] == reads
+        assert getClonedReplicas(fake, 'app-1') == 1
+
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': 'bench:\n  deployments:\n    app-0:\n      scale_factor: many\n'})
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': config.replace('scale_factor: "1"', 'scale_factor: "3"', 1)})
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 3)        # the invalid version was skipped, other deployments are kept
+        assert 'ddprofiler_rc_managed_deployments 3\n' in metrics.render()
+    finally:
+        fake.stop()
+
+
+def test_operator_catches_up_on_configmap_change_missed_by_broken_watch(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(2)})
+        service_init, engine, work_queue, metrics = startOperator(fake, {'WATCH_TIMEOUT': '1'}, engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 5 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        state = [state for state in engine.getWatchStates() if state.name.startswith('configmaps/')][0]
+
+        fake.failNext('GET', 500, path=r'/configmaps\?.*watch=(?i:true)')        # the watch is broken when its request ends
+        assert waitFor(lambda: state.failures == 1)
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': buildConfig({NAMESPACE: getNames(2)}).replace('scale_factor: "1"', 'scale_factor: "2"')})
+        fake.compact()                                                          # the change can't be resumed, the configmap is relisted
+        assert waitFor(lambda: state.relists == 2)
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 2 and getClonedReplicas(fake, 'app-1') == 2)
+    finally:
+        fake.stop()
+
+
+def test_operator_adds_and_removes_deployments_and_namespaces_at_runtime(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(3)})
+        fake.addDeployment('team-a', 'app-0')
+        service_init, engine, work_queue, metrics = startOperator(fake, {'REMOVED_CLONE_POLICY': 'delete', 'FIELD_SELECTOR_MAX_WATCHES': '100'}, engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 7 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        untouched_version = fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone')['metadata']['resourceVersion']
+
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': buildConfig({NAMESPACE: ['app-0', 'app-2'], 'team-a': ['app-0']})})
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, 'team-a', 'app-0-clone') is not None)
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-1-clone') is None)
+        assert waitFor(lambda: 'deployments/team-a?metadata.name=app-0' in [state.name for state in engine.getWatchStates()])
+        assert waitFor(lambda: 'deployments/%s?metadata.name=app-1' % NAMESPACE not in [state.name for state in engine.getWatchStates()])
+        fake.setReplicas('team-a', 'app-0', 3)
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, 'team-a', 'app-0-clone')['spec']['replicas'] == 3)
+
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': buildConfig({NAMESPACE: ['app-0', 'app-2']})})
+        assert waitFor(lambda: not [state for state in engine.getWatchStates() if state.name.startswith('deployments/team-a')])
+        assert fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone')['metadata']['resourceVersion'] == untouched_version
+        assert fake.getRequestCounts()[('delete', DEPLOYMENTS)] == 2
+        assert 'ddprofiler_rc_managed_deployments 2\n' in metrics.render()
+    finally:
+        fake.stop()
+
+
+@pytest.mark.parametrize('decoder', ['model', 'raw'])
+def test_operator_builds_clone_from_event_and_caches_snapshots(engine_type, decoder):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(2)})
+        service_init, engine, work_queue, metrics = startOperator(fake, {'DEPLOYMENT_DECODER': decoder}, engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 5 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert waitFor(lambda: work_queue.getStats()['depth'] == 0 and work_queue.getStats()['processing'] == 0)
+        reads = fake.getRequestCounts()[('get', DEPLOYMENTS)]
+
+        engine.patchDeployment('app-0', NAMESPACE, {'spec': {'template': {'spec': {'containers': [{'name': 'app-0', 'image': 'nginx:2'}]}}}})
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone')['spec']['template']['spec']['containers'][0]['image'] == 'nginx:2')
+        fake.setReplicas(NAMESPACE, 'app-0', 4)
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone')['spec']['replicas'] == 4)
+        assert fake.getRequestCounts()[('get', DEPLOYMENTS)] == reads                  # the clone is built from the event object
+
+        assert waitFor(lambda: engine.getDeploymentCache().get('app-0-clone', NAMESPACE)[1].replicas == 4)       # the response can come after the fake is changed
+        cloned = engine.getDeploymentCache().get('app-0-clone', NAMESPACE)[1]
+        assert isinstance(cloned, KubeDeploymentSnapshot) and cloned.image == 'nginx:2'
+        assert waitFor(lambda: service_init.getReadinessFailures() == [])
+    finally:
+        fake.stop()
+
+
+def test_operator_clones_source_created_after_start(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(1) + ['late']})
+        fake.deleteObject(DEPLOYMENTS, NAMESPACE, 'late')                    # configured, but not created yet
+        service_init, engine, work_queue, metrics = startOperator(fake, {'FIELD_SELECTOR_MAX_WATCHES': '100'}, engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 5 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert fake.getObject(DEPLOYMENTS, NAMESPACE, 'late-clone') is None
+
+        fake.addDeployment(NAMESPACE, 'late', replicas=2)                    # its next events change only status and are dropped
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'late-clone') is not None)
+        assert waitFor(lambda: getClonedReplicas(fake, 'late') == 2)
+    finally:
+        fake.stop()
+
+
+def getClonedImage(fake, name):
+    return fake.getObject(DEPLOYMENTS, NAMESPACE, name + '-clone')['spec']['template']['spec']['containers'][0]['image']
+
+
+def test_operator_repairs_clone_changed_or_deleted_by_others(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(1)}, image='profiler:1')
+        service_init, engine, work_queue, metrics = startOperator(fake, engine_type=engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 3 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert getClonedImage(fake, 'app-0') == 'profiler:1'
+        assert service_init._kube_deployments[0].getCloneState() == 'converged'
+
+        fake.setReplicas(NAMESPACE, 'app-0-clone', 5)
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 1)
+        assert waitFor(lambda: 'ddprofiler_rc_clone_repairs_total 1\n' in metrics.render())
+
+        engine.patchDeployment('app-0-clone', NAMESPACE, {'spec': {'template': {'spec': {'containers': [{'name': 'app-0', 'image': 'nginx:2'}]}}}})
+        assert waitFor(lambda: getClonedImage(fake, 'app-0') == 'profiler:1')
+        assert waitFor(lambda: 'ddprofiler_rc_clone_repairs_total 2\n' in metrics.render())
+
+        fake.deleteObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone')
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-clone') is not None)
+        assert (getClonedReplicas(fake, 'app-0'), getClonedImage(fake, 'app-0')) == (1, 'profiler:1')
+        assert waitFor(lambda: 'ddprofiler_rc_clone_repairs_total 3\n' in metrics.render())
+        assert waitFor(lambda: 'ddprofiler_rc_clones{state="converged"} 1\n' in metrics.render())
+
+        config = buildConfig({NAMESPACE: getNames(1)}, image='profiler:1').replace('name_suffix: "clone"', 'name_suffix: "profiled"')
+        fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': config})
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-profiled') is not None)
+        fake.setReplicas(NAMESPACE, 'app-0-profiled', 5)                     # events of the renamed clone reach its handler
+        assert waitFor(lambda: fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-0-profiled')['spec']['replicas'] == 1)
+        assert waitFor(lambda: 'ddprofiler_rc_clone_repairs_total 4\n' in metrics.render())
+    finally:
+        fake.stop()
+
+
+def test_operator_keeps_watching_while_throttled_reconcile_waits(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(2)})
+        service_init, engine, work_queue, metrics = startOperator(fake, {'API_THROTTLE_RETRIES': '1'}, engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 5 and all(state.resource_version is not None for state in engine.getWatchStates()))
+
+        fake.failNext('PATCH', 429, path='/app-0-clone/scale')              # the worker waits Retry-After: 1 of the fake
+        fake.setReplicas(NAMESPACE, 'app-0', 3)
+        assert waitFor(lambda: any(call['outcome'] == 'error:429' for call in engine.getApiStats().getCalls()))
+        fake.setReplicas(NAMESPACE, 'app-1', 4)
+        assert waitFor(lambda: engine.getDeployment('app-1', NAMESPACE).replicas == 4, timeout=0.8)   # events reach the cache meanwhile
+        assert getClonedReplicas(fake, 'app-0') == 1
+
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 3)        # the retried reconcile doesn't block the loop
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-1') == 4)
+        fake.setReplicas(NAMESPACE, 'app-0', 2)
+        assert waitFor(lambda: getClonedReplicas(fake, 'app-0') == 2)
+    finally:
+        fake.stop()
+
+
+def test_operator_is_ready_while_a_clone_cant_be_created(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(2)})
+        fake.failNext('PATCH', 403, count=1000, path='/deployments/app-1-clone')             # f.e. the quota of the namespace is exceeded
+        service_init, engine, work_queue, metrics = startOperator(fake, engine_type=engine_type)
+        assert waitFor(lambda: len(engine.getWatchStates()) == 5 and all(state.resource_version is not None for state in engine.getWatchStates()))
+        assert fake.getObject(DEPLOYMENTS, NAMESPACE, 'app-1-clone') is None
+        assert waitFor(lambda: 'ddprofiler_rc_clones{state="missing"} 1\n' in metrics.render())
+        assert service_init.getReadinessFailures() == []
+    finally:
+        fake.stop()
+
+
+def test_operator_creates_one_listener_for_deployments_of_new_namespace(engine_type):
+    fake = FakeKubeApi().start()
+    try:
+        addOperatorConfig(fake, {NAMESPACE: getNames(1)})
+        for name in getNames(4):
+            fake.addDeployment('team-a', name)
+        service_init, engine, work_queue, metrics = startOperator(fake, {'WORKERS': '4', 'FIELD_SELECTOR_MAX_WATCHES': '100'}, engine_type)
+
+        def createListener(namespace):                                    # a slow listener gives parallel workers time to race
+            time.sleep(0.2)
+            return KubeDeploymentEventListener(namespace)
+        with mock.patch('ProfilerKubeRC.ServiceInit.KubeDeploymentEventListener', side_effect=createListener):
+            fake.updateConfigMap(NAMESPACE, 'ddprof-rcconfig', {'profiler-rc-config': buildConfig({NAMESPACE: getNames(1), 'team-a': getNames(4)})})
+            assert waitFor(lambda: all(fake.getObject(DEPLOYMENTS, 'team-a', name + '-clone') is not None for name in getNames(4)))
+            assert waitFor(lambda: work_queue.getStats()['depth'] == 0 and work_queue.getStats()['processing'] == 0)
+        assert [listener.getNamespace() for listener in service_init._kube_event_listeners] == [NAMESPACE, 'team-a']
+        assert waitFor(lambda: len([state for state in engine.getWatchStates() if state.name.startswith('deployments/team-a')]) == 8)
+    finally:
+        fake.stop()
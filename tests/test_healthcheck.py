@@ -0,0 +1,68 @@
+import sys
+import threading
+import time
+import urllib.request
+from urllib.error import HTTPError
+from http.server import ThreadingHTTPServer
+
+from ProfilerKubeRC.container import EngineContainer, TasksContainer, MetricsContainer
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.healthcheck import HealthCheck
+
+
+class ServiceState:
+    def __init__(self):
+        self.liveness = []
+        self.readiness = []
+        self.checks = 0
+
+    def getLivenessFailures(self):
+        self.checks += 1
+        return self.liveness
+
+    def getReadinessFailures(self):
+        self.checks += 1
+        return self.readiness
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+    for container in (EngineContainer(), TasksContainer(), MetricsContainer()):
+        container.wire(modules=[sys.modules[__name__]])
+
+
+def get(server, path):
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:%d%s' % (server.server_port, path), timeout=5) as response:
+            return response.status, response.read().decode()
+    except HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def test_probes_are_answered_from_service_state():
+    HealthCheck.service_check = None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HealthCheck)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert get(server, '/readyz') == (503, 'service is not initialized\n')
+        service = ServiceState()
+        HealthCheck.service_check = service
+        assert get(server, '/livez') == (200, 'ok\n')
+        assert get(server, '/readyz') == (200, 'ok\n')
+        service.readiness = ['watch deployments/bench is not synced']
+        assert get(server, '/') == (503, 'watch deployments/bench is not synced\n')
+        assert get(server, '/livez') == (200, 'ok\n')
+        assert get(server, '/metrics')[0] == 200
+        assert get(server, '/unknown')[0] == 404
+
+        started_at = time.monotonic()
+        for i in range(50):
+            get(server, '/readyz')
+        assert time.monotonic() - started_at < 5                   # no retries and sleeps in probes
+        assert service.checks == 54
+    finally:
+        HealthCheck.service_check = None
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,81 @@
+import pytest
+from kubernetes import client
+
+from ProfilerKubeRC.KubeInformer import KubeInformerCache
+from ProfilerKubeRC.KubePredicates import DESIRED_HASH_ANNOTATION
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot, LAST_APPLIED_ANNOTATION
+from ProfilerKubeRC.KubeWatch import KubeWatchState
+
+
+def buildDeployment(resource_version, replicas):
+    return client.V1Deployment(
+        metadata=client.V1ObjectMeta(name='app', namespace='ns', resource_version=resource_version),
+        spec=client.V1DeploymentSpec(replicas=replicas, selector=client.V1LabelSelector(), template=client.V1PodTemplateSpec()),
+        status=client.V1DeploymentStatus(replicas=replicas))
+
+
+def buildScale(resource_version, replicas, running):
+    return client.V1Scale(
+        metadata=client.V1ObjectMeta(name='app', namespace='ns', resource_version=resource_version),
+        spec=client.V1ScaleSpec(replicas=replicas),
+        status=client.V1ScaleStatus(replicas=running))
+
+
+def test_older_object_does_not_replace_cached_one():
+    cache = KubeInformerCache()
+    cache.put(buildDeployment('10', 1))
+    assert cache.put(buildDeployment('9', 2)).replicas == 1
+    assert cache.get('app', 'ns')[1].resource_version == '10'
+
+
+def test_scale_response_updates_a_copy_of_cached_deployment():
+    cache = KubeInformerCache()
+    deployment = cache.put(buildDeployment('10', 1))
+    updated = cache.putScale(buildScale('11', 3, 2))
+    assert (updated.replicas, updated.status_replicas, updated.resource_version) == (3, 2, '11')
+    assert cache.get('app', 'ns')[1] is updated
+    assert (deployment.replicas, deployment.status_replicas, deployment.resource_version) == (1, 1, '10')
+    assert updated.template_hash == deployment.template_hash
+
+
+def test_scale_of_unknown_deployment_is_ignored():
+    cache = KubeInformerCache()
+    assert cache.putScale(buildScale('11', 3, 2)) is None
+    assert cache.get('app', 'ns') == (False, None)
+
+
+def test_deployment_is_pruned_and_cached_as_snapshot():
+    deployment = buildDeployment('10', 2)
+    deployment.metadata.managed_fields = [client.V1ManagedFieldsEntry(manager='kubectl')]
+    deployment.metadata.annotations = {LAST_APPLIED_ANNOTATION: '{}', DESIRED_HASH_ANNOTATION: 'abc'}
+    deployment.status.conditions = [client.V1DeploymentCondition(type='Available', status='True')]
+    deployment.spec.template.spec = client.V1PodSpec(containers=[client.V1Container(name='app', image='app:1', env=[client.V1EnvVar(name='A', value='1')])])
+    KubeDeploymentSnapshot.prune(deployment)
+    assert deployment.metadata.managed_fields is None and deployment.status.conditions is None
+    assert deployment.metadata.annotations == {DESIRED_HASH_ANNOTATION: 'abc'}
+
+    cache = KubeInformerCache()
+    snapshot = cache.put(deployment)
+    assert isinstance(snapshot, KubeDeploymentSnapshot) and cache.get('app', 'ns')[1] is snapshot
+    assert (snapshot.replicas, snapshot.status_replicas, snapshot.desired_hash, snapshot.image, snapshot.env) == (2, 2, 'abc', 'app:1', (('A', '1'),))
+    assert snapshot.template_hash == KubeDeploymentSnapshot.buildDesiredStateHash(deployment)
+    with pytest.raises(AttributeError):
+        snapshot.replicas = 3
+    deployment.spec.replicas = 5
+    assert KubeDeploymentSnapshot.fromDeployment(deployment).template_hash == snapshot.template_hash
+
+
+def test_watch_state_keeps_only_resource_versions_of_objects():
+    state = KubeWatchState('deployments/ns')
+    other = buildDeployment('11', 1)
+    other.metadata.name = 'other'
+    state.observe({'type': 'ADDED', 'object': buildDeployment('10', 1)})
+    state.observe({'type': 'MODIFIED', 'object': other})
+    assert state._known == {('ns', 'app'): '10', ('ns', 'other'): '11'}
+
+    events = state.relistEvents([buildDeployment('12', 2)], '12', 'V1Deployment')
+    assert [(event['type'], event['object'].metadata.name, event['object'].metadata.resource_version) for event in events] == \
+        [('MODIFIED', 'app', '12'), ('DELETED', 'other', '11')]
+    assert state._known == {('ns', 'app'): '12'}
+    deleted = KubeDeploymentSnapshot.fromDeployment(events[1]['object'])          # DELETED objects are stubs with metadata only
+    assert (deleted.namespace, deleted.name, deleted.replicas) == ('ns', 'other', None)
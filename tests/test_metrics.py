@@ -0,0 +1,30 @@
+from ProfilerKubeRC.metrics import MetricsRegistry, MetricFamily, getProcessRss
+
+
+def test_registry_renders_counters_gauges_and_histograms():
+    registry = MetricsRegistry()
+    calls = registry.counter('calls_total', 'Calls', ('verb',))
+    calls.inc(verb='get')
+    calls.inc(2, verb='get')
+    assert registry.counter('calls_total', 'Calls', ('verb',)) is calls
+    registry.gauge('depth', 'Depth').set(3)
+    histogram = registry.histogram('duration_seconds', 'Duration', ('path',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, path='load')
+    histogram.observe(0.5, path='load')
+    histogram.observe(5, path='load')
+    registry.addCollector(lambda: [MetricFamily('label', 'gauge', 'Escaped label').addSample({'name': 'a"b\\c'}, 1)])
+
+    lines = registry.render().splitlines()
+    assert '# TYPE ddprofiler_rc_calls_total counter' in lines
+    assert 'ddprofiler_rc_calls_total{verb="get"} 3' in lines
+    assert 'ddprofiler_rc_depth 3' in lines
+    assert 'ddprofiler_rc_duration_seconds_bucket{path="load",le="0.1"} 1' in lines
+    assert 'ddprofiler_rc_duration_seconds_bucket{path="load",le="1.0"} 2' in lines
+    assert 'ddprofiler_rc_duration_seconds_bucket{path="load",le="+Inf"} 3' in lines
+    assert 'ddprofiler_rc_duration_seconds_count{path="load"} 3' in lines
+    assert 'ddprofiler_rc_duration_seconds_sum{path="load"} 5.55' in lines
+    assert 'ddprofiler_rc_label{name="a\\"b\\\\c"} 1' in lines
+
+
+def test_process_rss():
+    assert getProcessRss() > 0
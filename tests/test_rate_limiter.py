@@ -0,0 +1,80 @@
+import pytest
+import sys
+import threading
+import time
+
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeRateLimiter import KubeRateLimiter, LANE_REPLICAS, LANE_DEFAULT, LANE_WRITES
+
+from tests.fake_kube_api import FakeKubeApi, DEPLOYMENTS
+
+NAMESPACE = 'limited'
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+def test_burst_is_passed_and_then_calls_are_paced():
+    limiter = KubeRateLimiter(qps=20, burst=2)
+    started_at = time.monotonic()
+    waits = [limiter.acquire() for i in range(6)]
+    assert waits[:2] == [0.0, 0.0] and all(wait > 0 for wait in waits[2:])
+    assert time.monotonic() - started_at >= 0.18
+    stats = limiter.getStats()['lanes'][LANE_DEFAULT]
+    assert (stats['calls'], stats['delayed']) == (6, 4) and stats['wait_seconds_total'] > 0
+    assert KubeRateLimiter(qps=0, burst=1).acquire() == 0.0
+
+
+def acquireInOrder(limiter, lane, order):
+    limiter.acquire(lane)
+    order.append(lane)
+
+
+def test_replica_changes_overtake_queued_writes():
+    limiter = KubeRateLimiter(qps=5, burst=1)
+    limiter.acquire()
+    order = []
+    writes = [threading.Thread(target=acquireInOrder, args=(limiter, LANE_WRITES, order)) for i in range(2)]
+    for thread in writes:
+        thread.start()
+    time.sleep(0.05)
+    replicas = threading.Thread(target=acquireInOrder, args=(limiter, LANE_REPLICAS, order))
+    replicas.start()
+    for thread in writes + [replicas]:
+        thread.join()
+    assert order == [LANE_REPLICAS, LANE_WRITES, LANE_WRITES]
+    assert [KubeRateLimiter.getLane(*call) for call in (('patch', 'deployments/scale'), ('apply', 'deployments'), ('get', 'deployments'))] == \
+        [LANE_REPLICAS, LANE_WRITES, LANE_DEFAULT]
+
+
+def test_retry_after_pauses_all_lanes():
+    limiter = KubeRateLimiter(qps=100, burst=10)
+    limiter.pause(0.3)
+    assert limiter.acquire(LANE_REPLICAS) >= 0.25
+    assert limiter.getStats()['pauses'] == 1 and limiter.getStats()['paused_seconds_total'] == pytest.approx(0.3)
+
+
+def test_throttled_call_is_retried_after_retry_after():
+    fake = FakeKubeApi().start()
+    try:
+        fake.addDeployment(NAMESPACE, 'app')
+        engine = KubeEngine(fake.createClient(), KubeEngineSettings({'API_THROTTLE_RETRIES': '1'}))
+        engine.readDeployment('app', NAMESPACE)
+        fake.failNext('PATCH', 429, path='/scale')
+        started_at = time.monotonic()
+        assert engine.patchDeploymentScale('app', NAMESPACE, {'spec': {'replicas': 2}}).replicas == 2
+        assert time.monotonic() - started_at >= 0.9                                  # Retry-After: 1 of the fake
+        assert fake.getObject(DEPLOYMENTS, NAMESPACE, 'app')['spec']['replicas'] == 2
+        outcomes = {call['outcome']: call['count'] for call in engine.getApiStats().getCalls() if call['resource'] == 'deployments/scale'}
+        assert outcomes == {'error:429': 1, 'success': 1}
+        assert engine.getRateLimiter().getStats()['pauses'] == 1
+
+        fake.failNext('PATCH', 429, path='/scale', count=2)
+        assert engine.patchDeploymentScale('app', NAMESPACE, {'spec': {'replicas': 3}}) is None       # retries are exhausted
+    finally:
+        fake.stop()
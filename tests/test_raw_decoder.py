@@ -0,0 +1,101 @@
+import json
+import time
+from types import SimpleNamespace
+from kubernetes import client
+
+from ProfilerKubeRC.KubePredicates import DESIRED_HASH_ANNOTATION
+from ProfilerKubeRC.KubeRawDecoder import KubeRawDecoder, KubeRawObject
+from ProfilerKubeRC.KubeSnapshot import KubeDeploymentSnapshot, LAST_APPLIED_ANNOTATION
+
+BENCHMARK_DEPLOYMENTS = 5000
+
+
+def buildDeploymentJson(name, resource_version):
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {
+            'name': name,
+            'namespace': 'bench',
+            'resourceVersion': resource_version,
+            'generation': 3,
+            'creationTimestamp': '2021-03-01T10:00:00Z',
+            'labels': {'app': name, 'team': 'profiler'},
+            'annotations': {DESIRED_HASH_ANNOTATION: 'abc', LAST_APPLIED_ANNOTATION: '{"kind": "Deployment"}'},
+            'managedFields': [{'manager': 'kubectl', 'operation': 'Update', 'apiVersion': 'apps/v1', 'time': '2021-03-01T10:00:00Z',
+                               'fieldsType': 'FieldsV1', 'fieldsV1': {'f:spec': {'f:replicas': {}, 'f:template': {'f:spec': {}}}}}]
+        },
+        'spec': {
+            'replicas': 2,
+            'selector': {'matchLabels': {'app': name}},
+            'strategy': {'type': 'RollingUpdate', 'rollingUpdate': {'maxSurge': '25%', 'maxUnavailable': '25%'}},
+            'template': {
+                'metadata': {'labels': {'app': name}},
+                'spec': {
+                    'containers': [{
+                        'name': name,
+                        'image': 'nginx:1',
+                        'env': [{'name': 'A', 'value': '1'}, {'name': 'B', 'value': 'two'}],
+                        'ports': [{'containerPort': 8080, 'protocol': 'TCP'}],
+                        'resources': {'limits': {'cpu': '500m', 'memory': '256Mi'}}
+                    }],
+                    'restartPolicy': 'Always'
+                }
+            }
+        },
+        'status': {
+            'replicas': 2,
+            'readyReplicas': 2,
+            'conditions': [{'type': 'Available', 'status': 'True', 'lastUpdateTime': '2021-03-01T10:00:00Z', 'reason': 'MinimumReplicasAvailable'}]
+        }
+    }
+
+
+def deserialize(data, model_type):
+    return client.ApiClient().deserialize(SimpleNamespace(data=data), model_type)
+
+
+def test_raw_and_model_objects_give_the_same_snapshot():
+    data = json.dumps(buildDeploymentJson('app', '10'))
+    raw = KubeRawObject(KubeRawDecoder.loads(data), 'V1Deployment')
+    model = deserialize(data, 'V1Deployment')
+    KubeDeploymentSnapshot.prune(raw)
+    KubeDeploymentSnapshot.prune(model)
+    assert 'managedFields' not in raw.raw['metadata'] and 'conditions' not in raw.raw['status']
+
+    raw_snapshot, model_snapshot = KubeDeploymentSnapshot.fromDeployment(raw), KubeDeploymentSnapshot.fromDeployment(model)
+    assert repr(raw_snapshot) == repr(model_snapshot) and raw_snapshot.env == model_snapshot.env == (('A', '1'), ('B', 'two'))
+    assert (raw.metadata.name, raw.metadata.namespace, raw.metadata.resource_version) == ('app', 'bench', '10')
+    assert KubeDeploymentSnapshot.buildDesiredStateHash(raw.toModel()) == raw_snapshot.template_hash
+    assert raw.toModel().spec.template.spec.containers[0].image == 'nginx:1'
+
+
+def test_watch_events_are_decoded_without_models():
+    decoder = KubeRawDecoder()
+    event = decoder.unmarshal_event(json.dumps({'type': 'MODIFIED', 'object': buildDeploymentJson('app', '11')}), 'V1Deployment')
+    assert isinstance(event['object'], KubeRawObject) and event['object'].metadata.resource_version == '11'
+    error = decoder.unmarshal_event(json.dumps({'type': 'ERROR', 'object': {'code': 410, 'message': 'too old'}}), 'V1Deployment')
+    assert error['object'] == error['raw_object'] == {'code': 410, 'message': 'too old'}
+    assert KubeRawDecoder.get_return_type(client.AppsV1Api.list_namespaced_deployment) == 'V1Deployment'
+
+
+def test_raw_decoding_of_large_list_is_faster_than_models():
+    data = json.dumps({
+        'apiVersion': 'apps/v1', 'kind': 'DeploymentList', 'metadata': {'resourceVersion': '5000'},
+        'items': [buildDeploymentJson('app-%d' % i, str(i)) for i in range(BENCHMARK_DEPLOYMENTS)]
+    }).encode('utf8')
+
+    started_at = time.perf_counter()
+    models = deserialize(data, 'V1DeploymentList')
+    model_snapshots = [KubeDeploymentSnapshot.fromDeployment(KubeDeploymentSnapshot.prune(item)) for item in models.items]
+    model_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    items, resource_version = KubeRawDecoder().decodeList(data, 'V1Deployment')
+    raw_snapshots = [KubeDeploymentSnapshot.fromDeployment(KubeDeploymentSnapshot.prune(item)) for item in items]
+    raw_seconds = time.perf_counter() - started_at
+
+    print("%d deployments: models %.3f s, raw %.3f s (%.1fx)" % (BENCHMARK_DEPLOYMENTS, model_seconds, raw_seconds, model_seconds / raw_seconds))
+    assert resource_version == '5000' and len(raw_snapshots) == len(model_snapshots) == BENCHMARK_DEPLOYMENTS
+    assert raw_snapshots[-1].template_hash == model_snapshots[-1].template_hash
+    assert raw_seconds < model_seconds
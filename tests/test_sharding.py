@@ -0,0 +1,116 @@
+import sys
+import time
+from dependency_injector import providers
+
+from ProfilerKubeRC.container import EngineContainer
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeEngine import KubeEngine
+from ProfilerKubeRC.KubeEngineSettings import KubeEngineSettings
+from ProfilerKubeRC.KubeSharding import KubeHashRing, KubeShardCoordinator
+
+from tests.fake_kube_api import FakeKubeApi, LEASES
+
+NAMESPACE = 'operator'
+KEYS = ['bench/app-%d' % i for i in range(300)]
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+def test_ring_splits_keys_and_moves_only_keys_of_new_member():
+    ring = KubeHashRing(['a', 'b', 'c'])
+    owners = {key: ring.getOwner(key) for key in KEYS}
+    counts = {member: list(owners.values()).count(member) for member in ring.getMembers()}
+    assert all(50 < count < 150 for count in counts.values())
+    assert KubeHashRing(['c', 'b', 'a']).getOwner(KEYS[0]) == owners[KEYS[0]]
+
+    bigger = KubeHashRing(['a', 'b', 'c', 'd'])
+    moved = [key for key in KEYS if bigger.getOwner(key) != owners[key]]
+    assert moved and all(bigger.getOwner(key) == 'd' for key in moved)
+    assert KubeHashRing([]).getOwner(KEYS[0]) is None
+
+
+def wireEngine(fake, environ=None):
+    engine_container = EngineContainer()
+    engine_container.config.engine_type.from_value('sync')
+    engine_container.kube_client.override(providers.Object(fake.createClient()))
+    engine_container.engine_settings.override(providers.Object(KubeEngineSettings(dict({'SHARD_GROUP': 'ops', 'SHARD_LEASE_DURATION': '1'}, **(environ or {})))))
+    engine_container.wire(modules=[sys.modules[__name__]])
+
+
+def test_coordinators_split_keys_and_rebalance_when_member_leaves():
+    fake = FakeKubeApi().start()
+    try:
+        wireEngine(fake, {'SHARD_RENEW_INTERVAL': '0.1'})
+        first, second = KubeShardCoordinator(NAMESPACE, 'first'), KubeShardCoordinator(NAMESPACE, 'second')
+        rebalances = []
+        first.addRebalanceHandler(lambda: rebalances.append(first.getMembers()))
+        first.join()
+        second.join()
+        assert first.getMembers() == ['first'] and second.getMembers() == ['first', 'second']
+        assert first.renew() and rebalances == [['first', 'second']]
+        assert not any(second.isOwned(key) for key in KEYS)                     # first has dropped keys of second before second takes them
+        assert 0 < sum(first.isOwned(key) for key in KEYS) < len(KEYS)
+        time.sleep(0.2)
+        assert second.renew() and second.getStats()['rebalances'] == 2
+        assert all(first.isOwned(key) != second.isOwned(key) for key in KEYS)
+        assert 0 < sum(first.isOwned(key) for key in KEYS) < len(KEYS)
+        assert fake.getObject(LEASES, NAMESPACE, 'ops-second')['spec']['holderIdentity'] == 'second'
+
+        second.renew()                                                  # the lease is replaced, not created again
+        assert first.renew() is False
+        time.sleep(1.2)                                                 # second doesn't renew its lease anymore
+        assert first.renew() and first.getMembers() == ['first']
+        assert all(first.isOwned(key) for key in KEYS)
+        assert first.getStats() == {'members': 1, 'renewals': 4, 'failed_renewals': 0, 'rebalances': 2, 'collected_leases': 0}
+        assert fake.getRequestCounts()[('create', LEASES)] == 2
+    finally:
+        fake.stop()
+
+
+def test_replica_drops_own_keys_when_its_lease_expires():
+    fake = FakeKubeApi().start()
+    try:
+        wireEngine(fake, {'SHARD_LEASE_DURATION': '2'})                        # the first renewals are in time even on a busy machine
+        first, second = KubeShardCoordinator(NAMESPACE, 'first'), KubeShardCoordinator(NAMESPACE, 'second')
+        first.join()
+        second.join()
+        first.renew()
+        fake.failNext('PUT', 500, count=2, path='/leases/ops-second$')            # second can't renew its lease for a while
+        second.renew()
+        assert second.getMembers() == ['first', 'second']                       # the lease isn't expired yet
+        time.sleep(2.2)
+        assert first.renew() and first.getMembers() == ['first']
+        assert second.renew() and second.getMembers() == ['first']
+        assert all(first.isOwned(key) and not second.isOwned(key) for key in KEYS)
+
+        assert second.renew() and second.getMembers() == ['first', 'second']    # the lease is renewed again
+        assert second.getStats()['failed_renewals'] == 2
+    finally:
+        fake.stop()
+
+
+def test_leases_are_deleted_when_replicas_leave():
+    fake = FakeKubeApi().start()
+    try:
+        wireEngine(fake, {'SHARD_LEASE_RETENTION': '0'})
+        first, second, third = (KubeShardCoordinator(NAMESPACE, identity) for identity in ('first', 'second', 'third'))
+        for coordinator in (first, second, third):
+            coordinator.join()
+        assert first.renew() and first.getMembers() == ['first', 'second', 'third']
+
+        second.leave()                                                          # f.e. the pod is stopped
+        assert fake.getObject(LEASES, NAMESPACE, 'ops-second') is None
+        second.leave()                                                          # the membership task leaves after the service
+        assert first.renew() and first.getMembers() == ['first', 'third']       # without waiting for the expiration
+
+        time.sleep(1.2)                                                         # third has gone without deleting its lease
+        assert first.renew() and first.getMembers() == ['first']
+        assert fake.getObject(LEASES, NAMESPACE, 'ops-third') is None
+        assert first.getStats()['collected_leases'] == 1
+        assert fake.getRequestCounts()[('delete', LEASES)] == 2
+    finally:
+        fake.stop()
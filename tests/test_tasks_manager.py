@@ -0,0 +1,132 @@
+import asyncio
+import pytest
+import sys
+import threading
+from dependency_injector import providers
+
+from ProfilerKubeRC.container import EngineContainer, TasksContainer
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeEventListener import KubeCmEventListener
+from ProfilerKubeRC.TasksManager import TasksManager
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('CRITICAL')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+def test_failed_task_is_restarted():
+    tasks_manager = TasksManager(backoff_base=0.01, backoff_max=0.02)
+    calls = []
+
+    def task():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError('failure %d' % len(calls))
+
+    info = tasks_manager.addTask(task, name='flaky')
+    tasks_manager.runTasks()
+    assert len(calls) == 3
+    assert info.restarts == 2
+    assert info.last_error == repr(RuntimeError('failure 2'))
+    assert not info.running
+
+
+def test_capacity_matches_registered_tasks():
+    tasks_manager = TasksManager()
+    barrier = threading.Barrier(20, timeout=5)
+    for i in range(20):
+        tasks_manager.addTask(barrier.wait, restart=False)
+    tasks_manager.runTasks()
+    assert not barrier.broken
+    assert all(info.last_error is None for info in tasks_manager.getTasksInfo())
+
+
+def test_task_added_after_start_is_run():
+    tasks_manager = TasksManager()
+    added = threading.Event()
+    started = threading.Event()
+
+    def first():
+        tasks_manager.addTask(started.set, name='second')
+        added.set()
+
+    tasks_manager.addTask(first)
+    tasks_manager.runTasks()
+    assert added.is_set() and started.wait(timeout=5)
+    assert [info.name for info in tasks_manager.getTasksInfo()] == ['test_task_added_after_start_is_run.<locals>.first', 'second']
+
+
+def test_coroutine_task_is_supervised_in_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    tasks_manager = TasksManager(backoff_base=0.01, backoff_max=0.02)
+    calls = []
+
+    async def task(name):
+        await asyncio.sleep(0.01)
+        calls.append(threading.current_thread())
+        if len(calls) < 2:
+            raise RuntimeError('failure of %s' % name)
+
+    infos = [tasks_manager.addTask(task, ('watch-%d' % i,), name='watch-%d' % i, runner=lambda coroutine: asyncio.run_coroutine_threadsafe(coroutine, loop))
+             for i in range(2)]
+    threads = threading.active_count()
+    tasks_manager.runTasks()
+    assert threading.active_count() == threads
+    assert len(calls) == 3 and len(set(calls)) == 1
+    assert sorted(info.restarts for info in infos) == [0, 1]
+    assert not any(info.running for info in infos)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+class FailingWatchEngine:
+    """
+    Engine which watch fails once, in the calling thread or in its own event loop like the asyncio engine
+    """
+
+    def __init__(self, is_async):
+        self._is_async = is_async
+        self.watches = 0
+        self.threads = []
+        self._loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self.loop_thread.start()
+
+    def isAsync(self):
+        return self._is_async
+
+    def runCoroutine(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def watchConfigMaps(self, namespace, callback=None, field_selector=None):
+        self.watches += 1
+        self.threads.append(threading.current_thread())
+        if self.watches == 1:
+            raise RuntimeError('watch failure')
+
+    async def watchConfigMapsAsync(self, namespace, callback=None, field_selector=None):
+        await asyncio.sleep(0.01)
+        self.watchConfigMaps(namespace, callback, field_selector)
+
+
+@pytest.mark.parametrize('is_async', [False, True])
+def test_failed_watcher_is_restarted(is_async):
+    engine = FailingWatchEngine(is_async)
+    engine_container = EngineContainer()
+    engine_container.kube_engine.override(providers.Object(engine))
+    engine_container.wire(modules=[sys.modules[__name__]])
+    tasks_manager = TasksManager(backoff_base=0.01, backoff_max=0.02)
+    tasks_container = TasksContainer()
+    tasks_container.tasks_manager.override(providers.Object(tasks_manager))
+    tasks_container.wire(modules=[sys.modules[__name__]])
+    info = KubeCmEventListener('default', 'config').addWatcherTask(name='configmaps/default')
+    tasks_manager.runTasks()
+    assert engine.watches == 2
+    if is_async:                                                    # the watch is supervised in the event loop without a thread
+        assert engine.threads == [engine.loop_thread, engine.loop_thread]
+    else:
+        assert engine.threads[0].name == 'configmaps/default'
+    assert info.restarts == 1
+    assert info.last_error == repr(RuntimeError('watch failure'))
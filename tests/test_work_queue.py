@@ -0,0 +1,80 @@
+import sys
+import threading
+import time
+
+from ProfilerKubeRC.logger import LoggerContainer
+from ProfilerKubeRC.KubeWorkQueue import KubeWorkQueue
+
+
+def setup_module():
+    logger_container = LoggerContainer()
+    logger_container.config.loglevel.from_value('ERROR')
+    logger_container.wire(modules=[sys.modules[__name__]])
+
+
+def startWorkers(queue, count):
+    workers = [threading.Thread(target=queue.runWorker, daemon=True) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stopWorkers(queue, workers):
+    queue.shutdown()
+    for worker in workers:
+        worker.join(timeout=5)
+
+
+def waitProcessed(queue, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while queue.getStats()['processed'] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_pending_items_of_the_same_slot_are_coalesced():
+    queue = KubeWorkQueue()
+    handled = []
+    for i in range(5):
+        queue.add('ns/a', 'event', handled.append, i)
+    queue.add('ns/a', 'config', handled.append, 'config')
+    workers = startWorkers(queue, 2)
+    waitProcessed(queue, 1)
+    stopWorkers(queue, workers)
+    assert handled == [4, 'config']
+    stats = queue.getStats()
+    assert stats['coalesced'] == 4
+    assert stats['depth'] == 0
+
+
+def test_key_is_never_processed_in_parallel():
+    queue = KubeWorkQueue()
+    running = []
+    overlaps = []
+    started = threading.Event()
+
+    def task(i):
+        running.append(i)
+        overlaps.append(len(running) > 1)
+        started.set()
+        time.sleep(0.05)
+        running.remove(i)
+
+    workers = startWorkers(queue, 4)
+    queue.add('ns/a', 'event', task, 1)
+    started.wait(timeout=5)
+    queue.add('ns/a', 'event', task, 2)            # added while the key is processed
+    waitProcessed(queue, 2)
+    stopWorkers(queue, workers)
+    assert overlaps == [False, False]
+
+
+def test_different_keys_are_processed_in_parallel():
+    queue = KubeWorkQueue()
+    barrier = threading.Barrier(3, timeout=5)
+    for key in ('ns/a', 'ns/b', 'ns/c'):
+        queue.add(key, 'event', barrier.wait)
+    workers = startWorkers(queue, 3)
+    waitProcessed(queue, 3)
+    stopWorkers(queue, workers)
+    assert not barrier.broken
+    assert queue.getStats()['processed'] == 3